@@ -1,8 +1,8 @@
 import sqlalchemy as sa
 
 
-def create_connection_postgre(server, database, username, password, port):
+def create_connection_postgre(server, database, username, password, port, pool_size=5, max_overflow=10):
     conn = f'postgresql+psycopg2://{username}:{password}@{server}:{port}/{database}'
-    return sa.create_engine(conn)
+    return sa.create_engine(conn, pool_size=pool_size, max_overflow=max_overflow)
 
 
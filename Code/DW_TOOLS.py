@@ -1,29 +1,1820 @@
+import hashlib
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
 import pandas as pd
+import sqlalchemy as sa
 
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
 
-def merge_input(left, right, left_on, right_on, surrogate_key, suff):
-    dict_na = right.query(f"{surrogate_key} == -3").to_dict('index')
 
-    df = (
-        left.
-            merge(right, how="left", left_on=left_on, right_on=right_on, suffixes=suff).
-            fillna(dict_na[list(dict_na)[0]])
+def create_key_index(dim, natural_key, surrogate_key):
+    """
+    Cria um índice ordenado chave natural -> surrogate key de uma dimensão
+
+    parâmetros:
+    dim -- pandas.DataFrame da dimensão;
+    natural_key -- coluna da chave natural (ex.: cd_cliente);
+    surrogate_key -- coluna da surrogate key (ex.: sk_cliente);
+
+    return:
+    key_index -- tupla (chaves ordenadas, surrogate keys int32);
+    """
+    index = (
+        dim.
+            filter([natural_key, surrogate_key]).
+            drop_duplicates(subset=natural_key, keep='last').
+            sort_values(natural_key)
+    )
+
+    return index[natural_key].to_numpy(), index[surrogate_key].to_numpy(dtype='int32')
+
+
+def share_arrays(arrays):
+    """
+    Copia arrays numpy para blocos de memória compartilhada, que outros
+    processos leem sem serialização
+
+    parâmetros:
+    arrays -- dicionário nome -> numpy.ndarray (dtypes numéricos ou datetime);
+
+    return:
+    blocks -- lista de SharedMemory criados, liberados com release_shared;
+    descriptor -- dicionário nome -> (bloco, shape, dtype) usado por attach_arrays;
+    """
+    blocks = []
+    descriptor = {}
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        if array.dtype.hasobject:
+            raise TypeError(f'a coluna {name} é do tipo object e não pode ser compartilhada')
+
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        descriptor[name] = (block.name, array.shape, array.dtype.str)
+
+    return blocks, descriptor
+
+
+def attach_arrays(descriptor):
+    """
+    Abre, somente leitura, os arrays criados por share_arrays em outro
+    processo. Os arrays apontam direto para a memória compartilhada.
+
+    parâmetros:
+    descriptor -- retorno de share_arrays;
+
+    return:
+    blocks -- lista de SharedMemory abertos, que devem viver enquanto os
+              arrays forem usados;
+    arrays -- dicionário nome -> numpy.ndarray;
+    """
+    blocks = []
+    arrays = {}
+    for name, (block_name, shape, dtype) in descriptor.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        array = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        array.flags.writeable = False
+        blocks.append(block)
+        arrays[name] = array
+
+    return blocks, arrays
+
+
+def release_shared(blocks, unlink=False):
+    """
+    Fecha os blocos de memória compartilhada
+
+    parâmetros:
+    blocks -- lista de SharedMemory;
+    unlink -- remove os blocos do sistema (apenas no processo que os criou);
+    """
+    for block in blocks:
+        block.close()
+        if unlink:
+            block.unlink()
+
+
+def lookup_key(values, key_index, default=-3):
+    """
+    Traduz chaves naturais em surrogate keys por busca binária no índice.
+    Chaves não encontradas recebem o membro desconhecido.
+
+    parâmetros:
+    values -- array ou pandas.Series com as chaves naturais;
+    key_index -- retorno de create_key_index;
+    default -- surrogate key das chaves não encontradas;
+
+    return:
+    numpy.ndarray int32;
+    """
+    keys, surrogate_keys = key_index
+    values = np.asarray(values)
+    if len(keys) == 0:
+        return np.full(len(values), default, dtype='int32')
+
+    position = np.minimum(np.searchsorted(keys, values), len(keys) - 1)
+    found = keys[position] == values
+
+    return np.where(found, surrogate_keys[position], default).astype('int32')
+
+
+def assign_surrogate_key(left, left_on, key_index, surrogate_key, default=-3):
+    """
+    Grava em left a coluna surrogate_key resolvida a partir de left_on, sem
+    copiar as demais colunas do dataframe
+
+    parâmetros:
+    left -- pandas.DataFrame;
+    left_on -- coluna com a chave natural;
+    key_index -- retorno de create_key_index;
+    surrogate_key -- nome da coluna gerada;
+    default -- surrogate key das chaves não encontradas;
+
+    return:
+    left -- pandas.DataFrame;
+    """
+    left[surrogate_key] = lookup_key(left[left_on], key_index, default=default)
+
+    return left
+
+
+def asof_join(left, right, left_on, right_on, left_time, columns, start='dt_inicio', end='dt_fim', default=None):
+    """
+    Resolve, para cada linha de left, a versão de right vigente em left_time
+    (start <= left_time < end, ou end nulo para a versão ativa). As versões
+    são ordenadas por (chave, start) e a busca é feita com merge_asof, sem
+    produto cartesiano entre as versões. Linhas sem versão vigente ou com
+    chave nula não são descartadas: recebem os valores de default (ex.: o
+    membro desconhecido). As chaves são comparadas como int64, então chaves
+    float (coluna inteira com nulos lida pelo pandas) também são aceitas.
+
+    parâmetros:
+    left -- pandas.DataFrame;
+    right -- pandas.DataFrame da dimensão com as versões;
+    left_on -- coluna chave de left;
+    right_on -- coluna chave de right;
+    left_time -- coluna de data de left;
+    columns -- colunas de right a trazer para o resultado;
+    start -- coluna de início de vigência em right;
+    end -- coluna de fim de vigência em right;
+    default -- dicionário coluna -> valor das linhas sem versão vigente
+               (ex.: {'sk_produto': -3});
+
+    return:
+    pandas.DataFrame com as linhas de left, na mesma ordem, e as colunas columns;
+    """
+    default = default or {}
+    left = left.reset_index(drop=True)
+
+    versions = (
+        right.
+        filter([right_on, start, end, *columns]).
+        assign(**{
+            start: lambda x: pd.to_datetime(x[start]),
+            end: lambda x: pd.to_datetime(x[end])}).
+        dropna(subset=[right_on, start]).
+        astype({right_on: 'int64'}).
+        sort_values(start)
     )
 
-    return df
+    keys = (
+        pd.DataFrame({
+            left_on: left[left_on],
+            left_time: pd.to_datetime(left[left_time]),
+            '__row': np.arange(len(left))}).
+        dropna(subset=[left_on, left_time]).
+        astype({left_on: 'int64'}).
+        sort_values(left_time)
+    )
+
+    matched = pd.merge_asof(
+        keys,
+        versions,
+        left_on=left_time,
+        right_on=start,
+        left_by=left_on,
+        right_by=right_on,
+        direction='backward'
+    )
+    valid = matched[start].notna() & (matched[end].isna() | (matched[left_time] < matched[end]))
+
+    resolved = (
+        matched.
+        loc[valid, ['__row', *columns]].
+        set_index('__row').
+        reindex(np.arange(len(left)))
+    )
+    if default:
+        resolved = resolved.fillna(value=default).astype({col: versions[col].dtype for col in default})
+
+    return pd.concat([left, resolved.reset_index(drop=True)], axis=1)
+
+
+def create_stage(conn_input, conn_output, schema_in, table, stg_name, tbl_exists, method='auto', buffer_size=8192,
+                 watermark=None, full_refresh=False, fingerprint=False, snapshot=False, dtype=None):
+    """
+    Cria a stage de uma tabela de origem
+
+    parâmetros:
+    conn_input -- conexão criada via SqlAlchemy com o servidor de origem;
+    conn_output -- conexão criada via SqlAlchemy com o servidor do DW;
+    schema_in -- schema da tabela de origem;
+    table -- nome da tabela de origem;
+    stg_name -- nome da stage;
+    tbl_exists -- if_exists (append, replace, fail);
+    method -- 'auto', 'server' (cópia dentro do banco), 'copy' (COPY em streaming)
+              ou 'pandas' (read_table + to_sql). 'auto' usa 'server' quando origem e
+              destino são o mesmo banco e 'copy' caso contrário;
+    buffer_size -- tamanho em bytes dos blocos lidos no modo 'copy';
+    watermark -- coluna crescente da origem (ex.: id_venda). Com tbl_exists='append'
+                 apenas as linhas a partir do último valor carregado são copiadas.
+                 As linhas do último valor são apagadas da stage e lidas de novo,
+                 então linhas desse valor gravadas na origem depois da última
+                 carga (ex.: itens de uma venda) não são perdidas. Com a coluna
+                 em dtype, a comparação usa o tipo declarado. Uma stage existente
+                 sem watermark registrado é recriada. A stage é mantida
+                 LOGGED, para não perder linhas já cobertas pelo watermark em
+                 uma queda do Postgres;
+    full_refresh -- recria a stage inteira e reinicia o watermark;
+    fingerprint -- compara a assinatura da origem (quantidade de linhas, maior
+                   xmin e layout declarado em dtype) com a da última carga e não
+                   copia a tabela se ela não mudou;
+    snapshot -- grava um snapshot parquet da stage no cache local (ver cache_dir);
+    dtype -- dicionário coluna -> tipo SqlAlchemy. Quando informado, a stage é
+             criada apenas com essas colunas, convertidas na origem para os tipos
+             declarados;
+
+    return:
+    True se a stage foi copiada, False se a cópia foi ignorada;
+    """
+    if full_refresh:
+        tbl_exists = 'replace'
+
+    create_control_table(conn_output)
+
+    source_fingerprint = None
+    if fingerprint:
+        source_fingerprint = (
+            f'{table_fingerprint(conn_input, schema_in, table)}:{layout_fingerprint(conn_output.dialect, dtype)}'
+        )
+        if (not full_refresh
+                and table_exists(conn_output, 'stage', stg_name)
+                and read_fingerprint(conn_output, stg_name) == source_fingerprint):
+            return False
+
+    where = None
+    before = []
+    after = [register_stage_sql(stg_name, source_fingerprint)]
+    if watermark is not None:
+        last_value = None
+        if tbl_exists == 'append' and table_exists(conn_output, 'stage', stg_name):
+            last_value = read_watermark(conn_output, stg_name)
+            if last_value is None:
+                # stage criada sem watermark (ex.: antes do modo incremental): sem
+                # saber o que já foi copiado, ela é recriada em vez de duplicada
+                tbl_exists = 'replace'
+            elif is_unlogged(conn_output, 'stage', stg_name):
+                # o watermark sobrevive a uma queda do Postgres, uma stage UNLOGGED não
+                before.append(f'ALTER TABLE "stage"."{stg_name}" SET LOGGED')
+        if last_value is not None:
+            where, boundary = watermark_filters(conn_input.dialect, watermark, last_value, dtype=dtype)
+            before.append(f'DELETE FROM "stage"."{stg_name}" WHERE {boundary}')
+        after.append(update_watermark_sql(stg_name, watermark, where))
+
+    if method == 'auto':
+        method = 'server' if same_database(conn_input, conn_output) else 'copy'
+
+    if method == 'server':
+        server_stage(
+            conn=conn_output,
+            schema_in=schema_in,
+            table=table,
+            stg_name=stg_name,
+            tbl_exists=tbl_exists,
+            where=where,
+            before=before,
+            after=after,
+            dtype=dtype,
+            unlogged=watermark is None
+        )
+    elif method == 'copy':
+        copy_stage(
+            conn_input=conn_input,
+            conn_output=conn_output,
+            schema_in=schema_in,
+            table=table,
+            stg_name=stg_name,
+            tbl_exists=tbl_exists,
+            buffer_size=buffer_size,
+            where=where,
+            before=before,
+            after=after,
+            dtype=dtype,
+            unlogged=watermark is None
+        )
+    else:
+        pandas_stage(
+            conn_input=conn_input,
+            conn_output=conn_output,
+            schema_in=schema_in,
+            table=table,
+            stg_name=stg_name,
+            tbl_exists=tbl_exists,
+            where=where,
+            before=before,
+            after=after,
+            dtype=dtype,
+            unlogged=watermark is None
+        )
+
+    if snapshot:
+        snapshot_table(conn_output, 'stage', stg_name)
+
+    return True
+
+
+def select_query(dialect, schema_in, table, dtype=None, where=None):
+    """
+    Monta o SELECT da tabela de origem. Com dtype cada coluna é convertida para o
+    tipo declarado; colunas numéricas aceitam vírgula como separador decimal.
+
+    parâmetros:
+    dialect -- dialeto SqlAlchemy usado para compilar os tipos;
+    schema_in -- schema da tabela de origem;
+    table -- nome da tabela de origem;
+    dtype -- dicionário coluna -> tipo SqlAlchemy;
+    where -- filtro aplicado na origem;
+
+    return:
+    query -- str;
+    """
+    if dtype is None:
+        columns = '*'
+    else:
+        columns = ', '.join(
+            f'{cast_column(dialect, column, sa_type)} AS "{column}"' for column, sa_type in dtype.items()
+        )
+
+    query = f'SELECT {columns} FROM "{schema_in}"."{table}"'
+    if where is not None:
+        query = f'{query} WHERE {where}'
+
+    return query
+
+
+def cast_column(dialect, column, sa_type):
+    """
+    Monta a conversão de uma coluna da origem para o tipo declarado. Colunas
+    numéricas aceitam vírgula como separador decimal.
+
+    parâmetros:
+    dialect -- dialeto SqlAlchemy usado para compilar o tipo;
+    column -- nome da coluna;
+    sa_type -- tipo SqlAlchemy (classe ou instância);
+
+    return:
+    expressão sql -- str;
+    """
+    sa_type = sa_type() if isinstance(sa_type, type) else sa_type
+    if isinstance(sa_type, sa.Numeric):
+        expression = f'REPLACE(NULLIF(TRIM("{column}"::TEXT), \'\'), \',\', \'.\')'
+    else:
+        expression = f'"{column}"'
+
+    return f'CAST({expression} AS {sa_type.compile(dialect=dialect)})'
+
+
+def watermark_filters(dialect, column, last_value, dtype=None):
+    """
+    Monta os filtros do watermark: as linhas da origem a partir do último
+    valor carregado e as linhas desse valor na stage, que são lidas de novo.
+    Quando a coluna está em dtype, a coluna e o valor são convertidos para o
+    tipo declarado e comparados nesse tipo (ex.: numericamente para ids
+    gravados como texto na origem, onde '10000' < '9999').
+
+    parâmetros:
+    dialect -- dialeto SqlAlchemy usado para compilar o tipo;
+    column -- coluna do watermark;
+    last_value -- último valor carregado, como gravado em controle_carga;
+    dtype -- dicionário coluna -> tipo SqlAlchemy;
+
+    return:
+    tupla (filtro da origem, filtro da stage);
+    """
+    if dtype is None or column not in dtype:
+        value = f"'{last_value}'"
+        return f'"{column}" >= {value}', f'"{column}" = {value}'
+
+    sa_type = dtype[column]
+    sa_type = sa_type() if isinstance(sa_type, type) else sa_type
+    type_name = sa_type.compile(dialect=dialect)
+    value = f"CAST('{last_value}' AS {type_name})"
+
+    return f'{cast_column(dialect, column, sa_type)} >= {value}', f'CAST("{column}" AS {type_name}) = {value}'
+
+
+def swap_stage_sql(stg_name):
+    """
+    Monta os comandos que trocam a stage pela tabela sombra "<stg_name>_new":
+    atualiza as estatísticas da sombra, remove a stage antiga e renomeia a
+    sombra. Executados em uma única transação, os leitores nunca veem a stage
+    vazia ou parcialmente carregada.
+
+    parâmetros:
+    stg_name -- nome da stage;
+
+    return:
+    lista de comandos sql;
+    """
+    return [
+        f'ANALYZE "stage"."{stg_name}_new"',
+        f'DROP TABLE IF EXISTS "stage"."{stg_name}"',
+        f'ALTER TABLE "stage"."{stg_name}_new" RENAME TO "{stg_name}"'
+    ]
+
+
+def pandas_stage(conn_input, conn_output, schema_in, table, stg_name, tbl_exists, where=None, before=(), after=(),
+                 dtype=None, unlogged=True):
+    """
+    Cria a stage lendo a origem com pandas e gravando com to_sql. No modo
+    replace a carga é feita em uma tabela sombra (UNLOGGED com unlogged) que
+    substitui a stage ao final.
+
+    parâmetros:
+    conn_input -- conexão criada via SqlAlchemy com o servidor de origem;
+    conn_output -- conexão criada via SqlAlchemy com o servidor do DW;
+    schema_in -- schema da tabela de origem;
+    table -- nome da tabela de origem;
+    stg_name -- nome da stage;
+    tbl_exists -- if_exists (append, replace, fail);
+    where -- filtro aplicado na origem;
+    before -- comandos executados antes da cópia, na mesma transação (apenas no
+              modo append);
+    after -- comandos executados na mesma transação após a cópia;
+    dtype -- dicionário coluna -> tipo SqlAlchemy;
+    unlogged -- cria a tabela sombra como UNLOGGED;
+    """
+    exists = table_exists(conn_output, 'stage', stg_name)
+    if exists and tbl_exists == 'fail':
+        raise ValueError(f"Table '{stg_name}' already exists.")
+
+    stage = pd.read_sql_query(select_query(conn_input.dialect, schema_in, table, dtype=dtype, where=where), conn_input)
+
+    if exists and tbl_exists == 'append':
+        with conn_output.begin() as transaction:
+            for sql in before:
+                transaction.execute(sql)
+            stage.to_sql(name=stg_name, con=transaction, schema='stage', if_exists='append', index=False, dtype=dtype)
+            for sql in after:
+                transaction.execute(sql)
+        return
+
+    shadow = f'{stg_name}_new'
+    stage.head(0).to_sql(name=shadow, con=conn_output, schema='stage', if_exists='replace', index=False,
+                         dtype=dtype)
+    if unlogged:
+        conn_output.execute(f'ALTER TABLE "stage"."{shadow}" SET UNLOGGED')
+    stage.to_sql(name=shadow, con=conn_output, schema='stage', if_exists='append', index=False, dtype=dtype)
+
+    with conn_output.begin() as transaction:
+        for sql in swap_stage_sql(stg_name) + list(after):
+            transaction.execute(sql)
+
+
+def server_stage(conn, schema_in, table, stg_name, tbl_exists, where=None, before=(), after=(), dtype=None,
+                 unlogged=True):
+    """
+    Cria a stage dentro do próprio banco, sem trafegar as linhas pelo Python.
+    No modo replace a cópia é feita em uma tabela sombra (UNLOGGED com
+    unlogged) que substitui a stage na mesma transação.
+
+    parâmetros:
+    conn -- conexão criada via SqlAlchemy com o servidor do DW;
+    schema_in -- schema da tabela de origem;
+    table -- nome da tabela de origem;
+    stg_name -- nome da stage;
+    tbl_exists -- if_exists (append, replace, fail);
+    where -- filtro aplicado na origem;
+    before -- comandos executados antes da cópia, na mesma transação (apenas no
+              modo append);
+    after -- comandos executados na mesma transação após a cópia;
+    dtype -- dicionário coluna -> tipo SqlAlchemy;
+    unlogged -- cria a tabela sombra como UNLOGGED;
+    """
+    exists = table_exists(conn, 'stage', stg_name)
+    if exists and tbl_exists == 'fail':
+        raise ValueError(f"Table '{stg_name}' already exists.")
+
+    query = select_query(conn.dialect, schema_in, table, dtype=dtype, where=where)
+
+    with conn.begin() as transaction:
+        if exists and tbl_exists == 'append':
+            for sql in before:
+                transaction.execute(sql)
+            transaction.execute(f'INSERT INTO "stage"."{stg_name}" {query}')
+        else:
+            transaction.execute(f'DROP TABLE IF EXISTS "stage"."{stg_name}_new"')
+            persistence = 'UNLOGGED' if unlogged else ''
+            transaction.execute(f'CREATE {persistence} TABLE "stage"."{stg_name}_new" AS {query}')
+            for sql in swap_stage_sql(stg_name):
+                transaction.execute(sql)
+        for sql in after:
+            transaction.execute(sql)
+
+
+def copy_stage(conn_input, conn_output, schema_in, table, stg_name, tbl_exists, buffer_size=8192, where=None, before=(),
+               after=(), dtype=None, unlogged=True):
+    """
+    Cria a stage copiando a tabela de origem via COPY TO STDOUT / COPY FROM STDIN,
+    sem materializar as linhas em memória. No modo replace a cópia é feita em uma
+    tabela sombra (UNLOGGED com unlogged) que substitui a stage na transação do
+    COPY.
+
+    parâmetros:
+    conn_input -- conexão criada via SqlAlchemy com o servidor de origem;
+    conn_output -- conexão criada via SqlAlchemy com o servidor do DW;
+    schema_in -- schema da tabela de origem;
+    table -- nome da tabela de origem;
+    stg_name -- nome da stage;
+    tbl_exists -- if_exists (append, replace, fail);
+    buffer_size -- tamanho em bytes dos blocos lidos do pipe;
+    where -- filtro aplicado na origem;
+    before -- comandos executados antes da cópia, na mesma transação (apenas no
+              modo append);
+    after -- comandos executados na mesma transação após a cópia;
+    dtype -- dicionário coluna -> tipo SqlAlchemy;
+    unlogged -- cria a tabela sombra como UNLOGGED;
+    """
+    if dtype is None:
+        source = sa.Table(table, sa.MetaData(), schema=schema_in, autoload_with=conn_input)
+        columns = [sa.Column(column.name, column.type) for column in source.columns]
+    else:
+        columns = [sa.Column(column, sa_type) for column, sa_type in dtype.items()]
+    exists = table_exists(conn_output, 'stage', stg_name)
+    if exists and tbl_exists == 'fail':
+        raise ValueError(f"Table '{stg_name}' already exists.")
+
+    if exists and tbl_exists == 'append':
+        target = stg_name
+        before = list(before)
+    else:
+        target = f'{stg_name}_new'
+        shadow = sa.Table(target, sa.MetaData(), *columns, schema='stage', prefixes=['UNLOGGED'] if unlogged else [])
+        before = [
+            f'DROP TABLE IF EXISTS "stage"."{target}"',
+            str(sa.schema.CreateTable(shadow).compile(dialect=conn_output.dialect))
+        ]
+        after = swap_stage_sql(stg_name) + list(after)
+
+    if where is None and dtype is None:
+        copy_from = f'COPY "{schema_in}"."{table}" TO STDOUT'
+    else:
+        copy_from = f'COPY ({select_query(conn_input.dialect, schema_in, table, dtype=dtype, where=where)}) TO STDOUT'
+
+    stream_copy(
+        conn_input=conn_input,
+        conn_output=conn_output,
+        copy_from=copy_from,
+        copy_to=f'COPY "stage"."{target}" FROM STDIN',
+        buffer_size=buffer_size,
+        before=before,
+        after=after
+    )
+
+
+def stream_copy(conn_input, conn_output, copy_from, copy_to, buffer_size=8192, before=(), after=()):
+    """
+    Liga um COPY ... TO STDOUT em conn_input a um COPY ... FROM STDIN em conn_output
+    através de um pipe do sistema operacional, mantendo o uso de memória limitado
+
+    parâmetros:
+    conn_input -- conexão criada via SqlAlchemy com o servidor de origem;
+    conn_output -- conexão criada via SqlAlchemy com o servidor de destino;
+    copy_from -- comando COPY ... TO STDOUT;
+    copy_to -- comando COPY ... FROM STDIN;
+    buffer_size -- tamanho em bytes dos blocos lidos do pipe;
+    before -- comandos executados em conn_output na transação do COPY, antes dele;
+    after -- comandos executados em conn_output na mesma transação do COPY;
+    """
+    raw_input = conn_input.raw_connection()
+    raw_output = conn_output.raw_connection()
+    cursor = raw_output.cursor()
+    errors = []
+    producer = None
+    try:
+        for sql in before:
+            cursor.execute(sql)
+
+        fd_read, fd_write = os.pipe()
+
+        def produce():
+            try:
+                with os.fdopen(fd_write, 'wb') as pipe_write:
+                    raw_input.cursor().copy_expert(copy_from, pipe_write)
+            except Exception as error:
+                errors.append(error)
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        with os.fdopen(fd_read, 'rb') as pipe_read:
+            cursor.copy_expert(copy_to, pipe_read, size=buffer_size)
+        producer.join()
+        if errors:
+            raise errors[0]
+        for sql in after:
+            cursor.execute(sql)
+        raw_output.commit()
+    except Exception:
+        raw_output.rollback()
+        raise
+    finally:
+        if producer is not None:
+            producer.join()
+        raw_input.close()
+        raw_output.close()
+
+
+def copy_sql(schema, table_name, columns):
+    """
+    Monta o COPY ... FROM STDIN em CSV usado pelas cargas de dataframes.
+    Nulos são gravados como \\N para não se confundirem com strings vazias.
+    """
+    return (
+        f'COPY "{schema}"."{table_name}" ("{concat_cols(list(columns))}") '
+        "FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+    )
+
+
+def prepare_copy_frame(df, dtype=None):
+    """
+    Ajusta as colunas do dataframe aos tipos declarados antes do COPY.
+    Colunas inteiras que viraram float por causa de nulos voltam a ser
+    inteiras (Int64), evitando valores como 1.0 em colunas INTEGER.
+
+    parâmetros:
+    df -- pandas.DataFrame;
+    dtype -- dicionário coluna -> tipo SqlAlchemy (classe ou instância);
+
+    return:
+    pandas.DataFrame;
+    """
+    integers = [
+        col for col, type_ in (dtype or {}).items()
+        if col in df.columns
+        and issubclass(type_ if isinstance(type_, type) else type(type_), sa.types.Integer)
+        and pd.api.types.is_float_dtype(df[col])
+    ]
+
+    return df.astype({col: 'Int64' for col in integers}) if integers else df
+
+
+def copy_dataframe(cursor, df, schema, table_name, chunksize=100000):
+    """
+    Grava o dataframe em uma tabela existente via COPY FROM STDIN, em blocos
+    de chunksize linhas
+
+    parâmetros:
+    cursor -- cursor psycopg2;
+    df -- pandas.DataFrame;
+    schema -- schema da tabela;
+    table_name -- nome da tabela;
+    chunksize -- quantidade de linhas enviadas por COPY;
+    """
+    sql = copy_sql(schema, table_name, df.columns)
+    for start in range(0, len(df), chunksize):
+        buffer = io.StringIO()
+        df.iloc[start:start + chunksize].to_csv(buffer, index=False, header=False, na_rep='\\N')
+        buffer.seek(0)
+        cursor.copy_expert(sql, buffer)
+
+
+def update_table(connection, df, schema, table_name, key, where=None, dtype=None):
+    """
+    Atualiza em lote uma tabela do DW a partir de um dataframe. As linhas são
+    enviadas para uma tabela temporária com um único COPY e aplicadas com um
+    único UPDATE ... FROM. Todas as colunas de df diferentes de key são
+    atualizadas.
+
+    parâmetros:
+    connection -- conexão SqlAlchemy (ex.: aberta com conn.begin()). A tabela
+                  temporária é descartada no commit dessa transação;
+    df -- pandas.DataFrame com a chave e os novos valores;
+    schema -- schema da tabela;
+    table_name -- nome da tabela;
+    key -- coluna usada para casar as linhas (ex.: cd_loja);
+    where -- filtro adicional da tabela de destino, referenciada pelo alias dst
+             (ex.: 'dst."fl_ativo" = 1');
+    dtype -- dicionário coluna -> tipo SqlAlchemy da tabela, usado para ajustar
+             as colunas antes do COPY (prepare_copy_frame);
+
+    return:
+    quantidade de linhas atualizadas;
+    """
+    if len(df) == 0:
+        return 0
+
+    temp_name = f'tmp_{table_name}'
+    columns = [col for col in df.columns if col != key]
+    set_clause = ', '.join(f'"{col}" = src."{col}"' for col in columns)
+    where_clause = "" if where is None else f"AND ({where})"
+
+    connection.execute(f'DROP TABLE IF EXISTS "pg_temp"."{temp_name}"')
+    connection.execute(
+        f'CREATE TEMP TABLE "{temp_name}" ON COMMIT DROP AS '
+        f'SELECT "{concat_cols([key, *columns])}" FROM "{schema}"."{table_name}" WITH NO DATA'
+    )
+    copy_dataframe(connection.connection.cursor(), prepare_copy_frame(df.filter([key, *columns]), dtype), 'pg_temp',
+                   temp_name)
+
+    result = connection.execute(
+        f'UPDATE "{schema}"."{table_name}" AS dst SET {set_clause} '
+        f'FROM "pg_temp"."{temp_name}" AS src '
+        f'WHERE dst."{key}" = src."{key}" {where_clause}'
+    )
+
+    return result.rowcount
+
+
+def load_table(df, conn, schema, table_name, if_exists='append', dtype=None, chunksize=100000):
+    """
+    Carrega um dataframe no DW via COPY FROM STDIN, mantendo os tipos das
+    colunas. A criação da tabela (quando necessária) e a carga ocorrem na
+    mesma transação.
+
+    parâmetros:
+    df -- pandas.DataFrame;
+    conn -- conexão criada via SqlAlchemy com o servidor do DW;
+    schema -- schema da tabela;
+    table_name -- nome da tabela;
+    if_exists -- if_exists (append, replace, fail);
+    dtype -- dicionário coluna -> tipo SqlAlchemy;
+    chunksize -- quantidade de linhas enviadas por COPY;
+    """
+    df = prepare_copy_frame(df, dtype)
+
+    with conn.begin() as connection:
+        df.head(0).to_sql(con=connection, name=table_name, schema=schema, if_exists=if_exists, index=False,
+                          dtype=dtype)
+        copy_dataframe(connection.connection.cursor(), df, schema, table_name, chunksize=chunksize)
+
+
+def insert_new_rows(connection, df, schema, table_name, key, chunksize=100000):
+    """
+    Insere as linhas de df cuja chave ainda não existe na tabela. As linhas
+    são enviadas para uma tabela temporária via COPY e inseridas com um único
+    INSERT ... WHERE NOT EXISTS. A tabela fica bloqueada para outras escritas
+    até o fim da transação, então cargas concorrentes não inserem a mesma
+    chave duas vezes.
+
+    parâmetros:
+    connection -- conexão SqlAlchemy (ex.: aberta com conn.begin()). A tabela
+                  temporária é descartada no commit dessa transação;
+    df -- pandas.DataFrame já ajustado por prepare_copy_frame;
+    schema -- schema da tabela;
+    table_name -- nome da tabela;
+    key -- coluna chave ou lista de colunas (ex.: ['nu_nfc', 'sk_produto']);
+    chunksize -- quantidade de linhas enviadas por COPY;
+
+    return:
+    pandas.DataFrame com as chaves inseridas;
+    """
+    keys = [key] if isinstance(key, str) else list(key)
+    columns = concat_cols(list(df.columns))
+    temp_name = f'tmp_{table_name}'
+    key_clause = ' AND '.join(f'dst."{col}" = src."{col}"' for col in keys)
+
+    connection.execute(f'DROP TABLE IF EXISTS "pg_temp"."{temp_name}"')
+    connection.execute(
+        f'CREATE TEMP TABLE "{temp_name}" (LIKE "{schema}"."{table_name}" INCLUDING DEFAULTS) ON COMMIT DROP'
+    )
+    copy_dataframe(connection.connection.cursor(), df, 'pg_temp', temp_name, chunksize=chunksize)
+
+    connection.execute(f'LOCK TABLE "{schema}"."{table_name}" IN SHARE ROW EXCLUSIVE MODE')
+    result = connection.execute(
+        f'INSERT INTO "{schema}"."{table_name}" ("{columns}") '
+        f'SELECT "{columns}" FROM "pg_temp"."{temp_name}" AS src '
+        f'WHERE NOT EXISTS (SELECT 1 FROM "{schema}"."{table_name}" AS dst '
+        f'WHERE {key_clause}) '
+        f'RETURNING "{concat_cols(keys)}"'
+    )
+
+    return pd.DataFrame(result.fetchall(), columns=keys)
+
+
+def hash_column(series):
+    """
+    Normaliza uma coluna para texto antes do hash, para que o mesmo valor gere
+    o mesmo hash independente do dtype lido (ex.: 1, 1.0, datas e nulos)
+    """
+    if series.dtype == object and pd.api.types.infer_dtype(series, skipna=True) in ('date', 'datetime'):
+        series = pd.to_datetime(series)
+    if pd.api.types.is_bool_dtype(series):
+        return series.astype('Int64').astype('string')
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype('Float64').astype('string')
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series.dt.strftime('%Y-%m-%d %H:%M:%S').astype('string')
+
+    return series.astype('string')
+
+
+def row_hash(df, columns):
+    """
+    Calcula um hash de 64 bits por linha sobre um grupo de colunas
+
+    parâmetros:
+    df -- pandas.DataFrame;
+    columns -- colunas do grupo (ex.: colunas tipo 2 da dimensão);
+
+    return:
+    numpy.ndarray int64;
+    """
+    if len(columns) == 0:
+        return np.zeros(len(df), dtype='int64')
+
+    normalized = pd.DataFrame({col: hash_column(df[col]) for col in columns})
+
+    return pd.util.hash_pandas_object(normalized, index=False).to_numpy().view('int64')
+
+
+def assign_row_hashes(df, type1=(), type2=()):
+    """
+    Grava no dataframe os hashes dos grupos de colunas tipo 1 e tipo 2
+    (nu_hash_tipo1 e nu_hash_tipo2), persistidos junto com a dimensão
+
+    parâmetros:
+    df -- pandas.DataFrame;
+    type1 -- colunas tipo 1;
+    type2 -- colunas tipo 2;
+
+    return:
+    pandas.DataFrame;
+    """
+    return df.assign(
+        nu_hash_tipo1=row_hash(df, list(type1)),
+        nu_hash_tipo2=row_hash(df, list(type2))
+    )
+
+
+def ensure_hash_columns(conn, schema, table_name):
+    """
+    Cria as colunas de hash na dimensão, se não existirem. Quando as colunas
+    já existem nenhum DDL é executado.
+
+    parâmetros:
+    conn -- conexão criada via SqlAlchemy com o servidor do DW;
+    schema -- schema da dimensão;
+    table_name -- nome da dimensão;
+    """
+    if not {'nu_hash_tipo1', 'nu_hash_tipo2'} <= table_columns(conn, schema, table_name):
+        conn.execute(
+            f'ALTER TABLE "{schema}"."{table_name}" '
+            f'ADD COLUMN IF NOT EXISTS "nu_hash_tipo1" BIGINT, '
+            f'ADD COLUMN IF NOT EXISTS "nu_hash_tipo2" BIGINT'
+        )
+
+
+def fill_row_hashes(connection, schema, table_name, surrogate_key, type1=(), type2=()):
+    """
+    Calcula o hash das linhas da dimensão que ainda não o possuem (ex.:
+    dimensões carregadas antes das colunas existirem ou membros inferidos).
+    Deve rodar na transação da carga, depois do bloqueio da dimensão, para
+    que nenhuma linha sem hash apareça antes da leitura das versões ativas.
+
+    parâmetros:
+    connection -- conexão SqlAlchemy da transação da carga;
+    schema -- schema da dimensão;
+    table_name -- nome da dimensão;
+    surrogate_key -- coluna da surrogate key, usada para atualizar as linhas;
+    type1 -- colunas tipo 1;
+    type2 -- colunas tipo 2;
+    """
+    missing = read_table(
+        connection, schema, table_name,
+        columns=[surrogate_key, *type1, *type2],
+        where=f'"{surrogate_key}" > 0 AND ("nu_hash_tipo1" IS NULL OR "nu_hash_tipo2" IS NULL)'
+    )
+    if len(missing) > 0:
+        update_table(
+            connection,
+            assign_row_hashes(missing, type1, type2).filter([surrogate_key, 'nu_hash_tipo1', 'nu_hash_tipo2']),
+            schema, table_name, key=surrogate_key
+        )
+
+
+def ensure_inferred_column(conn, schema, table_name):
+    """
+    Cria na dimensão, se não existir, a coluna fl_inferido, que marca os
+    membros inferidos (criados pela carga da fato antes da dimensão receber
+    o registro real). Quando a coluna já existe nenhum DDL é executado.
+
+    parâmetros:
+    conn -- conexão criada via SqlAlchemy com o servidor do DW;
+    schema -- schema da dimensão;
+    table_name -- nome da dimensão;
+    """
+    if 'fl_inferido' in table_columns(conn, schema, table_name):
+        return
+
+    conn.execute(
+        f'ALTER TABLE "{schema}"."{table_name}" '
+        f'ADD COLUMN IF NOT EXISTS "fl_inferido" INTEGER NOT NULL DEFAULT 0'
+    )
+
+
+def create_inferred_members(conn, schema, table_name, natural_key, surrogate_key, source, scd=False):
+    """
+    Cria em lote um membro inferido para cada chave natural referenciada pela
+    fato que ainda não existe na dimensão. O membro recebe apenas a surrogate
+    key, a chave natural e fl_inferido = 1; os demais atributos são
+    preenchidos, sem nova versão, quando a dimensão receber o registro real.
+    A dimensão fica bloqueada para escrita durante a criação, com o mesmo
+    bloqueio de upsert_dimension e apply_scd, evitando surrogate keys
+    repetidas entre cargas concorrentes. Quando algum membro é
+    criado, a versão da dimensão é incrementada e o snapshot do cache local
+    é removido, para que a próxima leitura veja os novos membros.
+
+    parâmetros:
+    conn -- conexão criada via SqlAlchemy com o servidor do DW;
+    schema -- schema da dimensão;
+    table_name -- nome da dimensão;
+    natural_key -- coluna da chave natural (ex.: cd_cliente);
+    surrogate_key -- coluna da surrogate key (ex.: sk_cliente);
+    source -- consulta SQL que retorna as chaves naturais usadas pela fato em
+              uma coluna chamada key;
+    scd -- a dimensão guarda histórico. O membro inferido é criado ativo e
+           vigente desde 1900-01-01;
+
+    return:
+    quantidade de membros inferidos criados;
+    """
+    ensure_inferred_column(conn, schema, table_name)
+
+    columns = [surrogate_key, natural_key, 'fl_inferido']
+    values = ['1']
+    if scd:
+        columns += ['fl_ativo', 'dt_inicio', 'dt_fim']
+        values += ['1', "TIMESTAMP '1900-01-01'", 'NULL']
+
+    with conn.begin() as connection:
+        connection.execute(f'LOCK TABLE "{schema}"."{table_name}" IN SHARE ROW EXCLUSIVE MODE')
+        result = connection.execute(
+            f'INSERT INTO "{schema}"."{table_name}" ("{concat_cols(columns)}") '
+            f'SELECT max_sk.value + ROW_NUMBER() OVER (ORDER BY src."key"), src."key", {", ".join(values)} '
+            f'FROM (SELECT DISTINCT "key" FROM ({source}) AS keys WHERE "key" IS NOT NULL) AS src '
+            f'CROSS JOIN (SELECT GREATEST(COALESCE(MAX("{surrogate_key}"), 0), 0) AS value '
+            f'FROM "{schema}"."{table_name}") AS max_sk '
+            f'WHERE NOT EXISTS (SELECT 1 FROM "{schema}"."{table_name}" AS cur '
+            f'WHERE cur."{natural_key}" = src."key")'
+        )
+        if result.rowcount > 0:
+            bump_version(connection, schema, table_name)
+
+    if result.rowcount > 0:
+        remove_snapshots(schema, table_name)
+
+    return result.rowcount
+
+
+def ensure_unique_index(conn, schema, table_name, column):
+    """
+    Cria, fora da transação da carga, o índice único ux_{table_name}_{column}
+    usado pelo ON CONFLICT de upsert_dimension. Quando o índice já existe
+    nenhum DDL é executado, então a carga não pede um bloqueio SHARE que
+    depois seria elevado a SHARE ROW EXCLUSIVE.
+
+    parâmetros:
+    conn -- conexão criada via SqlAlchemy com o servidor do DW;
+    schema -- schema da tabela;
+    table_name -- nome da tabela;
+    column -- coluna do índice (ex.: cd_cliente);
+    """
+    index_name = f'ux_{table_name}_{column}'
+    response = conn.execute(
+        'SELECT 1 FROM "pg_indexes" '
+        f'WHERE "schemaname" = \'{schema}\' AND "indexname" = \'{index_name}\''
+    ).scalar()
+    if response is None:
+        conn.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS "{index_name}" ON "{schema}"."{table_name}" ("{column}")')
+
+
+def read_active_hashes(connection, schema, table_name, natural_key, surrogate_key):
+    """
+    Lê a chave natural, os hashes e fl_inferido das versões ativas da
+    dimensão. Hashes nulos viram 0 no banco, para que o pandas não leia as
+    colunas como float64 e perca a precisão dos hashes de 64 bits; a linha
+    com hash nulo é tratada como alterada.
+
+    parâmetros:
+    connection -- conexão SqlAlchemy da transação da carga;
+    schema -- schema da dimensão;
+    table_name -- nome da dimensão;
+    natural_key -- coluna da chave natural;
+    surrogate_key -- coluna da surrogate key;
+
+    return:
+    pandas.DataFrame;
+    """
+    return pd.read_sql_query(
+        f'SELECT "{natural_key}", '
+        'COALESCE("nu_hash_tipo1", 0) AS "nu_hash_tipo1", '
+        'COALESCE("nu_hash_tipo2", 0) AS "nu_hash_tipo2", '
+        '"fl_inferido" '
+        f'FROM "{schema}"."{table_name}" '
+        f'WHERE "{surrogate_key}" > 0 AND "fl_ativo" = 1',
+        connection
+    )
+
+
+def classify_scd(stage, dim, natural_key, type1=(), type2=()):
+    """
+    Classifica em uma única passada as linhas da stage contra as versões
+    ativas da dimensão, comparando os hashes de cada grupo de colunas
 
+    parâmetros:
+    stage -- pandas.DataFrame com os nomes de colunas da dimensão;
+    dim -- pandas.DataFrame com a chave natural e os hashes persistidos das
+           versões ativas (e, opcionalmente, fl_inferido);
+    natural_key -- coluna da chave natural (ex.: cd_loja);
+    type1 -- colunas sobrescritas em todas as versões quando mudam;
+    type2 -- colunas que geram uma nova versão quando mudam;
 
-def create_stage(conn_input, conn_output, schema_in, table, stg_name, tbl_exists):
+    return:
+    stage -- pandas.DataFrame com os hashes e as colunas fl_novo, fl_inferido,
+             fl_tipo1 e fl_tipo2. Membros inferidos não são marcados como
+             mudança tipo 1 ou tipo 2;
+    """
+    stage = (
+        stage.
+        drop_duplicates(subset=natural_key, keep='last').
+        reset_index(drop=True).
+        pipe(assign_row_hashes, type1=type1, type2=type2)
+    )
+    dim = dim.drop_duplicates(subset=natural_key, keep='last')
+
+    position = pd.Index(dim[natural_key]).get_indexer(stage[natural_key])
+    found = position >= 0
+    position = np.where(found, position, 0)
+
+    if len(dim) == 0:
+        changed1 = changed2 = inferred = np.zeros(len(stage), dtype=bool)
+    else:
+        changed1 = stage['nu_hash_tipo1'].to_numpy() != dim['nu_hash_tipo1'].to_numpy(dtype='int64')[position]
+        changed2 = stage['nu_hash_tipo2'].to_numpy() != dim['nu_hash_tipo2'].to_numpy(dtype='int64')[position]
+        inferred = np.zeros(len(stage), dtype=bool)
+        if 'fl_inferido' in dim.columns:
+            inferred = found & (dim['fl_inferido'].to_numpy() == 1)[position]
+
+    return stage.assign(
+        fl_novo=~found,
+        fl_inferido=inferred,
+        fl_tipo1=found & ~inferred & changed1,
+        fl_tipo2=found & ~inferred & changed2
+    )
+
+
+def upsert_dimension(conn, stage, schema, table_name, natural_key, surrogate_key, type1=(), dtype=None):
+    """
+    Carrega uma dimensão tipo 1 com um único INSERT ... ON CONFLICT, apoiado
+    em um índice único na chave natural. Novas chaves recebem surrogate keys
+    sequenciais a partir da maior existente e chaves existentes só são
+    atualizadas quando o hash tipo 1 mudou ou quando são membros inferidos,
+    que passam a ter fl_inferido = 0. A dimensão não é lida pelo pandas.
+
+    parâmetros:
+    conn -- conexão criada via SqlAlchemy com o servidor do DW;
+    stage -- pandas.DataFrame com as colunas da dimensão, sem a surrogate key;
+    schema -- schema da dimensão;
+    table_name -- nome da dimensão;
+    natural_key -- coluna da chave natural (ex.: cd_cliente);
+    surrogate_key -- coluna da surrogate key (ex.: sk_cliente);
+    type1 -- colunas tipo 1;
+    dtype -- dicionário coluna -> tipo SqlAlchemy da dimensão;
+
+    return:
+    dicionário com a quantidade de linhas inseridas ou atualizadas;
+    """
+    type1 = list(type1)
+    ensure_hash_columns(conn, schema, table_name)
+    ensure_inferred_column(conn, schema, table_name)
+    ensure_unique_index(conn, schema, table_name, natural_key)
+
+    stage = (
+        stage.
+        drop_duplicates(subset=natural_key, keep='last').
+        pipe(assign_row_hashes, type1=type1)
+    )
+    columns = [natural_key, *type1, 'nu_hash_tipo1', 'nu_hash_tipo2']
+    temp_name = f'tmp_{table_name}'
+    select_clause = ', '.join(f'src."{col}"' for col in columns)
+    set_clause = ', '.join(f'"{col}" = EXCLUDED."{col}"' for col in [*columns[1:], 'fl_inferido'])
+
+    with conn.begin() as connection:
+        connection.execute(f'LOCK TABLE "{schema}"."{table_name}" IN SHARE ROW EXCLUSIVE MODE')
+        fill_row_hashes(connection, schema, table_name, surrogate_key, type1=type1)
+        connection.execute(f'DROP TABLE IF EXISTS "pg_temp"."{temp_name}"')
+        connection.execute(
+            f'CREATE TEMP TABLE "{temp_name}" ON COMMIT DROP AS '
+            f'SELECT "{concat_cols(columns)}" FROM "{schema}"."{table_name}" WITH NO DATA'
+        )
+        copy_dataframe(connection.connection.cursor(), prepare_copy_frame(stage.filter(columns), dtype), 'pg_temp',
+                       temp_name)
+
+        # as chaves novas são numeradas em sequência, sem lacunas, a partir da maior surrogate key
+        result = connection.execute(
+            f'INSERT INTO "{schema}"."{table_name}" AS dst ("{surrogate_key}", "{concat_cols(columns)}") '
+            f'SELECT COALESCE(cur."{surrogate_key}", '
+            f'max_sk.value + ROW_NUMBER() OVER (PARTITION BY cur."{surrogate_key}" IS NULL '
+            f'ORDER BY src."{natural_key}")), '
+            f'{select_clause} '
+            f'FROM "pg_temp"."{temp_name}" AS src '
+            f'LEFT JOIN "{schema}"."{table_name}" AS cur ON cur."{natural_key}" = src."{natural_key}" '
+            f'CROSS JOIN (SELECT GREATEST(COALESCE(MAX("{surrogate_key}"), 0), 0) AS value '
+            f'FROM "{schema}"."{table_name}") AS max_sk '
+            f'ON CONFLICT ("{natural_key}") DO UPDATE SET {set_clause} '
+            f'WHERE dst."nu_hash_tipo1" IS DISTINCT FROM EXCLUDED."nu_hash_tipo1" OR dst."fl_inferido" = 1'
+        )
+
+    return {'upserted': result.rowcount}
+
+
+def apply_scd(conn, stage, schema, table_name, natural_key, surrogate_key, type1=(), type2=(), dtype=None,
+              new_start=None):
+    """
+    Aplica a stage em uma dimensão conforme a declaração de SCD. Novas chaves
+    e mudanças tipo 2 geram inserts (com a versão anterior expirada), mudanças
+    tipo 1 são sobrescritas em todas as versões da chave. A comparação usa
+    apenas a chave natural e os hashes persistidos (nu_hash_tipo1 e
+    nu_hash_tipo2) das versões ativas. Membros inferidos recebem todos os
+    atributos na própria linha, sem gerar nova versão. Quando type2 é vazio a
+    dimensão não guarda histórico nem as colunas fl_ativo, dt_inicio e
+    dt_fim, e a carga é feita por upsert_dimension. As atualizações e os
+    inserts ocorrem na mesma transação.
+
+    parâmetros:
+    conn -- conexão criada via SqlAlchemy com o servidor do DW;
+    stage -- pandas.DataFrame com as colunas da dimensão, sem a surrogate key;
+    schema -- schema da dimensão;
+    table_name -- nome da dimensão;
+    natural_key -- coluna da chave natural (ex.: cd_loja);
+    surrogate_key -- coluna da surrogate key (ex.: sk_loja);
+    type1 -- colunas tipo 1;
+    type2 -- colunas tipo 2;
+    dtype -- dicionário coluna -> tipo SqlAlchemy da dimensão;
+    new_start -- dt_inicio das novas chaves: uma coluna da stage (ex.:
+                 dt_cadastro) ou uma data, igual à carga inicial da dimensão,
+                 para que vendas anteriores à carga encontrem a versão. Sem
+                 valor (ou com a coluna nula) é usada a data da carga. Novas
+                 versões tipo 2 sempre começam na data da carga;
+
+    return:
+    dicionário com a quantidade de linhas inseridas, atualizadas e expiradas;
+    """
+    type1, type2 = list(type1), list(type2)
+    if not type2:
+        return upsert_dimension(conn, stage, schema, table_name, natural_key, surrogate_key, type1=type1,
+                                dtype=dtype)
+
+    ensure_hash_columns(conn, schema, table_name)
+    ensure_inferred_column(conn, schema, table_name)
+
+    # bloqueia as escritas concorrentes (membros inferidos, outras cargas) entre a
+    # leitura das versões ativas e a numeração das novas surrogate keys
+    with conn.begin() as connection:
+        connection.execute(f'LOCK TABLE "{schema}"."{table_name}" IN SHARE ROW EXCLUSIVE MODE')
+        fill_row_hashes(connection, schema, table_name, surrogate_key, type1=type1, type2=type2)
+        dim = read_active_hashes(connection, schema, table_name, natural_key, surrogate_key)
+        stage = classify_scd(stage, dim, natural_key, type1=type1, type2=type2)
+
+        today = pd.to_datetime("today")
+        flags = ['fl_novo', 'fl_inferido', 'fl_tipo1', 'fl_tipo2']
+
+        type1_values = stage.loc[stage['fl_tipo1'], [natural_key, *type1, 'nu_hash_tipo1']]
+        inferred_values = (
+            stage.
+            loc[stage['fl_inferido'], [natural_key, *type1, *type2, 'nu_hash_tipo1', 'nu_hash_tipo2']].
+            assign(fl_inferido=0)
+        )
+        expired_values = (
+            stage.
+            loc[stage['fl_tipo2'], [natural_key]].
+            assign(
+                fl_ativo=0,
+                dt_fim=today)
+        )
+
+        new_values = stage[stage['fl_novo']].drop(columns=flags)
+        if new_start is None:
+            new_values = new_values.assign(dt_inicio=today)
+        elif isinstance(new_start, str) and new_start in new_values.columns:
+            new_values = new_values.assign(dt_inicio=pd.to_datetime(new_values[new_start]).fillna(today))
+        else:
+            new_values = new_values.assign(dt_inicio=pd.to_datetime(new_start))
+
+        insert_values = (
+            pd.concat([
+                new_values,
+                stage[stage['fl_tipo2']].drop(columns=flags).assign(dt_inicio=today)],
+                ignore_index=True).
+            assign(
+                fl_ativo=1,
+                dt_fim=None)
+        )
+
+        max_sk = connection.execute(
+            f'SELECT GREATEST(COALESCE(MAX("{surrogate_key}"), 0), 0) FROM "{schema}"."{table_name}"'
+        ).scalar()
+        insert_values.insert(0, surrogate_key, range(max_sk + 1, max_sk + 1 + len(insert_values)))
+
+        updated = update_table(connection, type1_values, schema, table_name, key=natural_key, dtype=dtype)
+        inferred = update_table(connection, inferred_values, schema, table_name, key=natural_key,
+                                where='dst."fl_inferido" = 1', dtype=dtype)
+        expired = update_table(connection, expired_values, schema, table_name, key=natural_key,
+                               where='dst."fl_ativo" = 1', dtype=dtype)
+        copy_dataframe(connection.connection.cursor(), prepare_copy_frame(insert_values, dtype), schema, table_name)
+
+    return {'inserted': len(insert_values), 'updated': updated, 'expired': expired, 'inferred': inferred}
+
+
+def is_partitioned(conn, schema, table_name):
+    response = conn.execute(
+        f'SELECT c.relkind FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace '
+        f'WHERE n.nspname = \'{schema}\' AND c.relname = \'{table_name}\''
+    ).scalar()
+
+    return response == 'p'
+
+
+def create_partitioned_table(conn, schema, table_name, dtype, partition_key):
+    """
+    Cria uma tabela particionada por faixa (RANGE) de partition_key e a
+    partição DEFAULT ({table_name}_default), que recebe as linhas fora das
+    partições criadas (ex.: membros -1, -2 e -3)
+
+    parâmetros:
+    conn -- conexão ou engine SqlAlchemy do DW;
+    schema -- schema da tabela;
+    table_name -- nome da tabela;
+    dtype -- dicionário coluna -> tipo SqlAlchemy, na ordem das colunas;
+    partition_key -- coluna de particionamento (ex.: sk_dt_venda);
+    """
+    table = sa.Table(
+        table_name,
+        sa.MetaData(),
+        *[sa.Column(col, type_) for col, type_ in dtype.items()],
+        schema=schema,
+        postgresql_partition_by=f'RANGE ("{partition_key}")'
+    )
+    table.create(conn, checkfirst=True)
+    conn.execute(
+        f'CREATE TABLE IF NOT EXISTS "{schema}"."{table_name}_default" '
+        f'PARTITION OF "{schema}"."{table_name}" DEFAULT'
+    )
+
+
+def create_aggregate_table(conn, schema, table_name, dtype, keys):
+    """
+    Cria, se não existir, uma tabela agregada com chave primária nas colunas
+    de agrupamento
+
+    parâmetros:
+    conn -- conexão ou engine SqlAlchemy do DW;
+    schema -- schema da tabela;
+    table_name -- nome da tabela;
+    dtype -- dicionário coluna -> tipo SqlAlchemy, na ordem das colunas;
+    keys -- colunas de agrupamento;
+    """
+    table = sa.Table(
+        table_name,
+        sa.MetaData(),
+        *[sa.Column(col, type_, primary_key=col in keys, autoincrement=False) for col, type_ in dtype.items()],
+        schema=schema
+    )
+    table.create(conn, checkfirst=True)
+
+
+def accumulate_table(connection, df, schema, table_name, keys, dtype=None):
+    """
+    Soma as medidas de um dataframe já agrupado em uma tabela agregada. As
+    linhas são enviadas para uma tabela temporária com um único COPY e
+    aplicadas com um único INSERT ... ON CONFLICT: grupos novos são
+    inseridos e grupos existentes recebem a soma das medidas. Todas as
+    colunas de df diferentes de keys são tratadas como medidas aditivas.
+
+    parâmetros:
+    connection -- conexão SqlAlchemy (ex.: aberta com conn.begin()). A tabela
+                  temporária é descartada no commit dessa transação;
+    df -- pandas.DataFrame com uma linha por grupo;
+    schema -- schema da tabela;
+    table_name -- nome da tabela;
+    keys -- colunas de agrupamento (chave primária da tabela);
+    dtype -- dicionário coluna -> tipo SqlAlchemy da tabela;
+
+    return:
+    quantidade de linhas inseridas ou atualizadas;
+    """
+    if len(df) == 0:
+        return 0
+
+    keys = list(keys)
+    measures = [col for col in df.columns if col not in keys]
+    columns = [*keys, *measures]
+    temp_name = f'tmp_{table_name}'
+    set_clause = ', '.join(f'"{col}" = dst."{col}" + EXCLUDED."{col}"' for col in measures)
+
+    connection.execute(f'DROP TABLE IF EXISTS "pg_temp"."{temp_name}"')
+    connection.execute(
+        f'CREATE TEMP TABLE "{temp_name}" ON COMMIT DROP AS '
+        f'SELECT "{concat_cols(columns)}" FROM "{schema}"."{table_name}" WITH NO DATA'
+    )
+    copy_dataframe(connection.connection.cursor(), prepare_copy_frame(df.filter(columns), dtype), 'pg_temp',
+                   temp_name)
+
+    # a ordem das chaves garante a mesma ordem de bloqueio entre cargas concorrentes
+    result = connection.execute(
+        f'INSERT INTO "{schema}"."{table_name}" AS dst ("{concat_cols(columns)}") '
+        f'SELECT "{concat_cols(columns)}" FROM "pg_temp"."{temp_name}" ORDER BY "{concat_cols(keys)}" '
+        f'ON CONFLICT ("{concat_cols(keys)}") DO UPDATE SET {set_clause}'
+    )
+
+    return result.rowcount
+
+
+def create_range_partition(conn, schema, table_name, partition_name, start, end):
+    """
+    Cria, se não existir, a partição [start, end) de uma tabela particionada
+
+    parâmetros:
+    conn -- conexão ou engine SqlAlchemy do DW;
+    schema -- schema da tabela;
+    table_name -- nome da tabela particionada;
+    partition_name -- nome da partição;
+    start -- início da faixa (inclusivo);
+    end -- fim da faixa (exclusivo);
+    """
+    conn.execute(
+        f'CREATE TABLE IF NOT EXISTS "{schema}"."{partition_name}" '
+        f'PARTITION OF "{schema}"."{table_name}" FOR VALUES FROM ({start}) TO ({end})'
+    )
+
+
+def swap_partition(df, conn, schema, table_name, partition_name, start, end, dtype=None, before_swap=None):
+    """
+    Reconstrói uma partição inteira: os dados são carregados em uma tabela
+    nova, fora da tabela particionada, que substitui a partição antiga em
+    uma única transação (DETACH, DROP, RENAME e ATTACH)
+
+    parâmetros:
+    df -- pandas.DataFrame com todas as linhas da partição;
+    conn -- conexão criada via SqlAlchemy com o servidor do DW;
+    schema -- schema da tabela;
+    table_name -- nome da tabela particionada;
+    partition_name -- nome da partição;
+    start -- início da faixa (inclusivo);
+    end -- fim da faixa (exclusivo);
+    dtype -- dicionário coluna -> tipo SqlAlchemy;
+    before_swap -- função chamada com a conexão da transação da troca, antes
+                   do DETACH, enquanto a partição antiga ainda pode ser lida
+                   (ex.: para ajustar tabelas agregadas);
+    """
+    shadow = f'{partition_name}_new'
+    conn.execute(f'DROP TABLE IF EXISTS "{schema}"."{shadow}"')
+    conn.execute(f'CREATE TABLE "{schema}"."{shadow}" (LIKE "{schema}"."{table_name}" INCLUDING DEFAULTS)')
+    load_table(df, conn, schema, shadow, if_exists='append', dtype=dtype)
+
+    with conn.begin() as connection:
+        if before_swap is not None:
+            before_swap(connection)
+        if table_exists(connection, schema, partition_name):
+            connection.execute(f'ALTER TABLE "{schema}"."{table_name}" DETACH PARTITION "{schema}"."{partition_name}"')
+            connection.execute(f'DROP TABLE "{schema}"."{partition_name}"')
+        connection.execute(f'ALTER TABLE "{schema}"."{shadow}" RENAME TO "{partition_name}"')
+        connection.execute(
+            f'ALTER TABLE "{schema}"."{table_name}" ATTACH PARTITION "{schema}"."{partition_name}" '
+            f'FOR VALUES FROM ({start}) TO ({end})'
+        )
+
+
+def create_control_table(conn):
+    """
+    Cria a tabela de controle de carga ou adiciona as colunas que faltam em
+    uma versão antiga. create_stage a chama em toda cópia; nas cópias em
+    paralelo ela deve ser chamada antes (run_stages), para que as cópias não
+    executem DDL ao mesmo tempo. Quando a tabela já está atualizada nenhum
+    DDL é executado.
+
+    parâmetros:
+    conn -- conexão criada via SqlAlchemy com o servidor do DW;
+    """
+    if not table_exists(conn, 'stage', 'controle_carga'):
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS "stage"."controle_carga" ('
+            '"no_schema" VARCHAR NOT NULL, '
+            '"no_tabela" VARCHAR NOT NULL, '
+            '"no_coluna_watermark" VARCHAR, '
+            '"vl_watermark" VARCHAR, '
+            '"ds_fingerprint" VARCHAR, '
+            '"nu_versao" INTEGER NOT NULL DEFAULT 0, '
+            '"dt_atualizacao" TIMESTAMP, '
+            'PRIMARY KEY ("no_schema", "no_tabela"))'
+        )
+        return
+
+    if not {'ds_fingerprint', 'nu_versao'} <= table_columns(conn, 'stage', 'controle_carga'):
+        conn.execute(
+            'ALTER TABLE "stage"."controle_carga" '
+            'ADD COLUMN IF NOT EXISTS "ds_fingerprint" VARCHAR, '
+            'ADD COLUMN IF NOT EXISTS "nu_versao" INTEGER NOT NULL DEFAULT 0'
+        )
+
+
+def table_fingerprint(conn, schema, table_name):
+    """
+    Calcula uma assinatura barata da tabela: quantidade de linhas e o maior
+    xmin (id da última transação que inseriu ou alterou uma linha)
+
+    parâmetros:
+    conn -- conexão criada via SqlAlchemy com o servidor da tabela;
+    schema -- schema da tabela;
+    table_name -- nome da tabela;
+
+    return:
+    fingerprint -- str;
+    """
+    return conn.execute(
+        'SELECT COUNT(*)::TEXT || \':\' || COALESCE(MAX("xmin"::TEXT::BIGINT), 0)::TEXT '
+        f'FROM "{schema}"."{table_name}"'
+    ).scalar()
+
+
+def layout_fingerprint(dialect, dtype=None):
+    """
+    Calcula uma assinatura do layout declarado da stage (colunas e tipos),
+    para que uma mudança de layout force a recriação da stage mesmo sem
+    mudança na origem
+
+    parâmetros:
+    dialect -- dialeto SqlAlchemy usado para compilar os tipos;
+    dtype -- dicionário coluna -> tipo SqlAlchemy ou None (layout da origem);
+
+    return:
+    fingerprint -- str;
+    """
+    if dtype is None:
+        layout = '*'
+    else:
+        layout = ';'.join(
+            f'{column} {(sa_type() if isinstance(sa_type, type) else sa_type).compile(dialect=dialect)}'
+            for column, sa_type in dtype.items()
+        )
+
+    return hashlib.md5(layout.encode()).hexdigest()
+
+
+def read_fingerprint(conn, stg_name):
+    return conn.execute(
+        'SELECT "ds_fingerprint" FROM "stage"."controle_carga" '
+        f'WHERE "no_schema" = \'stage\' AND "no_tabela" = \'{stg_name}\''
+    ).scalar()
+
+
+def register_stage_sql(stg_name, fingerprint=None):
+    """
+    Monta o comando que registra uma nova versão da stage
+
+    parâmetros:
+    stg_name -- nome da stage;
+    fingerprint -- assinatura da tabela de origem ou None;
+
+    return:
+    sql -- str;
+    """
+    fingerprint = 'NULL' if fingerprint is None else f"'{fingerprint}'"
+
+    return (
+        'INSERT INTO "stage"."controle_carga" '
+        '("no_schema", "no_tabela", "ds_fingerprint", "nu_versao", "dt_atualizacao") '
+        f'VALUES (\'stage\', \'{stg_name}\', {fingerprint}, 1, NOW()) '
+        'ON CONFLICT ("no_schema", "no_tabela") DO UPDATE SET '
+        '"ds_fingerprint" = EXCLUDED."ds_fingerprint", '
+        '"nu_versao" = "controle_carga"."nu_versao" + 1, '
+        '"dt_atualizacao" = EXCLUDED."dt_atualizacao"'
+    )
+
+
+def stage_versions(conn, stages):
+    """
+    Lê as versões atuais de um conjunto de stages
+
+    parâmetros:
+    conn -- conexão criada via SqlAlchemy com o servidor do DW;
+    stages -- lista com os nomes das stages;
+
+    return:
+    versions -- str no formato "stg_a:1;stg_b:4" ou None se alguma stage não
+                tiver versão registrada;
+    """
+    if not table_exists(conn, 'stage', 'controle_carga'):
+        return None
+
+    names = "', '".join(stages)
+    response = conn.execute(
+        'SELECT "no_tabela", "nu_versao" FROM "stage"."controle_carga" '
+        f'WHERE "no_schema" = \'stage\' AND "no_tabela" IN (\'{names}\')'
+    ).fetchall()
+
+    if len(response) < len(set(stages)):
+        return None
+
+    return ';'.join(f'{name}:{version}' for name, version in sorted(response))
+
+
+def is_loaded(conn, table_name, versions):
+    """
+    Verifica se a tabela do DW já foi carregada a partir das versões de stage
+    informadas, ou seja, se as stages não mudaram desde a última carga
+
+    parâmetros:
+    conn -- conexão criada via SqlAlchemy com o servidor do DW;
+    table_name -- nome da tabela no schema dw;
+    versions -- retorno de stage_versions;
+
+    return:
+    bool;
+    """
+    if versions is None or not table_exists(conn, 'dw', table_name):
+        return False
+
+    response = conn.execute(
+        'SELECT "ds_fingerprint" FROM "stage"."controle_carga" '
+        f'WHERE "no_schema" = \'dw\' AND "no_tabela" = \'{table_name}\''
+    ).scalar()
+
+    return response == versions
+
+
+def register_load(conn, table_name, versions):
+    """
+    Registra as versões de stage usadas na carga de uma tabela do DW
+
+    parâmetros:
+    conn -- conexão criada via SqlAlchemy com o servidor do DW;
+    table_name -- nome da tabela no schema dw;
+    versions -- retorno de stage_versions;
+    """
+    create_control_table(conn)
+    versions = 'NULL' if versions is None else f"'{versions}'"
+    conn.execute(
+        'INSERT INTO "stage"."controle_carga" '
+        '("no_schema", "no_tabela", "ds_fingerprint", "nu_versao", "dt_atualizacao") '
+        f'VALUES (\'dw\', \'{table_name}\', {versions}, 1, NOW()) '
+        'ON CONFLICT ("no_schema", "no_tabela") DO UPDATE SET '
+        '"ds_fingerprint" = EXCLUDED."ds_fingerprint", '
+        '"nu_versao" = "controle_carga"."nu_versao" + 1, '
+        '"dt_atualizacao" = EXCLUDED."dt_atualizacao"'
+    )
+    snapshot_table(conn, 'dw', table_name)
+
+
+def bump_version(connection, schema, table_name):
+    """
+    Incrementa a versão registrada de uma tabela do DW alterada fora do seu
+    pipeline, invalidando o snapshot da versão anterior sem alterar as
+    versões de stage usadas na última carga
+
+    parâmetros:
+    connection -- conexão SqlAlchemy (ex.: aberta com conn.begin());
+    schema -- schema da tabela;
+    table_name -- nome da tabela;
+    """
+    if not table_exists(connection, 'stage', 'controle_carga'):
+        return
+
+    connection.execute(
+        'UPDATE "stage"."controle_carga" '
+        'SET "nu_versao" = "nu_versao" + 1, "dt_atualizacao" = NOW() '
+        f'WHERE "no_schema" = \'{schema}\' AND "no_tabela" = \'{table_name}\''
+    )
+
+
+def table_version(conn, schema, table_name):
+    if not table_exists(conn, 'stage', 'controle_carga'):
+        return None
+
+    return conn.execute(
+        'SELECT "nu_versao" FROM "stage"."controle_carga" '
+        f'WHERE "no_schema" = \'{schema}\' AND "no_tabela" = \'{table_name}\''
+    ).scalar()
+
+
+def cache_dir():
+    """
+    Diretório do cache local de snapshots, definido pela variável de ambiente
+    DW_CACHE_DIR. O cache fica desligado sem a variável ou sem o pyarrow.
+
+    return:
+    diretório ou None;
+    """
+    directory = os.environ.get('DW_CACHE_DIR')
+    if not directory or pyarrow is None:
+        return None
+
+    return directory
+
+
+def snapshot_path(schema, table_name, version):
+    return os.path.join(cache_dir(), f'{schema}.{table_name}.v{version}.parquet')
+
+
+def snapshot_table(conn, schema, table_name):
+    """
+    Grava um snapshot parquet (zstd) da tabela no cache local, marcado com a
+    versão registrada em controle_carga. Snapshots de versões anteriores são
+    removidos.
+
+    parâmetros:
+    conn -- conexão criada via SqlAlchemy com o servidor DW;
+    schema -- schema da tabela;
+    table_name -- nome da tabela;
+    """
+    if cache_dir() is None:
+        return
+
+    version = table_version(conn, schema, table_name)
+    if version is None:
+        return
+
+    os.makedirs(cache_dir(), exist_ok=True)
+    path = snapshot_path(schema, table_name, version)
+    temp_path = f'{path}.{os.getpid()}.tmp'
     (
-        read_table(conn=conn_input, schema=schema_in, table_name=table).
-            to_sql(name=stg_name,
-                   con=conn_output,
-                   schema="stage",
-                   if_exists=tbl_exists,
-                   index=False)
+        read_table(conn=conn, schema=schema, table_name=table_name, cache=False).
+            to_parquet(temp_path, engine='pyarrow', compression='zstd', index=False)
+    )
+    os.replace(temp_path, path)
+
+    remove_snapshots(schema, table_name, keep=path)
+
+
+def remove_snapshots(schema, table_name, keep=None):
+    """
+    Remove do cache local os snapshots da tabela
+
+    parâmetros:
+    schema -- schema da tabela;
+    table_name -- nome da tabela;
+    keep -- caminho de um snapshot que deve ser mantido;
+    """
+    if cache_dir() is None or not os.path.isdir(cache_dir()):
+        return
+
+    prefix = f'{schema}.{table_name}.v'
+    for file_name in os.listdir(cache_dir()):
+        if (file_name.startswith(prefix) and file_name.endswith('.parquet')
+                and os.path.join(cache_dir(), file_name) != keep):
+            os.remove(os.path.join(cache_dir(), file_name))
+
+
+def read_snapshot(conn, schema, table_name, columns=None):
+    """
+    Lê a tabela do cache local se existir um snapshot da versão atual
+
+    parâmetros:
+    conn -- conexão criada via SqlAlchemy com o servidor DW;
+    schema -- schema da tabela;
+    table_name -- nome da tabela;
+    columns -- lista ou dicionário de colunas (igual ao read_table);
+
+    return:
+    pandas.DataFrame ou None;
+    """
+    if cache_dir() is None:
+        return None
+
+    version = table_version(conn, schema, table_name)
+    if version is None:
+        return None
+
+    path = snapshot_path(schema, table_name, version)
+    if not os.path.exists(path):
+        return None
+
+    if isinstance(columns, dict):
+        return pd.read_parquet(path, engine='pyarrow', columns=list(columns)).rename(columns=columns)
+
+    return pd.read_parquet(path, engine='pyarrow', columns=columns)
+
+
+def read_watermark(conn, stg_name, schema='stage'):
+    """
+    Lê o último valor de watermark registrado para a tabela
+
+    parâmetros:
+    conn -- conexão criada via SqlAlchemy com o servidor do DW;
+    stg_name -- nome da stage (ou da tabela do DW);
+    schema -- schema da tabela;
+
+    return:
+    vl_watermark -- str ou None;
+    """
+    return conn.execute(
+        'SELECT "vl_watermark" FROM "stage"."controle_carga" '
+        f'WHERE "no_schema" = \'{schema}\' AND "no_tabela" = \'{stg_name}\''
+    ).scalar()
+
+
+def register_watermark(conn, schema, table_name, column, value):
+    """
+    Registra o último valor de watermark carregado em uma tabela do DW, sem
+    alterar as versões registradas por register_load
+
+    parâmetros:
+    conn -- conexão criada via SqlAlchemy com o servidor do DW;
+    schema -- schema da tabela;
+    table_name -- nome da tabela;
+    column -- coluna do watermark;
+    value -- maior valor de column já carregado;
+    """
+    create_control_table(conn)
+    conn.execute(
+        'INSERT INTO "stage"."controle_carga" '
+        '("no_schema", "no_tabela", "no_coluna_watermark", "vl_watermark", "dt_atualizacao") '
+        f'VALUES (\'{schema}\', \'{table_name}\', \'{column}\', \'{value}\', NOW()) '
+        'ON CONFLICT ("no_schema", "no_tabela") DO UPDATE SET '
+        '"no_coluna_watermark" = EXCLUDED."no_coluna_watermark", '
+        '"vl_watermark" = EXCLUDED."vl_watermark", '
+        '"dt_atualizacao" = EXCLUDED."dt_atualizacao"'
+    )
+
+
+def update_watermark_sql(stg_name, column, where=None):
+    """
+    Monta o comando que grava o maior valor de column presente na stage como
+    novo watermark. Sem linhas novas o valor anterior é mantido.
+
+    parâmetros:
+    stg_name -- nome da stage;
+    column -- coluna do watermark;
+    where -- filtro das linhas novas;
+
+    return:
+    sql -- str;
+    """
+    if where is None:
+        where_clause = ""
+        new_value = 'EXCLUDED."vl_watermark"'
+    else:
+        where_clause = f"WHERE {where}"
+        new_value = 'COALESCE(EXCLUDED."vl_watermark", "controle_carga"."vl_watermark")'
+
+    return (
+        'INSERT INTO "stage"."controle_carga" '
+        '("no_schema", "no_tabela", "no_coluna_watermark", "vl_watermark", "dt_atualizacao") '
+        f'SELECT \'stage\', \'{stg_name}\', \'{column}\', MAX("{column}")::TEXT, NOW() '
+        f'FROM "stage"."{stg_name}" {where_clause} '
+        'ON CONFLICT ("no_schema", "no_tabela") DO UPDATE SET '
+        '"no_coluna_watermark" = EXCLUDED."no_coluna_watermark", '
+        f'"vl_watermark" = {new_value}, '
+        '"dt_atualizacao" = EXCLUDED."dt_atualizacao"'
     )
 
 
+def same_database(conn_input, conn_output):
+    return conn_input is conn_output or conn_input.url == conn_output.url
+
+
+def table_columns(conn, schema, table_name):
+    response = conn.execute(
+        'SELECT "column_name" FROM "information_schema"."columns" '
+        f'WHERE "table_schema" = \'{schema}\' AND "table_name" = \'{table_name}\''
+    )
+
+    return {row[0] for row in response}
+
+
+def is_unlogged(conn, schema, table_name):
+    response = conn.execute(
+        f'SELECT c.relpersistence FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace '
+        f'WHERE n.nspname = \'{schema}\' AND c.relname = \'{table_name}\''
+    ).scalar()
+
+    return response == 'u'
+
+
+def table_exists(conn, schema, table_name):
+    response = conn.execute(f'SELECT to_regclass(\'"{schema}"."{table_name}"\')').scalar()
+
+    return response is not None
+
+
 def dict_to_str(dict):
     str = list()
     for value in dict.keys():
@@ -40,7 +1831,7 @@ def concat_cols(str):
     return '", "'.join(str)
 
 
-def read_table(conn, schema, table_name, columns=None, where=None, distinct=False):
+def build_query(schema, table_name, columns=None, where=None, distinct=False):
     if distinct:
         distinct_clause = "DISTINCT"
     else:
@@ -56,6 +1847,103 @@ def read_table(conn, schema, table_name, columns=None, where=None, distinct=Fals
     else:
         query = f'SELECT {distinct_clause} "{concat_cols(columns)}" FROM "{schema}"."{table_name}" {where_clause}'
 
-    response = pd.read_sql_query(query, conn)
+    return query
+
+
+def read_table(conn, schema, table_name, columns=None, where=None, distinct=False, cache=True, dtype=None):
+    response = None
+    if cache and where is None and not distinct:
+        response = read_snapshot(conn, schema, table_name, columns=columns)
+
+    if response is None:
+        query = build_query(schema, table_name, columns=columns, where=where, distinct=distinct)
+        response = pd.read_sql_query(query, conn)
+
+    if dtype is not None:
+        response = response.astype(dtype)
+
+    return response
+
+
+def read_table_chunks(conn, schema, table_name, columns=None, where=None, distinct=False, chunksize=50000,
+                      dtype=None):
+    """
+    Lê uma tabela em blocos usando um cursor no servidor, sem materializar
+    a tabela inteira em memória
+
+    parâmetros:
+    conn -- conexão criada via SqlAlchemy com o servidor DW;
+    schema -- schema da tabela;
+    table_name -- nome da tabela;
+    columns -- lista ou dicionário de colunas (igual ao read_table);
+    where -- filtro da consulta;
+    distinct -- aplica SELECT DISTINCT;
+    chunksize -- quantidade de linhas de cada bloco;
+    dtype -- dicionário coluna -> dtype pandas aplicado em cada bloco;
+
+    return:
+    gerador de pandas.DataFrame;
+    """
+    query = build_query(schema, table_name, columns=columns, where=where, distinct=distinct)
+
+    with conn.connect().execution_options(stream_results=True) as connection:
+        for chunk in pd.read_sql_query(query, connection, chunksize=chunksize):
+            yield chunk if dtype is None else chunk.astype(dtype)
+
+
+def read_table_ranges(conn, schema, table_name, key, partitions=4, columns=None, where=None, distinct=False,
+                      transform=None, dtype=None):
+    """
+    Lê uma tabela dividida em faixas de uma chave inteira. Cada faixa é lida
+    em paralelo por uma conexão do pool.
+
+    parâmetros:
+    conn -- conexão criada via SqlAlchemy com o servidor DW. O pool deve ter
+            pelo menos partitions conexões;
+    schema -- schema da tabela;
+    table_name -- nome da tabela;
+    key -- coluna inteira usada para dividir a tabela (ex.: id_venda, sk_dt_venda);
+    partitions -- quantidade de faixas lidas ao mesmo tempo;
+    columns -- lista ou dicionário de colunas (igual ao read_table);
+    where -- condição simples (sem ORDER BY ou LIMIT) aplicada em cada faixa;
+    distinct -- aplica SELECT DISTINCT;
+    transform -- função aplicada em cada faixa logo após a leitura;
+    dtype -- dicionário coluna -> dtype pandas aplicado em cada faixa;
+
+    return:
+    response -- pandas.DataFrame;
+    """
+    where_clause = "" if where is None else f"WHERE {where}"
+    low, high = conn.execute(
+        f'SELECT MIN("{key}"), MAX("{key}") FROM "{schema}"."{table_name}" {where_clause}'
+    ).fetchone()
+
+    if low is None:
+        response = read_table(conn, schema, table_name, columns=columns, where=where, distinct=distinct, dtype=dtype)
+        return response if transform is None else transform(response)
+
+    step = (high - low) // partitions + 1
+    filters = list()
+    for start in range(low, high + 1, step):
+        range_filter = f'"{key}" >= {start} AND "{key}" < {start + step}'
+        if where is not None:
+            range_filter = f'{range_filter} AND ({where})'
+        filters.append(range_filter)
+
+    def read_range(range_filter):
+        frame = read_table(conn, schema, table_name, columns=columns, where=range_filter, distinct=distinct,
+                           dtype=dtype)
+        return frame if transform is None else transform(frame)
+
+    with ThreadPoolExecutor(max_workers=partitions) as executor:
+        frames = list(executor.map(read_range, filters))
+
+    # faixas vazias (buracos na chave) vêm com colunas object e fariam o
+    # concat converter as colunas numéricas das demais faixas para object
+    frames = [frame for frame in frames if len(frame) > 0] or frames[:1]
+    response = pd.concat(frames, ignore_index=True)
+
+    if distinct and columns is not None and key not in columns:
+        response = response.drop_duplicates(ignore_index=True)
 
     return response
@@ -1,10 +1,34 @@
 import time as t
 import pandas as pd
-from pandasql import sqldf
-from sqlalchemy.types import String, Integer
+from sqlalchemy.types import BigInteger, String, Integer
 import DW_TOOLS as dwt
 from CONEXAO import create_connection_postgre
 
+data_type = {
+    "sk_cliente": Integer(),
+    "cd_cliente": Integer(),
+    "no_cliente": String(),
+    "nu_cpf": String(),
+    "nu_telefone": String(),
+    "cd_endereco_cliente": Integer(),
+    "no_estado": String(),
+    "no_cidade": String(),
+    "no_bairro": String(),
+    "ds_rua": String(),
+    "nu_hash_tipo1": BigInteger(),
+    "nu_hash_tipo2": BigInteger()
+}
+
+# declaração da SCD: a dimensão cliente não guarda histórico, todos os
+# atributos são sobrescritos (tipo 1)
+scd_cliente = {
+    "natural_key": "cd_cliente",
+    "surrogate_key": "sk_cliente",
+    "type1": ["no_cliente", "nu_cpf", "nu_telefone", "cd_endereco_cliente", "no_estado", "no_cidade", "no_bairro",
+              "ds_rua"],
+    "type2": []
+}
+
 
 def extract_stg_cliente(conn):
     """
@@ -55,96 +79,15 @@ def extract_stg_cliente(conn):
     return stg_cliente_endereco
 
 
-def extract_dim_cliente(conn):
-    """
-    Extrai os registros da dim_cliente do DW
-
-    parâmetros:
-    conn -- conexão criada via SqlAlchemy com o servidor DW;
-
-    return:
-    dim_cliente -- dataframe da dim_cliente
-    """
-    try:
-        dim_cliente = dwt.read_table(
-            conn=conn,
-            schema="dw",
-            table_name="d_cliente",
-            columns=[
-                'sk_cliente',
-                'cd_cliente',
-                'no_cliente',
-                'nu_cpf',
-                'nu_telefone',
-                'cd_endereco_cliente',
-                'no_estado',
-                'no_bairro',
-                'ds_rua'
-            ]
-        )
-        return dim_cliente
-    except:
-        return None
-
-
-def extract_new_cliente(conn):
-    """
-    Extrai novos registros na stage
-
-    parâmetros:
-    conn -- conexão criada via SqlAlchemy com o servidor DW;
-
-    return:
-    new_values -- dataframe com as atualizações
-    """
-    dim_cliente = extract_dim_cliente(conn)
-
-    stg_cliente = (
-        extract_stg_cliente(conn).assign(
-            tel=lambda x: x.tel.apply(
-                lambda y: y[0:8] + y[-5:]
-            )
-        )
-    )
-
-    new_clientes = (
-        sqldf('\
-            SELECT \
-            stg.id_cliente, \
-            stg.nome, \
-            stg.cpf, \
-            stg.tel, \
-            stg.id_endereco, \
-            stg.estado, \
-            stg.cidade, \
-            stg.bairro, \
-            stg.rua \
-            FROM \
-            stg_cliente stg \
-            LEFT JOIN dim_cliente dim \
-            ON stg.id_cliente = dim.cd_cliente \
-            WHERE dim.cd_cliente IS NULL')
-    )
-
-    new_values = (
-        new_clientes.assign(
-            df_size=dim_cliente['sk_cliente'].max() + 1
-        )
-    )
-
-    return new_values
-
-
-def treat_dim_cliente(new_values):
+def rename_stage_cliente(stg_cliente):
     """
-    Faz o tratamento dos novos registros encontrados na stage
+    Seleciona e renomeia as colunas da stage para o padrão da dimensão
 
     parâmetros:
-    conn -- conexão criada via SqlAlchemy com o servidor DW;
-    new_values -- novos registros ou registros atualizados no formato pandas.Dataframe;
+    stg_cliente -- pandas.Dataframe;
 
     return:
-    trated_values -- registros atualizados no formato pandas.Dataframe;
+    dim_cliente -- pandas.Dataframe;
     """
     columns_name = {
         "id_cliente": "cd_cliente",
@@ -171,7 +114,7 @@ def treat_dim_cliente(new_values):
     ]
 
     dim_cliente = (
-        new_values.
+        stg_cliente.
         filter(select_columns).
         rename(columns=columns_name).
         assign(
@@ -181,15 +124,43 @@ def treat_dim_cliente(new_values):
         )
     )
 
-    if 'df_size' in new_values.columns:
-        size = new_values['df_size'].max()
-        dim_cliente.insert(0, 'sk_cliente', range(size, size + len(dim_cliente)))
-    else:
-        dim_cliente.insert(0, 'sk_cliente', range(1, 1 + len(dim_cliente)))
+    return dim_cliente
+
+
+def treat_dim_cliente(stg_cliente):
+    """
+    Faz o tratamento dos registros da stage para a carga inicial
+
+    parâmetros:
+    stg_cliente -- pandas.Dataframe;
+
+    return:
+    dim_cliente -- pandas.Dataframe;
+    """
+    dim_cliente = rename_stage_cliente(stg_cliente)
+    dim_cliente.insert(0, 'sk_cliente', range(1, 1 + len(dim_cliente)))
 
     return dim_cliente
 
 
+def update_dim_cliente(conn):
+    """
+    Aplica os novos clientes e as alterações da stage na dimensão cliente
+
+    parâmetros:
+    conn -- conexão criada via SqlAlchemy com o servidor DW;
+
+    return:
+    dicionário com a quantidade de linhas inseridas e atualizadas;
+    """
+    stage_cliente = (
+        extract_stg_cliente(conn).
+        pipe(rename_stage_cliente)
+    )
+
+    return dwt.apply_scd(conn, stage_cliente, 'dw', 'd_cliente', dtype=data_type, **scd_cliente)
+
+
 def treat_missing_data(dim_cliente):
     dim_cliente = (
         pd.DataFrame([
@@ -210,30 +181,13 @@ def load_dim_cliente(dim_cliente, conn, action):
     dim_cliente -- pandas.Dataframe;
     conn -- conexão criada via SqlAlchemy com o servidor do DW;
     """
-    data_type = {
-        "sk_cliente": Integer(),
-        "cd_cliente": Integer(),
-        "no_cliente": String(),
-        "nu_cpf": String(),
-        "nu_telefone": String(),
-        "cd_endereco_cliente": Integer(),
-        "no_estado": String(),
-        "no_cidade": String(),
-        "no_bairro": String(),
-        "ds_rua": String()
-    }
-    (
-        dim_cliente.
-        astype('string').
-        to_sql(
-            con=conn,
-            name='d_cliente',
-            schema='dw',
-            if_exists=action,
-            index=False,
-            chunksize=100,
-            dtype=data_type
-        )
+    dwt.load_table(
+        dim_cliente,
+        conn=conn,
+        schema='dw',
+        table_name='d_cliente',
+        if_exists=action,
+        dtype=data_type
     )
 
 
@@ -244,20 +198,22 @@ def run_dim_cliente(conn):
     parâmetros:
     conn -- conexão criada via SqlAlchemy com o servidor do DW;
     """
-    dim_cliente = extract_dim_cliente(conn)
-    if dim_cliente is None:
+    versions = dwt.stage_versions(conn, ['stg_cliente', 'stg_endereco'])
+    if dwt.is_loaded(conn, 'd_cliente', versions):
+        return
+
+    if not dwt.table_exists(conn, 'dw', 'd_cliente'):
         (
             extract_stg_cliente(conn).
             pipe(treat_dim_cliente).
             pipe(treat_missing_data).
+            pipe(dwt.assign_row_hashes, type1=scd_cliente['type1'], type2=scd_cliente['type2']).
             pipe(load_dim_cliente, conn=conn, action='replace')
         )
     else:
-        (
-            extract_new_cliente(conn).
-            pipe(treat_dim_cliente).
-            pipe(load_dim_cliente, conn=conn, action='append')
-        )
+        update_dim_cliente(conn)
+
+    dwt.register_load(conn, 'd_cliente', versions)
 
 
 if __name__ == '__main__':
@@ -1,7 +1,39 @@
+import numpy as np
 import pandas as pd
 import time as t
 from sqlalchemy.types import String, DateTime, Integer
 from CONEXAO import create_connection_postgre
+import DW_TOOLS as dwt
+
+# intervalo horário coberto pela dimensão data
+data_inicio = '2020-01-01'
+data_fim = '2023-01-01'
+
+
+def calculate_sk_data(dates, bounded=True):
+    """
+    Calcula a sk_data de cada data sem consultar a dimensão. A dimensão é
+    gerada com uma linha por hora a partir de data_inicio, então a sk é a
+    quantidade de horas desde data_inicio mais 1. Datas nulas ou fora do
+    intervalo recebem o membro desconhecido (-3).
+
+    parâmetros:
+    dates -- pandas.Series, array ou índice de datas;
+    bounded -- com False as datas fora do intervalo mantêm a sk calculada
+               (usado para limites de partição);
+
+    return:
+    numpy.ndarray int32;
+    """
+    dates = pd.to_datetime(np.asarray(dates)).to_numpy(dtype='datetime64[h]')
+    hours = (dates - np.datetime64(data_inicio, 'h')).astype('int64')
+    total_hours = (np.datetime64(data_fim, 'h') - np.datetime64(data_inicio, 'h')).astype('int64') + 1
+
+    valid = ~np.isnat(dates)
+    if bounded:
+        valid &= (hours >= 0) & (hours < total_hours)
+
+    return np.where(valid, hours + 1, -3).astype('int32')
 
 
 def treat_dim_data():
@@ -16,8 +48,8 @@ def treat_dim_data():
     ]
 
     data = pd.date_range(
-                start='2020-01-01',
-                end='2023-01-01',
+                start=data_inicio,
+                end=data_fim,
                 freq='H')
 
     dim_data = (
@@ -74,17 +106,13 @@ def load_dim_data(dim_data, conn):
         "dt_hora": Integer(),
         "ds_turno": String()
     }
-    (
-        dim_data.astype('string').
-            to_sql(
-            con=conn,
-            name='d_data',
-            schema='dw',
-            if_exists='replace',
-            index=False,
-            chunksize=100,
-            dtype=data_types
-        )
+    dwt.load_table(
+        dim_data,
+        conn=conn,
+        schema='dw',
+        table_name='d_data',
+        if_exists='replace',
+        dtype=data_types
     )
 
 
@@ -100,6 +128,8 @@ def run_dim_data(conn):
             pipe(load_dim_data, conn=conn)
     )
 
+    dwt.register_load(conn, 'd_data', None)
+
 
 if __name__ == '__main__':
     conn_dw = create_connection_postgre(
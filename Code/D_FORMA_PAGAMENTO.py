@@ -1,10 +1,27 @@
 import pandas as pd
 import time as t
-from pandasql import sqldf
 from CONEXAO import create_connection_postgre
-from sqlalchemy.types import String, Integer
+from sqlalchemy.types import BigInteger, String, Integer
 import DW_TOOLS as dwt
 
+data_types = {
+    "sk_forma_pagamento": Integer(),
+    "cd_forma_pagamento": Integer(),
+    "no_forma_pagamento": String(),
+    "ds_forma_pagamento": String(),
+    "nu_hash_tipo1": BigInteger(),
+    "nu_hash_tipo2": BigInteger()
+}
+
+# declaração da SCD: a dimensão forma de pagamento não guarda histórico,
+# todos os atributos são sobrescritos (tipo 1)
+scd_forma_pagamento = {
+    "natural_key": "cd_forma_pagamento",
+    "surrogate_key": "sk_forma_pagamento",
+    "type1": ["no_forma_pagamento", "ds_forma_pagamento"],
+    "type2": []
+}
+
 
 def extract_stg_forma_pagamento(conn):
     """
@@ -30,79 +47,15 @@ def extract_stg_forma_pagamento(conn):
     return stg_forma_pagamento
 
 
-def extract_dim_forma_pagamento(conn):
-    """
-    Extrai os registros da dim_forma_pagamento do DW
-
-    parâmetros:
-    conn -- conexão criada via SqlAlchemy com o servidor DW;
-
-    return:
-    dim_forma_pagamento -- dataframe da dim_forma_pagamento
-    """
-    try:
-        dim_forma_pagamento = dwt.read_table(
-            conn=conn,
-            schema='dw',
-            table_name='d_forma_pagamento',
-            columns=[
-                'sk_forma_pagamento',
-                'cd_forma_pagamento',
-                'no_forma_pagamento',
-                'ds_forma_pagamento'
-            ]
-        )
-
-        return dim_forma_pagamento
-    except:
-        return None
-
-
-def extract_new_forma_pagamento(conn):
-    """
-    Extrai novos registros na stage
-
-    parâmetros:
-    conn -- conexão criada via SqlAlchemy com o servidor DW;
-
-    return:
-    new_values -- dataframe com as atualizações
+def rename_stage_forma_pagamento(stg_forma_pagamento):
     """
-    dim_forma_pagamento = extract_dim_forma_pagamento(conn)
-
-    stg_forma_pagamento = extract_stg_forma_pagamento(conn)
-
-    new_funcionarios = (
-        sqldf('\
-                SELECT \
-                stg.id_pagamento, \
-                stg.nome, \
-                stg.descricao \
-                FROM stg_forma_pagamento stg \
-                LEFT JOIN dim_forma_pagamento dim \
-                ON stg.id_pagamento = dim.cd_forma_pagamento \
-                WHERE dim.cd_forma_pagamento IS NULL')
-    )
-
-    new_values = (
-        new_funcionarios.assign(
-            df_size=dim_forma_pagamento['sk_forma_pagamento'].max() + 1
-        )
-    )
-
-    return new_values
-
-
-def treat_dim_forma_pagamento(new_values):
-    """
-    Faz o tratamento dos novos registros encontrados na stage
+    Seleciona e renomeia as colunas da stage para o padrão da dimensão
 
     parâmetros:
-    conn -- conexão criada via SqlAlchemy com o servidor DW;
-    new_values -- novos registros ou registros atualizados no formato pandas.Dataframe;
+    stg_forma_pagamento -- pandas.Dataframe;
 
     return:
-    dim_forma_pagamento -- dataframe dos novos registros tratados;
+    dim_forma_pagamento -- pandas.Dataframe;
     """
     columns_names = {
         "id_pagamento": "cd_forma_pagamento",
@@ -117,7 +70,7 @@ def treat_dim_forma_pagamento(new_values):
     ]
 
     dim_forma_pagamento = (
-        new_values.
+        stg_forma_pagamento.
         filter(select_columns).
         rename(columns=columns_names).
         assign(
@@ -129,21 +82,47 @@ def treat_dim_forma_pagamento(new_values):
         )
     )
 
-    if 'df_size' in new_values.columns:
-        size = new_values['df_size'].max()
-        dim_forma_pagamento.insert(
-            0,
-            'sk_forma_pagamento',
-            range(size, size + len(dim_forma_pagamento)))
-    else:
-        dim_forma_pagamento.insert(
-            0,
-            'sk_forma_pagamento',
-            range(1, 1 + len(dim_forma_pagamento)))
+    return dim_forma_pagamento
+
+
+def treat_dim_forma_pagamento(stg_forma_pagamento):
+    """
+    Faz o tratamento dos registros da stage para a carga inicial
+
+    parâmetros:
+    stg_forma_pagamento -- pandas.Dataframe;
+
+    return:
+    dim_forma_pagamento -- pandas.Dataframe;
+    """
+    dim_forma_pagamento = rename_stage_forma_pagamento(stg_forma_pagamento)
+    dim_forma_pagamento.insert(
+        0,
+        'sk_forma_pagamento',
+        range(1, 1 + len(dim_forma_pagamento)))
 
     return dim_forma_pagamento
 
 
+def update_dim_forma_pagamento(conn):
+    """
+    Aplica as novas formas de pagamento e as alterações da stage na dimensão
+
+    parâmetros:
+    conn -- conexão criada via SqlAlchemy com o servidor DW;
+
+    return:
+    dicionário com a quantidade de linhas inseridas ou atualizadas;
+    """
+    stage_forma_pagamento = (
+        extract_stg_forma_pagamento(conn).
+        pipe(rename_stage_forma_pagamento)
+    )
+
+    return dwt.apply_scd(conn, stage_forma_pagamento, 'dw', 'd_forma_pagamento', dtype=data_types,
+                         **scd_forma_pagamento)
+
+
 def treat_missing_data(dim_forma_pagamento):
     dim_forma_pagamento = (
         pd.DataFrame([
@@ -165,24 +144,13 @@ def load_dim_forma_pagamento(dim_forma_pagamento, conn, action):
     dim_forma_pagamento -- pandas.Dataframe;
     conn -- conexão criada via SqlAlchemy com o servidor do DW;
     """
-    data_types = {
-        "sk_forma_pagamento": Integer(),
-        "cd_forma_pagamento": Integer(),
-        "no_forma_pagamento": String(),
-        "ds_forma_pagamento": String()
-    }
-    (
-        dim_forma_pagamento.
-        astype('string').
-        to_sql(
-            con=conn,
-            name='d_forma_pagamento',
-            schema='dw',
-            if_exists=action,
-            index=False,
-            chunksize=100,
-            dtype=data_types
-        )
+    dwt.load_table(
+        dim_forma_pagamento,
+        conn=conn,
+        schema='dw',
+        table_name='d_forma_pagamento',
+        if_exists=action,
+        dtype=data_types
     )
 
 
@@ -193,20 +161,22 @@ def run_dim_forma_pagamento(conn):
     parâmetros:
     conn -- conexão criada via SqlAlchemy com o servidor do DW;
     """
-    dim_forma_pagamento = extract_dim_forma_pagamento(conn)
-    if dim_forma_pagamento is None:
+    versions = dwt.stage_versions(conn, ['stg_forma_pagamento'])
+    if dwt.is_loaded(conn, 'd_forma_pagamento', versions):
+        return
+
+    if not dwt.table_exists(conn, 'dw', 'd_forma_pagamento'):
         (
             extract_stg_forma_pagamento(conn).
             pipe(treat_dim_forma_pagamento).
             pipe(treat_missing_data).
+            pipe(dwt.assign_row_hashes, type1=scd_forma_pagamento['type1']).
             pipe(load_dim_forma_pagamento, conn=conn, action='replace')
         )
     else:
-        (
-            extract_new_forma_pagamento(conn).
-            pipe(treat_dim_forma_pagamento).
-            pipe(load_dim_forma_pagamento, conn=conn, action='append')
-        )
+        update_dim_forma_pagamento(conn)
+
+    dwt.register_load(conn, 'd_forma_pagamento', versions)
 
 
 if __name__ == '__main__':
@@ -1,10 +1,29 @@
 import pandas as pd
 import time as t
-from pandasql import sqldf
-from sqlalchemy.types import Date, String, Integer
+from sqlalchemy.types import BigInteger, Date, String, Integer
 from CONEXAO import create_connection_postgre
 import DW_TOOLS as dwt
 
+data_types = {
+    "sk_funcionario": Integer(),
+    "cd_funcionario": Integer(),
+    "no_funcionario": String(),
+    "nu_cpf": String(),
+    "nu_telefone": String(),
+    "dt_nascimento": Date(),
+    "nu_hash_tipo1": BigInteger(),
+    "nu_hash_tipo2": BigInteger()
+}
+
+# declaração da SCD: a dimensão funcionario não guarda histórico, todos os
+# atributos são sobrescritos (tipo 1)
+scd_funcionario = {
+    "natural_key": "cd_funcionario",
+    "surrogate_key": "sk_funcionario",
+    "type1": ["no_funcionario", "nu_cpf", "nu_telefone", "dt_nascimento"],
+    "type2": []
+}
+
 
 def extract_stg_funcionario(conn):
     """
@@ -26,89 +45,22 @@ def extract_stg_funcionario(conn):
             'cpf',
             'tel',
             'data_nascimento'
-        ]
+        ],
+        dtype={'data_nascimento': 'datetime64[ns]'}
     )
 
     return stg_funcionario
 
 
-def extract_dim_funcionario(conn):
-    """
-    Extrai os registros da dim_funcionario do DW
-
-    parâmetros:
-    conn -- conexão criada via SqlAlchemy com o servidor DW;
-
-    return:
-    dim_funcionario -- dataframe da dim_funcionario
-    """
-    try:
-        dim_funcionario = dwt.read_table(
-            conn=conn,
-            schema='dw',
-            table_name='d_funcionario',
-            columns=[
-                'sk_funcionario',
-                'cd_funcionario',
-                'no_funcionario',
-                'nu_cpf',
-                'nu_telefone',
-                'dt_nascimento'
-            ]
-        )
-
-        return dim_funcionario
-    except:
-        return None
-
-
-def extract_new_funcionario(conn):
+def rename_stage_funcionario(stg_funcionario):
     """
-    Extrai novos registros na stage
+    Seleciona e renomeia as colunas da stage para o padrão da dimensão
 
     parâmetros:
-    conn -- conexão criada via SqlAlchemy com o servidor DW;
-
-    return:
-    new_values -- dataframe com as atualizações
-    """
-    dim_funcionario = extract_dim_funcionario(conn)
-
-    stg_funcionario = extract_stg_funcionario(conn)
-
-    new_funcionarios = (
-        sqldf('\
-                SELECT stg.id_funcionario, \
-                stg.nome, \
-                stg.cpf, \
-                stg.tel, \
-                stg.data_nascimento \
-                FROM \
-                stg_funcionario stg \
-                LEFT JOIN dim_funcionario dim \
-                ON stg.id_funcionario = dim.cd_funcionario \
-                WHERE dim.cd_funcionario IS NULL')
-    )
-
-    new_values = (
-        new_funcionarios.assign(
-            df_size=dim_funcionario['sk_funcionario'].max() + 1
-        )
-    )
-
-    return new_values
-
-
-def treat_dim_funcionario(new_values):
-    """
-    Faz o tratamento dos novos registros encontrados na stage
-
-    parâmetros:
-    conn -- conexão criada via SqlAlchemy com o servidor DW;
-    new_values -- novos registros ou registros atualizados no formato pandas.Dataframe;
+    stg_funcionario -- pandas.Dataframe;
 
     return:
-    trated_values -- dataframe dos novos registros tratados;
+    dim_funcionario -- pandas.Dataframe;
     """
     columns_names = {
         "id_funcionario": "cd_funcionario",
@@ -127,22 +79,48 @@ def treat_dim_funcionario(new_values):
     ]
 
     dim_funcionario = (
-        new_values.
+        stg_funcionario.
         filter(select_columns).
-        rename(columns=columns_names).
-        assign(
-            dt_nascimento=lambda x: x.dt_nascimento.astype('datetime64'))
+        rename(columns=columns_names)
     )
 
-    if 'df_size' in new_values.columns:
-        size = new_values['df_size'].max()
-        dim_funcionario.insert(0, 'sk_funcionario', range(size, size + len(dim_funcionario)))
-    else:
-        dim_funcionario.insert(0, 'sk_funcionario', range(1, 1 + len(dim_funcionario)))
+    return dim_funcionario
+
+
+def treat_dim_funcionario(stg_funcionario):
+    """
+    Faz o tratamento dos registros da stage para a carga inicial
+
+    parâmetros:
+    stg_funcionario -- pandas.Dataframe;
+
+    return:
+    dim_funcionario -- pandas.Dataframe;
+    """
+    dim_funcionario = rename_stage_funcionario(stg_funcionario)
+    dim_funcionario.insert(0, 'sk_funcionario', range(1, 1 + len(dim_funcionario)))
 
     return dim_funcionario
 
 
+def update_dim_funcionario(conn):
+    """
+    Aplica os novos funcionarios e as alterações da stage na dimensão funcionario
+
+    parâmetros:
+    conn -- conexão criada via SqlAlchemy com o servidor DW;
+
+    return:
+    dicionário com a quantidade de linhas inseridas e atualizadas;
+    """
+    stage_funcionario = (
+        extract_stg_funcionario(conn).
+        pipe(rename_stage_funcionario)
+    )
+
+    return dwt.apply_scd(conn, stage_funcionario, 'dw', 'd_funcionario', dtype=data_types, **scd_funcionario)
+
+
 def treat_missing_data(dim_funcionario):
     dim_funcionario = (
         pd.DataFrame([
@@ -163,28 +141,13 @@ def load_dim_funcionario(dim_funcionario, conn, action):
     dim_funcionario -- pandas.Dataframe;
     conn -- conexão criada via SqlAlchemy com o servidor do DW;
     """
-    data_types = {
-        "sk_funcionario": Integer(),
-        "cd_funcionario": Integer(),
-        "no_funcionario": String(),
-        "nu_cpf": String(),
-        "nu_telefone": String(),
-        "dt_nascimento": Date()
-    }
-
-    (
-        dim_funcionario.
-        astype('string').
-        to_sql(
-            con=conn,
-            name='d_funcionario',
-            schema='dw',
-            if_exists=action,
-            index=False,
-            chunksize=100,
-            dtype=data_types
-        )
-
+    dwt.load_table(
+        dim_funcionario,
+        conn=conn,
+        schema='dw',
+        table_name='d_funcionario',
+        if_exists=action,
+        dtype=data_types
     )
 
 
@@ -195,20 +158,22 @@ def run_dim_funcionario(conn):
     parâmetros:
     conn -- conexão criada via SqlAlchemy com o servidor do DW;
     """
-    dim_funcionario = extract_dim_funcionario(conn)
-    if dim_funcionario is None:
+    versions = dwt.stage_versions(conn, ['stg_funcionario'])
+    if dwt.is_loaded(conn, 'd_funcionario', versions):
+        return
+
+    if not dwt.table_exists(conn, 'dw', 'd_funcionario'):
         (
             extract_stg_funcionario(conn).
             pipe(treat_dim_funcionario).
             pipe(treat_missing_data).
+            pipe(dwt.assign_row_hashes, type1=scd_funcionario['type1'], type2=scd_funcionario['type2']).
             pipe(load_dim_funcionario, conn=conn, action='replace')
         )
     else:
-        (
-            extract_new_funcionario(conn).
-            pipe(treat_dim_funcionario).
-            pipe(load_dim_funcionario, conn=conn, action='append')
-        )
+        update_dim_funcionario(conn)
+
+    dwt.register_load(conn, 'd_funcionario', versions)
 
 
 if __name__ == '__main__':
@@ -1,11 +1,38 @@
 import pandas as pd
 import datetime as dt
 import time as t
-from sqlalchemy.types import DateTime, String, Integer
-from pandasql import sqldf
+from sqlalchemy.types import BigInteger, DateTime, String, Integer
 import DW_TOOLS as dwt
 from CONEXAO import create_connection_postgre
 
+data_types = {
+    "sk_loja": Integer(),
+    "cd_loja": Integer(),
+    "no_loja": String(),
+    "ds_razao_social": String(),
+    "nu_cnpj": String(),
+    "nu_telefone": String(),
+    "cd_endereco_loja": Integer(),
+    "no_estado": String(),
+    "no_cidade": String(),
+    "no_bairro": String(),
+    "ds_rua": String(),
+    "fl_ativo": Integer(),
+    "dt_inicio": DateTime(),
+    "dt_fim": DateTime(),
+    "nu_hash_tipo1": BigInteger(),
+    "nu_hash_tipo2": BigInteger()
+}
+
+# declaração da SCD: o nome e os dados cadastrais são sobrescritos (tipo 1),
+# mudanças de endereço geram uma nova versão da loja (tipo 2)
+scd_loja = {
+    "natural_key": "cd_loja",
+    "surrogate_key": "sk_loja",
+    "type1": ["no_loja", "ds_razao_social", "nu_cnpj", "nu_telefone"],
+    "type2": ["cd_endereco_loja", "no_estado", "no_cidade", "no_bairro", "ds_rua"]
+}
+
 
 def extract_stage_loja(conn):
     """
@@ -58,47 +85,9 @@ def extract_stage_loja(conn):
     return stg_loja_endereco
 
 
-def extract_dim_loja(conn):
+def rename_stage_loja(stg_loja_endereco):
     """
-    Extrai os dados da dimensão loja
-
-    parâmetros:
-    conn -- conexão criada via SqlAlchemy com o servidor DW;
-
-    return:
-    dim_loja -- pandas.Dataframe;
-    """
-    try:
-        dim_loja = dwt.read_table(
-            conn=conn,
-            schema='dw',
-            table_name='d_loja',
-            columns=[
-                'sk_loja',
-                'cd_loja',
-                'no_loja',
-                'ds_razao_social',
-                'nu_cnpj',
-                'nu_telefone',
-                'cd_endereco_loja',
-                'no_estado',
-                'no_cidade',
-                'no_bairro',
-                'ds_rua',
-                'fl_ativo',
-                'dt_inicio',
-                'dt_fim'],
-            where='"sk_loja" > 0'
-        )
-
-        return dim_loja
-    except:
-        return None
-
-
-def treat_dim_loja(stg_loja_endereco):
-    """
-    Faz o tratamento dos dados extraidos das stages
+    Seleciona e renomeia as colunas da stage para o padrão da dimensão
 
     parâmetros:
     stg_loja_endereco -- pandas.Dataframe;
@@ -134,9 +123,26 @@ def treat_dim_loja(stg_loja_endereco):
     dim_loja = (
         stg_loja_endereco.
         filter(select_columns).
-        rename(columns=columns_names).
+        rename(columns=columns_names)
+    )
+
+    return dim_loja
+
+
+def treat_dim_loja(stg_loja_endereco):
+    """
+    Faz o tratamento dos dados extraidos das stages
+
+    parâmetros:
+    stg_loja_endereco -- pandas.Dataframe;
+
+    return:
+    dim_loja -- pandas.Dataframe;
+    """
+    dim_loja = (
+        stg_loja_endereco.
+        pipe(rename_stage_loja).
         assign(
-            cd_loja=lambda x: x.cd_loja.astype("int64"),
             fl_ativo=lambda x: 1,
             dt_inicio=lambda x: dt.date(1900, 1, 1),
             dt_fim=None
@@ -159,153 +165,23 @@ def treat_dim_loja(stg_loja_endereco):
     return dim_loja
 
 
-def extract_new_records(conn):
+def update_dim_loja(conn):
     """
-    Extrai novos registros e registros atualizados na stage
+    Aplica as novas lojas e as alterações da stage na dimensão loja
 
     parâmetros:
     conn -- conexão criada via SqlAlchemy com o servidor DW;
 
     return:
-    new_values: dataframe com as atualizações
+    dicionário com a quantidade de linhas inseridas, atualizadas e expiradas;
     """
-    # extraindo os dados da stage
-    df_stage = extract_stage_loja(conn)
-
-    # extraindo os dados do dw
-    df_dw = extract_dim_loja(conn)
-
-    # fazendo a diferença da stage com o dw, para saber os dados que atualizaram
-    new_records = (
-        sqldf("\
-            SELECT \
-            stg.id_loja, \
-            stg.nome_loja, \
-            stg.razao_social, \
-            stg.cnpj, \
-            stg.telefone, \
-            stg.id_endereco, \
-            stg.estado, \
-            stg.cidade, \
-            stg.bairro, \
-            stg.rua \
-            FROM df_stage stg\
-            LEFT JOIN df_dw dw \
-            ON stg.id_loja = dw.cd_loja \
-            WHERE dw.cd_loja IS NULL").
-        assign(
-            fl_tipo_update=1
-        )
+    stage_loja = (
+        extract_stage_loja(conn).
+        pipe(rename_stage_loja)
     )
 
-    new_updates = (
-        sqldf("\
-            SELECT \
-            stg.id_loja, \
-            stg.nome_loja, \
-            stg.razao_social, \
-            stg.cnpj, \
-            stg.telefone, \
-            stg.id_endereco, \
-            stg.estado, \
-            stg.cidade, \
-            stg.bairro, \
-            stg.rua \
-            FROM df_stage stg \
-            INNER JOIN df_dw dw \
-            ON stg.id_loja = dw.cd_loja \
-            WHERE \
-            stg.estado != dw.no_estado \
-            OR stg.cidade != dw.no_cidade \
-            OR stg.bairro != dw.no_bairro \
-            OR stg.rua != dw.ds_rua").
-        assign(
-            fl_tipo_update=2
-        )
-    )
-
-    new_names = (
-        sqldf("\
-            SELECT \
-            stg.id_loja, \
-            stg.nome_loja, \
-            stg.razao_social, \
-            stg.cnpj, \
-            stg.telefone, \
-            stg.id_endereco, \
-            stg.estado, \
-            stg.cidade, \
-            stg.bairro, \
-            stg.rua \
-            FROM df_stage stg \
-            INNER JOIN df_dw dw \
-            ON stg.id_loja = dw.cd_loja \
-            WHERE stg.nome_loja != dw.no_loja").
-        assign(
-            fl_tipo_update=3
-        )
-    )
-    new_values = (
-        pd.concat([new_records, new_updates, new_names]).assign(
-            df_size=df_dw['sk_loja'].max() + 1
-        )
-    )
-
-    return new_values
-
-
-def treat_updated_loja(new_values):
-    """
-    Faz o tratamento dos fluxos de execução da SCD loja
-
-    parâmetros:
-    conn -- conexão criada via SqlAlchemy com o servidor DW;
-
-    return:
-    insert_records ou updated_values -- pandas.Dataframe;
-    """
-    select_columns = [
-        'cd_loja',
-        'no_loja',
-        'ds_razao_social',
-        'nu_cnpj',
-        'nu_telefone',
-        'cd_endereco_loja',
-        'no_estado',
-        'no_cidade',
-        'no_bairro',
-        'ds_rua',
-    ]
-
-    columns_names = {
-        "id_loja": "cd_loja",
-        "nome_loja": "no_loja",
-        "razao_social": "ds_razao_social",
-        "cnpj": "nu_cnpj",
-        "telefone": "nu_telefone",
-        "id_endereco": "cd_endereco_loja",
-        "estado": "no_estado",
-        "cidade": "no_cidade",
-        "bairro": "no_bairro",
-        "rua": "ds_rua"
-    }
-
-    size = new_values['df_size'].max()
-
-    # extraindo as linhas que foram alteradas e padronizando os dados
-    trated_values = (
-        new_values.
-        query('fl_tipo_update != 3').
-        rename(columns=columns_names).
-        filter(items=select_columns).
-        assign(
-            dt_inicio=lambda x: pd.to_datetime("today"),
-            dt_fim=None,
-            fl_ativo=lambda x: 1)
-    )
-    trated_values.insert(0, 'sk_loja', range(size, size + len(new_values)))
-
-    return trated_values
+    return dwt.apply_scd(conn, stage_loja, 'dw', 'd_loja', dtype=data_types, new_start=dt.datetime(1900, 1, 1),
+                         **scd_loja)
 
 
 def load_dim_loja(dim_loja, conn, action):
@@ -317,63 +193,18 @@ def load_dim_loja(dim_loja, conn, action):
     conn -- conexão criada via SqlAlchemy com o servidor do DW;
     action -- if_exists (append, replace...)
     """
-    data_types = {
-        "sk_loja": Integer(),
-        "cd_loja": Integer(),
-        "no_loja": String(),
-        "ds_razao_social": String(),
-        "nu_cnpj": String(),
-        "nu_telefone": String(),
-        "cd_endereco_loja": Integer(),
-        "no_estado": String(),
-        "no_cidade": String(),
-        "no_bairro": String,
-        "ds_rua": String(),
-        "fl_ativo": Integer(),
-        "dt_inicio": DateTime(),
-        "dt_fim": DateTime()
-    }
-    (
-        dim_loja.
-        astype('string').
-        to_sql(
-            con=conn,
-            name='d_loja',
-            schema='dw',
-            if_exists=action,
-            index=False,
-            chunksize=100,
-            dtype=data_types
-        )
+    dwt.load_table(
+        dim_loja,
+        conn=conn,
+        schema='dw',
+        table_name='d_loja',
+        if_exists=action,
+        dtype=data_types
     )
 
     return dim_loja
 
 
-def update_new_values(dim_loja, conn):
-    new_names = dim_loja.query('fl_tipo_update == 3')
-    if len(new_names) > 0:
-        for cd in new_names['id_loja']:
-            nome = dim_loja.query(f"id_loja == {cd}")["id_loja"].item()
-            sql = (f'\
-                    UPDATE "dw"."d_loja"\
-                    SET "no_loja" = \'{str(nome)}\'\
-                    WHERE "cd_loja" = {cd} AND "fl_ativo" = 1;')
-            conn.execute(sql)
-
-    new_values = dim_loja.query('fl_tipo_update == 2')
-    if len(new_values) > 0:
-        for cd in new_values['cd_loja']:
-            sql = (f'\
-                UPDATE "dw"."d_loja"\
-                SET "fl_ativo" = {0},\
-                "dt_fim" = \'{pd.to_datetime("today")}\'\
-                WHERE "cd_loja" = {cd} AND "fl_ativo" = 1;')
-            conn.execute(sql)
-
-    return dim_loja
-
-
 def run_dim_loja(conn):
     """
     Executa o pipeline da dimensão loja.
@@ -381,21 +212,21 @@ def run_dim_loja(conn):
     parâmetros:
     conn -- conexão criada via SqlAlchemy com o servidor do DW;
     """
-    dim_loja = extract_dim_loja(conn)
-    if dim_loja is None:
+    versions = dwt.stage_versions(conn, ['stg_loja', 'stg_endereco'])
+    if dwt.is_loaded(conn, 'd_loja', versions):
+        return
+
+    if not dwt.table_exists(conn, 'dw', 'd_loja'):
         (
             extract_stage_loja(conn=conn).
             pipe(treat_dim_loja).
+            pipe(dwt.assign_row_hashes, type1=scd_loja['type1'], type2=scd_loja['type2']).
             pipe(load_dim_loja, conn=conn, action='replace')
         )
     else:
-        (
-            extract_new_records(conn).
-            pipe(update_new_values, conn=conn).
-            pipe(treat_updated_loja).
-            pipe(load_dim_loja, conn=conn, action='append')
+        update_dim_loja(conn)
 
-        )
+    dwt.register_load(conn, 'd_loja', versions)
 
 
 if __name__ == '__main__':
@@ -1,8 +1,7 @@
 import pandas as pd
 import unidecode as uc
 import time as t
-from sqlalchemy.types import String, DateTime, Float, Integer
-from pandasql import sqldf
+from sqlalchemy.types import BigInteger, String, DateTime, Float, Integer
 import DW_TOOLS as dwt
 from CONEXAO import create_connection_postgre
 
@@ -17,6 +16,31 @@ columns_names = {
     "ativo": "fl_ativo"
 }
 
+data_types = {
+    "sk_produto": Integer(),
+    "cd_produto": Integer(),
+    "no_produto": String(),
+    "cd_barra": String(),
+    "vl_preco_custo": Float(),
+    "vl_percentual_lucro": Float(),
+    "dt_cadastro": DateTime(),
+    "fl_ativo": Integer(),
+    "dt_inicio": DateTime(),
+    "dt_fim": DateTime(),
+    "ds_categoria": String(),
+    "nu_hash_tipo1": BigInteger(),
+    "nu_hash_tipo2": BigInteger()
+}
+
+# declaração da SCD: mudanças de preço geram uma nova versão do produto (tipo 2),
+# os dados cadastrais são sobrescritos (tipo 1)
+scd_produto = {
+    "natural_key": "cd_produto",
+    "surrogate_key": "sk_produto",
+    "type1": ["no_produto", "cd_barra", "dt_cadastro", "ds_categoria"],
+    "type2": ["vl_preco_custo", "vl_percentual_lucro"]
+}
+
 categorias = {'cafe da manhã': {"CAFE", "ACHOCOLATADO", "CEREAIS", "PAO",
                                 "ACUCAR", "ADOCANTE", "BISCOITO",
                                 "GELEIA", "IOGURTE", "IORGUTE", "FANDANGOS"},
@@ -76,46 +100,13 @@ def extract_stage_produto(conn):
             'percentual_lucro',
             'data_cadastro',
             'ativo'],
-        where=f'"id_produto" > 0 order by "id_produto";'
+        where=f'"id_produto" > 0 order by "id_produto";',
+        dtype={'data_cadastro': 'datetime64[ns]'}
     )
 
     return stg_produto
 
 
-def extract_dim_produto(conn):
-    """
-    Extrai os dados da dimensão produto
-    parâmetros:
-    conn -- conexão criada via SqlAlchemy com o servidor DW;
-    return:
-    dim_produto -- pandas.Dataframe;
-    """
-    try:
-        dim_produto = dwt.read_table(
-            conn=conn,
-            schema='dw',
-            table_name='d_produto',
-            columns=[
-                'sk_produto',
-                'cd_produto',
-                'no_produto',
-                'cd_barra',
-                'vl_preco_custo',
-                'vl_percentual_lucro',
-                'dt_cadastro',
-                'fl_ativo',
-                'dt_inicio',
-                'dt_fim',
-                'ds_categoria'],
-            where=f'"cd_produto" > 0 \
-            and "fl_ativo" = 1\
-            order by "cd_produto";'
-        )
-        return dim_produto
-    except:
-        return None
-
-
 def treat_dim_produto(stg_produto):
     """
     Faz o tratamento dos dados extraidos das stages
@@ -138,21 +129,13 @@ def treat_dim_produto(stg_produto):
         filter(select_columns).
         rename(columns=columns_names).
         assign(
-            vl_preco_custo=lambda x: x.vl_preco_custo.apply(
-                lambda y: float(y.replace(",", "."))),
-            vl_percentual_lucro=lambda x: x.vl_percentual_lucro.apply(
-                lambda y: float(y.replace(",", "."))),
-            dt_cadastro=lambda x: x.dt_cadastro.apply(
-                lambda y: y[:10]),
-            dt_inicio=lambda x: pd.to_datetime(x.dt_cadastro),
+            dt_inicio=lambda x: x.dt_cadastro,
             dt_fim=None).
         assign(
             ds_categoria=lambda x: x.no_produto.apply(
                 lambda y: classificar_produto(y))).
         assign(
-            dt_cadastro=lambda x: pd.to_datetime(x.dt_cadastro),
-            no_produto=lambda x: x.no_produto.astype(str),
-            fl_ativo=lambda x: x.fl_ativo.astype("int64"))
+            no_produto=lambda x: x.no_produto.astype(str))
     )
 
     dim_produto.insert(0, 'sk_produto', range(1, 1 + len(dim_produto)))
@@ -168,136 +151,32 @@ def treat_dim_produto(stg_produto):
     return dim_produto
 
 
-def extract_new_produto(conn):
+def update_dim_produto(conn):
     """
-    Extrai novos registros e registros atualizados na stage
+    Aplica os novos produtos e as alterações da stage na dimensão produto
     parâmetros:
     conn -- conexão criada via SqlAlchemy com o servidor DW;
     return:
-    new_values: dataframe com as atualizações
+    dicionário com a quantidade de linhas inseridas, atualizadas e expiradas;
     """
-    df_stage = (
+    stage_produto = (
         extract_stage_produto(conn).
         rename(columns=columns_names).
+        filter([
+            "cd_produto",
+            "no_produto",
+            "cd_barra",
+            "vl_preco_custo",
+            "vl_percentual_lucro",
+            "dt_cadastro"]).
         assign(
-            vl_preco_custo=lambda x: x.vl_preco_custo.apply(
-                lambda y: float(y.replace(",", "."))),
-            vl_percentual_lucro=lambda x: x.vl_percentual_lucro.apply(
-                lambda y: float(y.replace(",", "."))),
-            dt_cadastro=lambda x: x.dt_cadastro.apply(
-                lambda y: y[:10])).
-        assign(dt_cadastro=lambda x: x.dt_cadastro.astype("datetime64"))
-    )
-
-    df_dw = extract_dim_produto(conn)
-
-    new_records = (
-        sqldf("\
-            SELECT df_stage.*\
-            FROM df_stage\
-            LEFT JOIN df_dw \
-            ON df_stage.cd_produto = df_dw.cd_produto\
-            WHERE df_dw.cd_produto IS NULL").
-        assign(
-            fl_tipo_update=1
-        )
-    )
-
-    new_updates = (
-        sqldf("\
-            SELECT stg.* \
-            FROM df_stage stg \
-            INNER JOIN df_dw dw \
-            ON stg.cd_produto = dw.cd_produto \
-            WHERE stg.vl_preco_custo != dw.vl_preco_custo\
-            OR stg.vl_percentual_lucro != dw.vl_percentual_lucro").
-        assign(
-            fl_tipo_update=2
-        )
-    )
-
-    new_names = (
-        sqldf("\
-            SELECT stg.* \
-            FROM df_stage stg \
-            INNER JOIN df_dw dw \
-            ON stg.cd_produto = dw.cd_produto \
-            WHERE stg.no_produto != dw.no_produto").
-        assign(
-            fl_tipo_update=3
-        )
-    )
-
-    new_values = (
-        pd.concat([new_records, new_updates, new_names]).assign(
-            df_size=df_dw['sk_produto'].max() + 1
-        )
-    )
-    print(new_updates)
-    return new_values
-
-
-def treat_new_produto(new_values, conn):
-    """
-    Faz o tratamento dos fluxos de execução da SCD produto
-    parâmetros:
-    conn -- conexão criada via SqlAlchemy com o servidor DW;
-    new_values -- novos registros ou registros atualizados no formato pandas.Dataframe;
-    return:
-    trated_values -- registros atualizados no formato pandas.Dataframe;
-    """
-    select_columns = [
-        "cd_produto",
-        "no_produto",
-        "cd_barra",
-        "dt_cadastro",
-        "vl_preco_custo",
-        "vl_percentual_lucro"
-    ]
-
-    size = new_values['df_size'].max()
-    new_names = new_values.query('fl_tipo_update == 3')
-
-    if len(new_values) > 0:
-        for cd in new_names['cd_produto']:
-            nome = new_names.query(f"cd_produto == {cd}")["no_produto"].item()
-            sql = (
-                f'\
-                UPDATE "dw"."d_produto"\
-                SET "no_produto" = \'{str(nome)}\'\
-                WHERE "cd_produto" = {cd} AND "fl_ativo" = 1;'
-            )
-            conn.execute(sql)
-
-    # extraindo linhas que serão atualizadas
-    trated_values = (
-        new_values.
-        query('fl_tipo_update != 3').
-        filter(select_columns).
-        assign(
-            dt_inicio=lambda x: pd.to_datetime("today"),
-            dt_fim=None,
-            fl_ativo=lambda x: 1,
-            dt_cadastro=lambda x: x.dt_cadastro.astype("datetime64"),
+            no_produto=lambda x: x.no_produto.astype(str),
             ds_categoria=lambda x: x.no_produto.apply(
-                lambda y: classificar_produto(y))
-        )
+                lambda y: classificar_produto(y)))
     )
 
-    trated_values.insert(0, 'sk_produto', range(size, size + len(new_values)))
-
-    # identificando as sks que precisam ser atualizadas
-    for cd in trated_values['cd_produto']:
-        sql = (
-            f'\
-                UPDATE "dw"."d_produto"\
-                SET "fl_ativo" = {0},\
-                "dt_fim" = \'{pd.to_datetime("today")}\'\
-                WHERE "cd_produto" = {cd} and "fl_ativo" = 1;'
-        )
-        conn.execute(sql)
-
-    return trated_values
+    return dwt.apply_scd(conn, stage_produto, 'dw', 'd_produto', dtype=data_types, new_start='dt_cadastro',
+                         **scd_produto)
 
 
 def load_dim_produto(dim_produto, conn, action):
@@ -308,32 +187,13 @@ def load_dim_produto(dim_produto, conn, action):
     conn -- conexão criada via SqlAlchemy com o servidor do DW;
     action -- if_exists (append, replace...)
     """
-    data_types = {
-        "sk_produto": Integer(),
-        "cd_produto": Integer(),
-        "no_produto": String(),
-        "cd_barra": String(),
-        "vl_preco_custo": Float(),
-        "vl_percentual_lucro": Float(),
-        "dt_cadastro": DateTime(),
-        "fl_ativo": Integer(),
-        "dt_inicio": DateTime(),
-        "dt_fim": DateTime(),
-        "ds_categoria": String()
-    }
-
-    (
-        dim_produto.
-        astype('string').
-        to_sql(
-            con=conn,
-            name='d_produto',
-            schema='dw',
-            if_exists=action,
-            index=False,
-            chunksize=100,
-            dtype=data_types
-        )
+    dwt.load_table(
+        dim_produto,
+        conn=conn,
+        schema='dw',
+        table_name='d_produto',
+        if_exists=action,
+        dtype=data_types
     )
 
 
@@ -343,20 +203,22 @@ def run_dim_produto(conn):
     parâmetros:
     conn -- conexão criada via SqlAlchemy com o servidor do DW;
     """
-    dim_produto = extract_dim_produto(conn)
-    if dim_produto is None:
+    versions = dwt.stage_versions(conn, ['stg_produto'])
+    if dwt.is_loaded(conn, 'd_produto', versions):
+        return
+
+    if not dwt.table_exists(conn, 'dw', 'd_produto'):
         (
             extract_stage_produto(conn).
             pipe(treat_dim_produto).
+            pipe(dwt.assign_row_hashes, type1=scd_produto['type1'], type2=scd_produto['type2']).
             pipe(load_dim_produto, conn=conn, action='replace')
 
         )
     else:
-        (
-            extract_new_produto(conn).
-            pipe(treat_new_produto, conn=conn).
-            pipe(load_dim_produto, conn=conn, action='append')
-        )
+        update_dim_produto(conn)
+
+    dwt.register_load(conn, 'd_produto', versions)
 
 
 if __name__ == '__main__':
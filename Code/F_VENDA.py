@@ -1,76 +1,76 @@
+import argparse
 import time as t
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import numpy as np
 import pandas as pd
-from sqlalchemy.types import Integer, String, Float
-from pandasql import sqldf
+import sqlalchemy as sa
+from sqlalchemy.types import Integer, BigInteger, String, Float
 from CONEXAO import create_connection_postgre
 import DW_TOOLS as dwt
+from D_DATA import calculate_sk_data, data_fim, data_inicio
 
 pd.set_option('display.max_columns', None)
 
-
-def verify_fact_exists(conn):
-    """
-    Verifica se a fato existe
-
-    parâmetros:
-    conn -- conexão criada via SqlAlchemy com o servidor DW;
-
-    return:
-    fact_venda -- dataframe da fato ou None;
-    """
-    try:
-        fact_venda = dwt.read_table(
-            conn=conn,
-            schema='dw',
-            table_name='f_venda',
-            columns=[
-                'sk_forma_pagamento',
-                'sk_cliente',
-                'sk_funcionario',
-                'sk_loja',
-                'sk_produto',
-                'sk_dt_venda',
-                'nu_nfc',
-                'qtd_produto',
-                'vl_preco_custo',
-                'vl_percentual_lucro'],
-            where='"sk_loja" > 0 LIMIT 10'
-        )
-
-        return fact_venda
-    except:
-        return None
-
-
-def extract_fact_venda(conn):
-    """
-    Extrai a fato vendas
-
-    parâmetros:
-    conn -- conexão criada via SqlAlchemy com o servidor DW;
-
-    return:
-    fact_venda -- dataframe da fato;
-    """
-    fact_venda = dwt.read_table(
-        conn=conn,
-        schema='DW',
-        table_name='F_VENDA',
-        columns=[
-            'sk_forma_pagamento',
-            'sk_cliente',
-            'sk_funcionario',
-            'sk_loja',
-            'sk_produto',
-            'sk_dt_venda',
-            'nu_nfc',
-            'qtd_produto',
-            'vl_preco_custo',
-            'vl_percentual_lucro'
-        ]
-    )
-
-    return fact_venda
+# tabelas agregadas mantidas a cada carga da fato. sk_dt_venda aponta para a
+# primeira hora do dia (a_venda_dia) ou do mês (a_venda_mes) na d_data
+aggregate_dia_type = {
+    "sk_dt_venda": Integer(),
+    "sk_loja": Integer(),
+    "sk_produto": Integer(),
+    "qt_vendas": Integer(),
+    "qtd_produto": BigInteger(),
+    "vl_custo": Float(),
+    "vl_receita": Float()
+}
+
+aggregate_mes_type = {
+    "sk_dt_venda": Integer(),
+    "ds_categoria": String(),
+    "qt_vendas": Integer(),
+    "qtd_produto": BigInteger(),
+    "vl_custo": Float(),
+    "vl_receita": Float()
+}
+
+# estimativa de memória ocupada por venda durante o processamento de um bloco
+# (stage venda + itens + colunas das dimensões + cópias intermediárias),
+# usada para converter o limite de memória em quantidade de vendas por bloco
+bytes_per_venda = 4096
+
+# chave de um item na fato: a carga descarta os itens cuja chave já existe
+fact_key = ['nu_nfc', 'sk_produto']
+
+# dimensões que recebem membros inferidos para as chaves naturais da stage
+# que ainda não existem: tabela da stage e coluna com a chave natural
+inferred_members = [
+    {"table_name": "d_forma_pagamento", "natural_key": "cd_forma_pagamento",
+     "surrogate_key": "sk_forma_pagamento", "stage": "stg_venda", "column": "id_pagamento", "scd": False},
+    {"table_name": "d_cliente", "natural_key": "cd_cliente",
+     "surrogate_key": "sk_cliente", "stage": "stg_venda", "column": "id_cliente", "scd": False},
+    {"table_name": "d_funcionario", "natural_key": "cd_funcionario",
+     "surrogate_key": "sk_funcionario", "stage": "stg_venda", "column": "id_func", "scd": False},
+    {"table_name": "d_loja", "natural_key": "cd_loja",
+     "surrogate_key": "sk_loja", "stage": "stg_venda", "column": "id_loja", "scd": True},
+    {"table_name": "d_produto", "natural_key": "cd_produto",
+     "surrogate_key": "sk_produto", "stage": "stg_item_venda", "column": "id_produto", "scd": True}
+]
+
+# conexão e dimensões de cada processo do modo paralelo (init_worker)
+worker_state = {}
+
+data_type = {
+    "sk_forma_pagamento": Integer(),
+    "sk_cliente": Integer(),
+    "sk_funcionario": Integer(),
+    "sk_loja": Integer(),
+    "sk_produto": Integer(),
+    "sk_dt_venda": Integer(),
+    "nu_nfc": String(),
+    "qtd_produto": Integer(),
+    "vl_preco_custo": Float(),
+    "vl_percentual_lucro": Float()
+}
 
 
 def extract_dim_forma_pagamento(conn):
@@ -133,37 +133,6 @@ def extract_dim_funcionario(conn):
     return dim_funcionario
 
 
-def extract_dim_data(conn):
-    """
-    Extrai a dimensão data
-
-    parâmetros:
-    conn -- conexão criada via SqlAlchemy com o servidor DW;
-
-    return:
-    dim_data -- dataframe da dim_data;
-    """
-    dim_data = (
-        dwt.read_table(
-            conn=conn,
-            schema='dw',
-            table_name='d_data',
-            columns=['sk_data', 'dt_referencia']).
-            assign(
-            dt_referencia=lambda x:
-            pd.to_datetime(
-                x.dt_referencia,
-                format='%Y-%m-%d %H:%M:%S')).
-            assign(
-            dt_referencia=lambda x: x.dt_referencia.astype(str)).
-            assign(
-            dt_referencia=lambda x: x.dt_referencia.apply(
-                lambda y: y[:13])
-        )
-    )
-    return dim_data
-
-
 def extract_dim_produto(conn):
     """
     Extrai a dimensão dim_produto
@@ -232,50 +201,86 @@ def extract_dim_loja(conn):
     return dim_loja
 
 
-def extract_stage_venda(conn):
+def treat_stage_venda(stage_venda):
     """
-    Extrai a stage venda e item venda
+    Calcula a sk_data (hora da venda) de um bloco da stage venda
 
     parâmetros:
-    conn -- conexão criada via SqlAlchemy com o servidor DW;
+    stage_venda -- pandas.Dataframe;
 
     return:
-    stage_venda -- dataframe da stage_venda;
+    stage_venda -- pandas.Dataframe;
     """
     stage_venda = (
-        dwt.read_table(
-            conn=conn,
-            schema='stage',
-            table_name='stg_venda',
-            columns=['id_venda', 'id_pagamento', 'id_cliente',
-                     'id_func', 'id_loja', 'nfc', 'data_venda']).
-        assign(
-            data_venda=lambda x: pd.to_datetime(
-                x.data_venda,
-                format='%Y-%m-%d %H:%M:%S')).
-        assign(
-            data_referencia=lambda x: x.data_venda.astype(str)).
-        assign(
-            data_referencia=lambda x: x.data_referencia.apply(
-                lambda y: y[:13]),
-            id_venda=lambda x: x.id_venda.astype('int64'),
-            id_pagamento=lambda x: x.id_pagamento.astype('int64'),
-            id_cliente=lambda x: x.id_cliente.astype('int64'),
-            id_func=lambda x: x.id_func.astype('int64'),
-            id_loja=lambda x: x.id_loja.astype('int64')
-        ))
-
-    stage_item_venda = (
-        dwt.read_table(
-            conn=conn,
-            schema='stage',
-            table_name='stg_item_venda',
-            columns=[
-                'id_venda',
-                'id_produto',
-                'qtd_produto']).
+        stage_venda.
         assign(
-            id_venda=lambda x: x.id_venda.astype('int64')))
+            sk_data=lambda x: calculate_sk_data(x.data_venda))
+    )
+
+    return stage_venda
+
+
+def extract_stage_venda(conn, chunksize=50000, partitions=4, boundary=None, id_range=None, where=None):
+    """
+    Extrai a stage venda e item venda. A stage venda é lida em blocos e
+    convertida bloco a bloco para limitar o pico de memória; a stage item
+    venda, que é a maior, é lida em faixas de id_venda em paralelo.
+
+    parâmetros:
+    conn -- conexão criada via SqlAlchemy com o servidor DW;
+    chunksize -- quantidade de linhas de cada bloco;
+    partitions -- quantidade de faixas de id_venda lidas ao mesmo tempo;
+    boundary -- lê apenas as vendas com id_venda >= boundary (retorno de
+                venda_boundary) ou todas as vendas quando None;
+    id_range -- tupla (início, fim) que limita a leitura às vendas com
+                início <= id_venda < fim;
+    where -- filtro adicional das vendas da stage (ex.: month_filter);
+
+    return:
+    stage_venda -- dataframe da stage_venda;
+    """
+    venda_filters = []
+    item_filters = []
+    if id_range is not None:
+        range_filter = f'"id_venda" >= {int(id_range[0])} AND "id_venda" < {int(id_range[1])}'
+        venda_filters.append(range_filter)
+        item_filters.append(range_filter)
+    if boundary is not None:
+        venda_filters.append(new_venda_filter(boundary))
+        item_filters.append(f'"id_venda" >= {int(boundary)}')
+    if where is not None:
+        venda_filters.append(where)
+        item_filters.append(
+            f'"id_venda" IN (SELECT "id_venda" FROM "stage"."stg_venda" WHERE {" AND ".join(venda_filters)})')
+
+    venda_filter = ' AND '.join(venda_filters) or None
+    item_filter = ' AND '.join(item_filters) or None
+
+    stage_venda = pd.concat(
+        [treat_stage_venda(chunk) for chunk in
+         dwt.read_table_chunks(
+             conn=conn,
+             schema='stage',
+             table_name='stg_venda',
+             columns=['id_venda', 'id_pagamento', 'id_cliente',
+                      'id_func', 'id_loja', 'nfc', 'data_venda'],
+             where=venda_filter,
+             chunksize=chunksize)],
+        ignore_index=True
+    )
+
+    stage_item_venda = dwt.read_table_ranges(
+        conn=conn,
+        schema='stage',
+        table_name='stg_item_venda',
+        key='id_venda',
+        partitions=partitions,
+        columns=[
+            'id_venda',
+            'id_produto',
+            'qtd_produto'],
+        where=item_filter
+    )
 
     stg_venda = (
         stage_venda.
@@ -290,217 +295,377 @@ def extract_stage_venda(conn):
     return stg_venda
 
 
-def extract_new_values(conn):
+def merge_scd_dimensions(stg_venda, dim_produto, dim_loja):
     """
-    Extrai novos registros encontrados na stage venda
+    Resolve o produto e a loja de cada venda pela versão vigente na data da
+    venda. Vendas sem versão vigente recebem o membro desconhecido (-3).
 
     parâmetros:
-    conn -- conexão criada via SqlAlchemy com o servidor DW;
+    stg_venda -- pandas.Dataframe;
+    dim_produto -- pandas.Dataframe com todas as versões de d_produto;
+    dim_loja -- pandas.Dataframe com todas as versões de d_loja;
 
     return:
-    stage_venda -- dataframe da stage_venda;
+    stg_venda -- pandas.Dataframe;
     """
-    stg_venda = extract_stage_venda(conn)
-
-    fact_venda = extract_fact_venda(conn)
-
-    new_values = (
-        sqldf('\
-                SELECT\
-                stg.id_venda,\
-                stg.id_pagamento,\
-                stg.id_cliente,\
-                stg.id_func,\
-                stg.id_loja,\
-                stg.nfc,\
-                stg.data_venda,\
-                stg.data_referencia,\
-                stg.id_produto,\
-                stg.qtd_produto\
-                FROM stg_venda stg\
-                LEFT JOIN fact_venda fact\
-                ON fact.nu_nfc = stg.nfc\
-                WHERE fact.nu_nfc IS NULL;'
-              )
+    stg_venda = (
+        stg_venda.
+        pipe(
+            dwt.asof_join,
+            right=dim_produto,
+            left_on='id_produto',
+            right_on='cd_produto',
+            left_time='data_venda',
+            columns=['sk_produto', 'vl_preco_custo', 'vl_percentual_lucro'],
+            default={'sk_produto': -3}).
+        pipe(
+            dwt.asof_join,
+            right=dim_loja,
+            left_on='id_loja',
+            right_on='cd_loja',
+            left_time='data_venda',
+            columns=['sk_loja'],
+            default={'sk_loja': -3})
     )
 
-    if len(new_values) > 0:
-        dim_forma_pagamento = extract_dim_forma_pagamento(conn)
-        dim_cliente = extract_dim_cliente(conn)
-        dim_funcionario = extract_dim_funcionario(conn)
-        dim_loja = extract_dim_loja(conn)
-        dim_produto = extract_dim_produto(conn)
-        dim_data = extract_dim_data(conn)
-
-        fact_merged_dimensions = (
-            new_values.
-            pipe(
-                dwt.merge_input,
-                right=dim_data,
-                left_on="data_referencia",
-                right_on="dt_referencia",
-                suff=['_16', '_17'],
-                surrogate_key='sk_data').
-            pipe(
-                dwt.merge_input,
-                right=dim_forma_pagamento,
-                left_on="id_pagamento",
-                right_on="cd_forma_pagamento",
-                suff=["_01", "_02"],
-                surrogate_key="sk_forma_pagamento").
-            pipe(
-                dwt.merge_input,
-                right=dim_cliente,
-                left_on="id_cliente",
-                right_on="cd_cliente",
-                suff=["_03", "_04"],
-                surrogate_key="sk_cliente").
-            pipe(
-                dwt.merge_input,
-                right=dim_funcionario,
-                left_on="id_func",
-                right_on="cd_funcionario",
-                suff=["_05", "_06"],
-                surrogate_key="sk_funcionario")
-        )
+    return stg_venda
 
-    merge_with_produto = (
-        sqldf('\
-            SELECT\
-            fmd.sk_forma_pagamento,\
-            fmd.sk_cliente,\
-            fmd.sk_funcionario,\
-            fmd.sk_data,\
-            fmd.data_venda,\
-            fmd.qtd_produto,\
-            fmd.nfc,\
-            fmd.id_loja,\
-            p.sk_produto,\
-            p.vl_preco_custo,\
-            p.vl_percentual_lucro\
-            FROM fact_merged_dimensions fmd\
-            LEFT JOIN dim_produto p\
-            ON fmd.id_produto = p.cd_produto\
-            WHERE p.cd_produto = fmd.id_produto AND p.fl_ativo = 1;'
-              )
-    )
 
-    merge_with_loja = (
-        sqldf(f'\
-            SELECT\
-            mwp.sk_forma_pagamento,\
-            mwp.sk_cliente,\
-            mwp.sk_funcionario,\
-            mwp.sk_data,\
-            mwp.data_venda,\
-            mwp.qtd_produto,\
-            mwp.nfc,\
-            mwp.sk_produto,\
-            mwp.vl_preco_custo,\
-            mwp.vl_percentual_lucro,\
-            l.sk_loja\
-            FROM merge_with_produto mwp\
-            LEFT JOIN dim_loja l ON mwp.id_loja = l.cd_loja\
-            WHERE l.cd_loja = mwp.id_loja AND l.fl_ativo = 1;')
-    )
+def create_inferred_dimensions(conn, boundary=None):
+    """
+    Cria os membros inferidos de todas as chaves naturais usadas pelas vendas
+    da stage que ainda não estão nas dimensões, antes da leitura das
+    dimensões. Assim as vendas recebem a sk definitiva em vez do membro
+    desconhecido (-3), e a sk é mantida quando a dimensão receber o registro.
 
-    return merge_with_loja
+    parâmetros:
+    conn -- conexão criada via SqlAlchemy com o servidor DW;
+    boundary -- considera apenas as vendas com id_venda >= boundary;
 
+    return:
+    dicionário dimensão -> quantidade de membros inferidos criados;
+    """
+    where = f'WHERE {new_venda_filter(boundary)}' if boundary is not None else ''
+
+    created = {}
+    for member in inferred_members:
+        if member['stage'] == 'stg_item_venda':
+            source = (
+                f'SELECT i."{member["column"]}" AS "key" FROM "stage"."stg_item_venda" AS i '
+                f'JOIN "stage"."stg_venda" ON "stg_venda"."id_venda" = i."id_venda" {where}'
+            )
+        else:
+            source = f'SELECT "{member["column"]}" AS "key" FROM "stage"."stg_venda" {where}'
+
+        created[member['table_name']] = dwt.create_inferred_members(
+            conn,
+            schema='dw',
+            table_name=member['table_name'],
+            natural_key=member['natural_key'],
+            surrogate_key=member['surrogate_key'],
+            source=source,
+            scd=member['scd']
+        )
 
-def extract_new_venda(conn):
+    return created
+
+
+def extract_dimensions(conn):
     """
-    Extrai todas as tabelas necessárias para gerar a fato venda
+    Extrai as dimensões usadas pela fato venda. O resultado fica em memória
+    durante toda a carga e é reaproveitado por todos os blocos de vendas.
 
     parâmetros:
     conn -- conexão criada via SqlAlchemy com o servidor DW;
 
     return:
-    stg_cliente_endereco -- pandas.Dataframe;
+    dimensions -- dicionário com os índices de chave das dimensões tipo 1 e
+                  as versões das dimensões tipo 2;
     """
-    stg_venda = extract_stage_venda(conn)
-    dim_forma_pagamento = extract_dim_forma_pagamento(conn)
-    dim_cliente = extract_dim_cliente(conn)
-    dim_funcionario = extract_dim_funcionario(conn)
-    dim_loja = extract_dim_loja(conn)
-    dim_produto = extract_dim_produto(conn)
-    dim_data = extract_dim_data(conn)
+    dimensions = {
+        'forma_pagamento': dwt.create_key_index(
+            extract_dim_forma_pagamento(conn), 'cd_forma_pagamento', 'sk_forma_pagamento'),
+        'cliente': dwt.create_key_index(
+            extract_dim_cliente(conn), 'cd_cliente', 'sk_cliente'),
+        'funcionario': dwt.create_key_index(
+            extract_dim_funcionario(conn), 'cd_funcionario', 'sk_funcionario'),
+        'produto': extract_dim_produto(conn),
+        'loja': extract_dim_loja(conn)
+    }
+
+    return dimensions
+
+
+def merge_dimensions(stg_venda, dimensions):
+    """
+    Resolve as chaves substitutas de um bloco de vendas
+
+    parâmetros:
+    stg_venda -- pandas.Dataframe;
+    dimensions -- dicionário retornado por extract_dimensions;
 
-    stage_merged_dimensions = (
+    return:
+    stg_venda -- pandas.Dataframe;
+    """
+    stg_venda = (
         stg_venda.
         pipe(
-            dwt.merge_input,
-            right=dim_data,
-            left_on="data_referencia",
-            right_on="dt_referencia",
-            suff=['_16', '_17'],
-            surrogate_key='sk_data').
+            dwt.assign_surrogate_key,
+            left_on='id_pagamento',
+            key_index=dimensions['forma_pagamento'],
+            surrogate_key='sk_forma_pagamento').
         pipe(
-            dwt.merge_input,
-            right=dim_forma_pagamento,
-            left_on="id_pagamento",
-            right_on="cd_forma_pagamento",
-            suff=["_01", "_02"],
-            surrogate_key="sk_forma_pagamento").
+            dwt.assign_surrogate_key,
+            left_on='id_cliente',
+            key_index=dimensions['cliente'],
+            surrogate_key='sk_cliente').
         pipe(
-            dwt.merge_input,
-            right=dim_cliente,
-            left_on="id_cliente",
-            right_on="cd_cliente",
-            suff=["_03", "_04"],
-            surrogate_key="sk_cliente").
+            dwt.assign_surrogate_key,
+            left_on='id_func',
+            key_index=dimensions['funcionario'],
+            surrogate_key='sk_funcionario').
         pipe(
-            dwt.merge_input,
-            right=dim_funcionario,
-            left_on="id_func",
-            right_on="cd_funcionario",
-            suff=["_05", "_06"],
-            surrogate_key="sk_funcionario")
+            merge_scd_dimensions,
+            dim_produto=dimensions['produto'],
+            dim_loja=dimensions['loja'])
+    )
+
+    return stg_venda
 
+
+def venda_ranges(conn, chunk_size, boundary=None, where=None):
+    """
+    Divide a stage venda em faixas de id_venda com até chunk_size vendas.
+    Com boundary, as faixas cobrem apenas o intervalo das vendas novas.
+
+    parâmetros:
+    conn -- conexão criada via SqlAlchemy com o servidor DW;
+    chunk_size -- tamanho de cada faixa de id_venda;
+    boundary -- considera apenas as vendas com id_venda >= boundary;
+    where -- filtro adicional das vendas da stage (ex.: month_filter);
+
+    return:
+    gerador de tuplas (início, fim), com fim exclusivo;
+    """
+    filters = ([new_venda_filter(boundary)] if boundary is not None else []) + ([where] if where is not None else [])
+    where_clause = f'WHERE {" AND ".join(filters)}' if filters else ''
+    sql = f'SELECT MIN("id_venda"), MAX("id_venda") FROM "stage"."stg_venda" {where_clause}'
+    start, end = conn.execute(sql).fetchone()
+    if start is None:
+        return
+
+    for lower in range(start, end + 1, chunk_size):
+        yield lower, min(lower + chunk_size, end + 1)
+
+
+def load_venda_range(conn, dimensions, id_range, boundary=None, where=None):
+    """
+    Extrai, resolve as chaves, trata e carrega um bloco de vendas
+
+    parâmetros:
+    conn -- conexão criada via SqlAlchemy com o servidor DW;
+    dimensions -- dicionário retornado por extract_dimensions;
+    id_range -- tupla (início, fim) de id_venda do bloco;
+    boundary -- considera apenas as vendas com id_venda >= boundary;
+    where -- filtro adicional das vendas da stage (ex.: month_filter);
+
+    return:
+    quantidade de linhas carregadas;
+    """
+    stg_venda = extract_stage_venda(conn, boundary=boundary, id_range=id_range, where=where)
+    if len(stg_venda) == 0:
+        return 0
+
+    fact_venda = (
+        stg_venda.
+        pipe(merge_dimensions, dimensions=dimensions).
+        pipe(treat_fact_venda)
     )
+    load_fact_venda(fact_venda, conn)
+
+    return len(fact_venda)
+
 
-    merge_with_produto = (
-        sqldf('\
-                SELECT\
-                smd.sk_forma_pagamento,\
-                smd.sk_cliente,\
-                smd.sk_funcionario,\
-                smd.sk_data,\
-                smd.data_venda,\
-                smd.qtd_produto,\
-                smd.nfc,\
-                smd.id_loja,\
-                p.sk_produto,\
-                p.vl_preco_custo,\
-                p.vl_percentual_lucro\
-                FROM stage_merged_dimensions smd\
-                INNER JOIN dim_produto p\
-                ON smd.id_produto = p.cd_produto\
-                WHERE (p.dt_inicio <= smd.data_venda < p.dt_fim)\
-                OR (p.dt_inicio <= smd.data_venda AND p.dt_fim IS NULL);')
+def share_dimensions(dimensions):
+    """
+    Copia as dimensões para memória compartilhada, para que os processos do
+    modo paralelo não recebam uma cópia serializada de cada uma
+
+    parâmetros:
+    dimensions -- dicionário retornado por extract_dimensions;
+
+    return:
+    blocks -- blocos de memória compartilhada criados;
+    descriptor -- descrição dos blocos usada por attach_dimensions;
+    """
+    arrays = {}
+    for name, dimension in dimensions.items():
+        if isinstance(dimension, pd.DataFrame):
+            arrays.update({f'{name}.frame.{column}': dimension[column].to_numpy() for column in dimension.columns})
+        else:
+            arrays[f'{name}.index.keys'], arrays[f'{name}.index.surrogate_keys'] = dimension
+
+    return dwt.share_arrays(arrays)
+
+
+def attach_dimensions(descriptor):
+    """
+    Reconstrói, em um processo do modo paralelo, as dimensões criadas por
+    share_dimensions. Os índices de chave são lidos direto da memória
+    compartilhada; as versões das dimensões tipo 2 viram um DataFrame local.
+
+    parâmetros:
+    descriptor -- retorno de share_dimensions;
+
+    return:
+    blocks -- blocos de memória compartilhada abertos;
+    dimensions -- dicionário no formato de extract_dimensions;
+    """
+    blocks, arrays = dwt.attach_arrays(descriptor)
+
+    indexes = {}
+    frames = {}
+    for name, array in arrays.items():
+        dimension, kind, column = name.split('.', 2)
+        (frames if kind == 'frame' else indexes).setdefault(dimension, {})[column] = array
+
+    dimensions = {name: (parts['keys'], parts['surrogate_keys']) for name, parts in indexes.items()}
+    dimensions.update({name: pd.DataFrame(parts) for name, parts in frames.items()})
+
+    return blocks, dimensions
+
+
+def init_worker(url, descriptor):
+    """
+    Inicializa um processo do modo paralelo: abre uma conexão própria com o
+    DW e as dimensões compartilhadas
+
+    parâmetros:
+    url -- sqlalchemy URL do servidor DW;
+    descriptor -- retorno de share_dimensions;
+    """
+    worker_state['conn'] = sa.create_engine(url)
+    worker_state['blocks'], worker_state['dimensions'] = attach_dimensions(descriptor)
+
+
+def run_worker_month(where, chunk_size, boundary=None):
+    """
+    Carrega todas as vendas de uma partição da fato em um processo do modo
+    paralelo, em blocos de id_venda. Como cada partição é carregada por um
+    único processo, os processos não esperam uns pelos outros no bloqueio
+    da partição feito por insert_new_rows.
+
+    parâmetros:
+    where -- filtro das vendas da partição (retorno de month_filters);
+    chunk_size -- quantidade de id_venda processados por bloco;
+    boundary -- considera apenas as vendas com id_venda >= boundary;
+
+    return:
+    quantidade de linhas carregadas;
+    """
+    conn = worker_state['conn']
+
+    return sum(
+        load_venda_range(conn, worker_state['dimensions'], id_range, boundary, where=where)
+        for id_range in venda_ranges(conn, chunk_size, boundary=boundary, where=where)
     )
 
-    merge_with_loja = (
-        sqldf('\
-                SELECT\
-                mwp.sk_forma_pagamento,\
-                mwp.sk_cliente,\
-                mwp.sk_funcionario,\
-                mwp.sk_data,\
-                mwp.data_venda,\
-                mwp.qtd_produto,\
-                mwp.nfc,\
-                mwp.sk_produto,\
-                mwp.vl_preco_custo,\
-                mwp.vl_percentual_lucro,\
-                l.sk_loja\
-                FROM merge_with_produto mwp\
-                INNER JOIN dim_loja l\
-                ON mwp.id_loja = l.cd_loja\
-                WHERE (l.dt_inicio <= mwp.data_venda < l.dt_fim)\
-                OR (l.dt_inicio <= mwp.data_venda AND l.dt_fim IS NULL);')
+
+def new_venda_filter(boundary):
+    """
+    Filtro das vendas novas da stage, resolvido pelo índice de id_venda. A
+    venda da borda (boundary) também é lida de novo: é a última venda já
+    carregada, que pode ter recebido itens depois da última carga
+
+    parâmetros:
+    boundary -- retorno de venda_boundary;
+
+    return:
+    filtro sql;
+    """
+    return f'"stg_venda"."id_venda" >= {int(boundary)}'
+
+
+def venda_boundary(conn):
+    """
+    Lê o maior id_venda da última carga da fato, registrado em controle_carga.
+    Sem registro (fato carregada antes do controle existir), o valor é
+    calculado uma única vez a partir dos nfc já presentes na fato.
+
+    parâmetros:
+    conn -- conexão criada via SqlAlchemy com o servidor DW;
+
+    return:
+    boundary -- int ou None quando todas as vendas da stage são novas;
+    """
+    boundary = None
+    if dwt.table_exists(conn, 'stage', 'controle_carga'):
+        boundary = dwt.read_watermark(conn, 'f_venda', schema='dw')
+    if boundary is None:
+        boundary = conn.execute(
+            'SELECT MAX(v."id_venda") FROM "stage"."stg_venda" AS v '
+            'WHERE EXISTS (SELECT 1 FROM "dw"."f_venda" AS f WHERE f."nu_nfc" = v."nfc")'
+        ).scalar()
+
+    return None if boundary is None else int(boundary)
+
+
+def venda_months(conn, boundary=None):
+    """
+    Lista os meses, dentro do intervalo da dimensão data, das vendas da stage
+
+    parâmetros:
+    conn -- conexão criada via SqlAlchemy com o servidor DW;
+    boundary -- considera apenas as vendas com id_venda >= boundary;
+
+    return:
+    pandas.PeriodIndex mensal ordenado;
+    """
+    where = f'WHERE {new_venda_filter(boundary)}' if boundary is not None else ''
+    sql = (
+        'SELECT DISTINCT date_trunc(\'month\', "data_venda") AS "mes" '
+        f'FROM "stage"."stg_venda" {where}'
     )
 
-    return merge_with_loja
+    return sk_to_month(calculate_sk_data(pd.read_sql_query(sql, conn)['mes'])).dropna().sort_values()
+
+
+def month_filters(months):
+    """
+    Monta um filtro de vendas da stage para cada partição da fato: um por
+    mês e um para a partição DEFAULT, que recebe as vendas sem data ou fora
+    do intervalo da dimensão data
+
+    parâmetros:
+    months -- meses (pandas.Period) das vendas;
+
+    return:
+    lista de filtros sql;
+    """
+    filters = [
+        f'"data_venda" >= TIMESTAMP \'{month.start_time:%Y-%m-%d}\' '
+        f'AND "data_venda" < TIMESTAMP \'{(month + 1).start_time:%Y-%m-%d}\''
+        for month in months
+    ]
+    filters.append(
+        f'NOT COALESCE("data_venda" >= TIMESTAMP \'{data_inicio}\' '
+        f'AND "data_venda" < TIMESTAMP \'{data_fim}\' + INTERVAL \'1 hour\', FALSE)'
+    )
+
+    return filters
+
+
+def create_venda_partitions(conn, months):
+    """
+    Cria antes da carga todas as partições mensais que as vendas da stage
+    vão usar, para que a carga de cada bloco não execute DDL na fato
+
+    parâmetros:
+    conn -- conexão criada via SqlAlchemy com o servidor DW;
+    months -- meses das vendas (retorno de venda_months);
+    """
+    if len(months) > 0:
+        create_month_partitions(conn, pd.period_range(months.min(), months.max() + 1, freq='M'))
 
 
 def treat_fact_venda(stg_venda):
@@ -561,65 +726,416 @@ def treat_missing_data(fact_venda):
     return fact_venda
 
 
-def load_fact_venda(fact_venda, conn, action):
+def sk_to_month(sk_dt_venda):
     """
-    Faz a carga da fato venda no DW.
+    Converte sk_dt_venda no mês da venda. Sks não positivas (membros -1, -2
+    e -3) viram NaT.
+
+    parâmetros:
+    sk_dt_venda -- pandas.Series ou array de sk_dt_venda;
+
+    return:
+    pandas.PeriodIndex mensal;
+    """
+    sk_dt_venda = np.asarray(sk_dt_venda, dtype='int64')
+    months = (pd.Timestamp(data_inicio) + pd.to_timedelta(sk_dt_venda - 1, unit='h')).to_period('M')
+
+    return months.where(sk_dt_venda > 0)
+
+
+def partition_name(month):
+    return f'f_venda_{month.year}_{month.month:02d}'
+
+
+def month_bounds(month):
+    """
+    Faixa [início, fim) de sk_dt_venda de um mês
+
+    parâmetros:
+    month -- pandas.Period mensal;
+
+    return:
+    tupla (início, fim);
+    """
+    start, end = calculate_sk_data([month.start_time, (month + 1).start_time], bounded=False)
+
+    return int(start), int(end)
+
+
+def create_month_partitions(conn, months):
+    """
+    Cria as partições mensais da fato que ainda não existem
+
+    parâmetros:
+    conn -- conexão criada via SqlAlchemy com o servidor do DW;
+    months -- meses (pandas.Period) das partições;
+    """
+    for month in months:
+        start, end = month_bounds(month)
+        dwt.create_range_partition(conn, 'dw', 'f_venda', partition_name(month), start, end)
+
+
+def create_fact_venda(conn):
+    """
+    Cria a fato venda particionada por mês de sk_dt_venda, com a partição
+    DEFAULT para os membros especiais. Uma fato existente não particionada é
+    migrada para o novo formato em uma única transação.
+
+    parâmetros:
+    conn -- conexão criada via SqlAlchemy com o servidor do DW;
+    """
+    if not dwt.table_exists(conn, 'dw', 'f_venda'):
+        dwt.create_partitioned_table(conn, 'dw', 'f_venda', data_type, 'sk_dt_venda')
+    elif not dwt.is_partitioned(conn, 'dw', 'f_venda'):
+        columns = dwt.concat_cols(list(data_type))
+        with conn.begin() as connection:
+            connection.execute('ALTER TABLE "dw"."f_venda" RENAME TO "f_venda_old"')
+            connection.execute('DROP INDEX IF EXISTS "dw"."ix_f_venda_nu_nfc"')
+            dwt.create_partitioned_table(connection, 'dw', 'f_venda', data_type, 'sk_dt_venda')
+
+            low, high = connection.execute(
+                'SELECT MIN("sk_dt_venda") FILTER (WHERE "sk_dt_venda" > 0), MAX("sk_dt_venda") '
+                'FROM "dw"."f_venda_old"'
+            ).fetchone()
+            if low is not None:
+                first, last = sk_to_month([low, high])
+                create_month_partitions(connection, pd.period_range(first, last + 1, freq='M'))
+
+            connection.execute(
+                f'INSERT INTO "dw"."f_venda" ("{columns}") '
+                f'SELECT "{columns}" FROM "dw"."f_venda_old" ORDER BY "sk_dt_venda"'
+            )
+            connection.execute('DROP TABLE "dw"."f_venda_old"')
+
+    conn.execute('CREATE INDEX IF NOT EXISTS "ix_f_venda_nu_nfc" ON "dw"."f_venda" ("nu_nfc")')
+    conn.execute('CREATE INDEX IF NOT EXISTS "ix_f_venda_sk_dt_venda" ON "dw"."f_venda" USING BRIN ("sk_dt_venda")')
+
+
+def load_fact_venda(fact_venda, conn, aggregate=True):
+    """
+    Faz a carga da fato venda no DW. Cada mês é gravado direto na sua
+    partição, ordenado por sk_dt_venda. Os itens cuja chave (nu_nfc e
+    sk_produto) já está na partição são descartados, então repetir uma carga
+    não duplica linhas e itens que chegaram depois da venda são inseridos.
+    Apenas as linhas realmente inseridas são somadas às tabelas agregadas,
+    na mesma transação da carga. A fato e as partições devem existir
+    (create_fact_venda e create_venda_partitions); nenhum DDL é executado
+    aqui.
 
     parâmetros:
     fact_venda -- pandas.Dataframe;
     conn -- conexão criada via SqlAlchemy com o servidor do DW;
-    action -- if_exists (append, replace...)
-    """
-    data_type = {
-        "sk_forma_pagamento": Integer(),
-        "sk_cliente": Integer(),
-        "sk_funcionario": Integer(),
-        "sk_loja": Integer(),
-        "sk_dt_venda": Integer(),
-        "sk_produto": Integer(),
-        "nu_nfc": String(),
-        "qtd_produto": Integer(),
-        "vl_preco_custo": Float(),
-        "vl_percentual_lucro": Float()
-    }
-    (
+    aggregate -- atualiza as tabelas agregadas;
+    """
+    months = sk_to_month(fact_venda['sk_dt_venda'])
+
+    fact_venda = (
         fact_venda.
-        to_sql(
-            con=conn,
-            name='f_venda',
-            schema="dw",
-            if_exists=action,
-            chunksize=100,
-            index=False,
-            dtype=data_type
+        assign(
+            particao=months.strftime('f_venda_%Y_%m').fillna('f_venda_default').to_numpy()).
+        sort_values('sk_dt_venda')
+    )
+
+    inserted = []
+    with conn.begin() as connection:
+        for name, partition in fact_venda.groupby('particao', sort=False):
+            partition = dwt.prepare_copy_frame(partition.drop(columns='particao'), data_type)
+            keys = dwt.insert_new_rows(connection, partition, 'dw', name, key=fact_key)
+            inserted.append(partition.merge(keys.drop_duplicates(), on=fact_key))
+
+        if aggregate and inserted:
+            update_venda_aggregates(pd.concat(inserted, ignore_index=True), connection)
+
+
+def rebuild_fact_month(fact_venda, conn, month):
+    """
+    Reconstrói um mês da fato venda trocando apenas a partição do mês. Na
+    mesma transação da troca, as linhas do mês nas tabelas agregadas são
+    recalculadas a partir das novas vendas.
+
+    parâmetros:
+    fact_venda -- pandas.Dataframe com todas as vendas do mês;
+    conn -- conexão criada via SqlAlchemy com o servidor do DW;
+    month -- mês a reconstruir (ex.: '2021-03');
+    """
+    month = pd.Period(month, freq='M')
+    start, end = month_bounds(month)
+    create_venda_aggregates(conn)
+    dwt.swap_partition(
+        fact_venda.sort_values('sk_dt_venda'),
+        conn, 'dw', 'f_venda', partition_name(month), start, end,
+        dtype=data_type,
+        before_swap=lambda connection: replace_month_aggregates(connection, fact_venda, month)
+    )
+
+
+def replace_month_aggregates(connection, fact_venda, month):
+    """
+    Recalcula as linhas de um mês nas tabelas agregadas: remove os grupos do
+    mês e soma as novas vendas. As linhas antigas não são subtraídas, pois a
+    categoria com que foram agregadas pode não ser mais a atual do produto.
+
+    parâmetros:
+    connection -- conexão SqlAlchemy da transação da troca da partição;
+    fact_venda -- pandas.Dataframe com todas as novas vendas do mês;
+    month -- pandas.Period do mês;
+    """
+    start, end = month_bounds(month)
+
+    for table_name in ['a_venda_dia', 'a_venda_mes']:
+        connection.execute(
+            f'DELETE FROM "dw"."{table_name}" '
+            f'WHERE "sk_dt_venda" >= {start} AND "sk_dt_venda" < {end}'
         )
+    update_venda_aggregates(fact_venda, connection)
+
+
+def treat_venda_measures(fact_venda):
+    """
+    Calcula o custo e a receita de cada item vendido e as sks do dia e do
+    mês da venda. Membros especiais (sk <= 0) mantêm a sk original.
+
+    parâmetros:
+    fact_venda -- pandas.Dataframe;
+
+    return:
+    fact_venda -- pandas.Dataframe;
+    """
+    sk = fact_venda['sk_dt_venda'].to_numpy(dtype='int64')
+    sk_mes = calculate_sk_data(sk_to_month(sk).to_timestamp())
+
+    fact_venda = (
+        fact_venda.
+        assign(
+            sk_dia=np.where(sk > 0, (sk - 1) // 24 * 24 + 1, sk),
+            sk_mes=np.where(sk > 0, sk_mes, sk),
+            vl_custo=lambda x: x.qtd_produto * x.vl_preco_custo,
+            vl_receita=lambda x: x.vl_custo * (1 + x.vl_percentual_lucro / 100))
     )
 
+    return fact_venda
 
-def run_fact_venda(conn):
+
+def aggregate_venda(fact_venda, keys):
     """
-    Executa o pipeline da fato venda.
+    Agrupa as vendas pelas colunas informadas
+
+    parâmetros:
+    fact_venda -- pandas.Dataframe retornado por treat_venda_measures;
+    keys -- dicionário coluna da fato -> coluna da tabela agregada;
+
+    return:
+    pandas.Dataframe com uma linha por grupo;
+    """
+    aggregate = (
+        fact_venda.
+        groupby(list(keys), sort=False).
+        agg(
+            qt_vendas=('nu_nfc', 'nunique'),
+            qtd_produto=('qtd_produto', 'sum'),
+            vl_custo=('vl_custo', 'sum'),
+            vl_receita=('vl_receita', 'sum')).
+        reset_index().
+        rename(columns=keys)
+    )
+
+    return aggregate
+
+
+def extract_categoria_produto(conn, sk_produto):
+    """
+    Extrai a categoria dos produtos informados
+
+    parâmetros:
+    conn -- conexão criada via SqlAlchemy com o servidor DW;
+    sk_produto -- sks dos produtos;
+
+    return:
+    pandas.Dataframe com sk_produto e ds_categoria;
+    """
+    sks = ', '.join(str(int(sk)) for sk in np.unique(sk_produto))
+    categoria = dwt.read_table(
+        conn=conn,
+        schema='dw',
+        table_name='d_produto',
+        columns=['sk_produto', 'ds_categoria'],
+        where=f'"sk_produto" IN ({sks})'
+    )
+
+    return categoria
+
+
+def seed_aggregate_sql(table_name, groups, join=''):
+    """
+    Monta o INSERT ... SELECT que preenche uma tabela agregada com as vendas
+    que já estão na fato, com as mesmas medidas de treat_venda_measures e
+    aggregate_venda. As linhas dos membros especiais (-1, -2 e -3) não são
+    agregadas.
+
+    parâmetros:
+    table_name -- nome da tabela agregada;
+    groups -- dicionário coluna da tabela agregada -> expressão sql sobre a
+              fato (alias f);
+    join -- joins adicionais usados pelas expressões de groups;
+
+    return:
+    sql -- str;
+    """
+    columns = [*groups, 'qt_vendas', 'qtd_produto', 'vl_custo', 'vl_receita']
+    expressions = ', '.join(groups.values())
+
+    return (
+        f'INSERT INTO "dw"."{table_name}" ("{dwt.concat_cols(columns)}") '
+        f'SELECT {expressions}, '
+        'COUNT(DISTINCT f."nu_nfc"), '
+        'SUM(f."qtd_produto"), '
+        'SUM(f."qtd_produto" * f."vl_preco_custo"), '
+        'SUM(f."qtd_produto" * f."vl_preco_custo" * (1 + f."vl_percentual_lucro" / 100)) '
+        f'FROM "dw"."f_venda" AS f {join} '
+        'WHERE f."nu_nfc" NOT IN (\'-1\', \'-2\', \'-3\') '
+        f'GROUP BY {expressions}'
+    )
+
+
+def create_venda_aggregates(conn):
+    """
+    Cria as tabelas agregadas da fato venda. Uma tabela criada agora é
+    preenchida, na mesma transação, com as vendas que já estão na fato, para
+    que os totais não cubram apenas as cargas seguintes.
+
+    parâmetros:
+    conn -- conexão criada via SqlAlchemy com o servidor do DW;
+    """
+    # sk da primeira hora do dia e do mês da venda; membros especiais mantêm a sk
+    sk_dia = 'CASE WHEN f."sk_dt_venda" > 0 THEN (f."sk_dt_venda" - 1) / 24 * 24 + 1 ELSE f."sk_dt_venda" END'
+    sk_mes = (
+        'CASE WHEN f."sk_dt_venda" > 0 THEN '
+        f'(EXTRACT(EPOCH FROM date_trunc(\'month\', TIMESTAMP \'{data_inicio}\' '
+        f'+ (f."sk_dt_venda" - 1) * INTERVAL \'1 hour\') - TIMESTAMP \'{data_inicio}\') / 3600)::INTEGER + 1 '
+        'ELSE f."sk_dt_venda" END'
+    )
+
+    aggregates = [
+        ('a_venda_dia', aggregate_dia_type, ['sk_dt_venda', 'sk_loja', 'sk_produto'], seed_aggregate_sql(
+            'a_venda_dia',
+            {'sk_dt_venda': sk_dia, 'sk_loja': 'f."sk_loja"', 'sk_produto': 'f."sk_produto"'})),
+        ('a_venda_mes', aggregate_mes_type, ['sk_dt_venda', 'ds_categoria'], seed_aggregate_sql(
+            'a_venda_mes',
+            {'sk_dt_venda': sk_mes, 'ds_categoria': 'COALESCE(p."ds_categoria", \'Desconhecido\')'},
+            join='LEFT JOIN "dw"."d_produto" AS p ON p."sk_produto" = f."sk_produto"'))
+    ]
+
+    for table_name, dtype, keys, seed in aggregates:
+        if dwt.table_exists(conn, 'dw', table_name):
+            continue
+
+        with conn.begin() as connection:
+            dwt.create_aggregate_table(connection, 'dw', table_name, dtype, keys=keys)
+            if dwt.table_exists(connection, 'dw', 'f_venda'):
+                connection.execute(seed)
+
+
+def update_venda_aggregates(fact_venda, connection):
+    """
+    Soma nas tabelas agregadas as vendas que acabaram de ser carregadas na
+    fato: a_venda_dia (dia x loja x produto) e a_venda_mes (mês x categoria).
+    A categoria é a do produto no momento da carga; uma mudança posterior de
+    categoria (tipo 1) não reclassifica as vendas já agregadas. Um item que
+    chega depois da venda já carregada conta a venda de novo em qt_vendas
+    de a_venda_mes quando a categoria dele já tinha itens da mesma venda.
+
+    parâmetros:
+    fact_venda -- pandas.Dataframe com as linhas inseridas na fato;
+    connection -- conexão SqlAlchemy aberta com conn.begin(), a mesma da
+                  carga da fato, para que fato e agregadas sejam gravadas
+                  juntas;
+    """
+    if len(fact_venda) == 0:
+        return
+
+    fact_venda = treat_venda_measures(fact_venda)
+
+    venda_dia = aggregate_venda(
+        fact_venda,
+        keys={'sk_dia': 'sk_dt_venda', 'sk_loja': 'sk_loja', 'sk_produto': 'sk_produto'}
+    )
+
+    venda_mes = (
+        fact_venda.
+        merge(extract_categoria_produto(connection, fact_venda['sk_produto']), how='left', on='sk_produto').
+        fillna({'ds_categoria': 'Desconhecido'}).
+        pipe(aggregate_venda, keys={'sk_mes': 'sk_dt_venda', 'ds_categoria': 'ds_categoria'})
+    )
+
+    dwt.accumulate_table(connection, venda_dia, 'dw', 'a_venda_dia',
+                         keys=['sk_dt_venda', 'sk_loja', 'sk_produto'], dtype=aggregate_dia_type)
+    dwt.accumulate_table(connection, venda_mes, 'dw', 'a_venda_mes',
+                         keys=['sk_dt_venda', 'ds_categoria'], dtype=aggregate_mes_type)
+
+
+def run_fact_venda(conn, chunk_size=100000, max_memory=None, workers=1):
+    """
+    Executa o pipeline da fato venda. As dimensões são lidas uma única vez e
+    as vendas são processadas em blocos de id_venda, então o pico de memória
+    depende do tamanho do bloco e não do volume da stage. Com mais de um
+    worker, as partições da fato (meses) são distribuídas entre processos
+    que leem as dimensões da memória compartilhada e carregam, bloco a
+    bloco, todas as vendas das suas partições. Cada bloco
+    carregado é somado às tabelas agregadas (update_venda_aggregates).
+    Chaves naturais ainda ausentes das dimensões viram membros inferidos
+    antes da leitura das dimensões (create_inferred_dimensions).
 
     parâmetros:
     conn -- conexão criada via SqlAlchemy com o servidor do DW;
+    chunk_size -- quantidade de id_venda processados por bloco;
+    max_memory -- limite aproximado de memória em MB para todos os workers.
+                  Quando informado, o tamanho do bloco é calculado a partir
+                  de bytes_per_venda;
+    workers -- quantidade de processos;
     """
-    fact_venda = verify_fact_exists(conn)
-    if fact_venda is None:
+    if max_memory is not None:
+        chunk_size = max(1, int(max_memory * 1024 * 1024 // (bytes_per_venda * workers)))
+
+    fact_exists = dwt.table_exists(conn, 'dw', 'f_venda')
+    boundary = venda_boundary(conn) if fact_exists else None
+    last_venda = conn.execute('SELECT MAX("id_venda") FROM "stage"."stg_venda"').scalar()
+    create_fact_venda(conn)
+    months = venda_months(conn, boundary)
+    create_venda_partitions(conn, months)
+    if not fact_exists:
         (
-            extract_new_venda(conn).
-            pipe(treat_fact_venda).
+            pd.DataFrame(columns=list(data_type)).
             pipe(treat_missing_data).
-            pipe(load_fact_venda, conn=conn, action='replace')
+            pipe(load_fact_venda, conn=conn, aggregate=False)
         )
+
+    create_venda_aggregates(conn)
+    create_inferred_dimensions(conn, boundary)
+    dimensions = extract_dimensions(conn)
+
+    if workers <= 1:
+        for id_range in venda_ranges(conn, chunk_size, boundary=boundary):
+            load_venda_range(conn, dimensions, id_range, boundary)
     else:
-        (
-            extract_new_values(conn).
-            pipe(treat_fact_venda).
-            pipe(load_fact_venda, conn=conn, action='append')
-        )
+        blocks, descriptor = share_dimensions(dimensions)
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                     initargs=(conn.url, descriptor)) as executor:
+                list(executor.map(run_worker_month, month_filters(months), repeat(chunk_size), repeat(boundary)))
+        finally:
+            dwt.release_shared(blocks, unlink=True)
+
+    if last_venda is not None:
+        dwt.register_watermark(conn, 'dw', 'f_venda', 'id_venda', last_venda)
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunk-size', type=int, default=100000)
+    parser.add_argument('--max-memory', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args()
+
     conn_dw = create_connection_postgre(
         server="192.168.3.2",
         database="projeto_dw_vendas",
@@ -628,5 +1144,5 @@ if __name__ == '__main__':
         port="5432"
     )
     start = t.time()
-    run_fact_venda(conn_dw)
+    run_fact_venda(conn_dw, chunk_size=args.chunk_size, max_memory=args.max_memory, workers=args.workers)
     print(f'exec time = {t.time() - start}')
@@ -1,9 +1,72 @@
 import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from sqlalchemy.types import Date, DateTime, Float, Integer, String
 import DW_TOOLS as dwt
 from CONEXAO import create_connection_postgre
 
+stage_data_types = {
+    'stg_venda': {
+        'id_venda': Integer(),
+        'id_pagamento': Integer(),
+        'id_cliente': Integer(),
+        'id_func': Integer(),
+        'id_loja': Integer(),
+        'nfc': String(),
+        'data_venda': DateTime()
+    },
+    'stg_item_venda': {
+        'id_venda': Integer(),
+        'id_produto': Integer(),
+        'qtd_produto': Integer()
+    },
+    'stg_loja': {
+        'id_loja': Integer(),
+        'nome_loja': String(),
+        'razao_social': String(),
+        'cnpj': String(),
+        'telefone': String(),
+        'id_endereco': Integer()
+    },
+    'stg_produto': {
+        'id_produto': Integer(),
+        'nome_produto': String(),
+        'cod_barra': String(),
+        'preco_custo': Float(),
+        'percentual_lucro': Float(),
+        'data_cadastro': Date(),
+        'ativo': Integer()
+    },
+    'stg_forma_pagamento': {
+        'id_pagamento': Integer(),
+        'nome': String(),
+        'descricao': String()
+    },
+    'stg_cliente': {
+        'id_cliente': Integer(),
+        'nome': String(),
+        'cpf': String(),
+        'tel': String(),
+        'id_endereco': Integer()
+    },
+    'stg_funcionario': {
+        'id_funcionario': Integer(),
+        'nome': String(),
+        'cpf': String(),
+        'tel': String(),
+        'data_nascimento': Date()
+    },
+    'stg_endereco': {
+        'id_endereco': Integer(),
+        'estado': String(),
+        'cidade': String(),
+        'bairro': String(),
+        'rua': String()
+    }
+}
 
-def create_stg_venda(conn_dw):
+
+def create_stg_venda(conn_dw, method='auto', full_refresh=False):
     start = time.time()
     dwt.create_stage(
         conn_input=conn_dw,
@@ -11,14 +74,19 @@ def create_stg_venda(conn_dw):
         schema_in='public',
         table='VENDA',
         stg_name='stg_venda',
-        tbl_exists='replace'
-
+        tbl_exists='append',
+        method=method,
+        dtype=stage_data_types['stg_venda'],
+        watermark='id_venda',
+        full_refresh=full_refresh
     )
     exec_time = time.time() - start
     print(f'tempo de execução da stage STG_VENDA: {exec_time:.4f}')
 
+    return exec_time
 
-def create_stg_item_venda(conn_dw):
+
+def create_stg_item_venda(conn_dw, method='auto', full_refresh=False):
     start = time.time()
     dwt.create_stage(
         conn_input=conn_dw,
@@ -26,14 +94,19 @@ def create_stg_item_venda(conn_dw):
         schema_in='public',
         table='ITEM_VENDA',
         stg_name='stg_item_venda',
-        tbl_exists='replace'
-
+        tbl_exists='append',
+        method=method,
+        dtype=stage_data_types['stg_item_venda'],
+        watermark='id_venda',
+        full_refresh=full_refresh
     )
     exec_time = time.time() - start
     print(f'tempo de execução da stage STG_ITEM_VENDA: {exec_time:.4f}')
 
+    return exec_time
 
-def create_stg_loja(conn_dw):
+
+def create_stg_loja(conn_dw, method='auto'):
     start = time.time()
     dwt.create_stage(
         conn_input=conn_dw,
@@ -41,14 +114,19 @@ def create_stg_loja(conn_dw):
         schema_in='public',
         table='LOJA',
         stg_name='stg_loja',
-        tbl_exists='replace'
-
+        tbl_exists='replace',
+        method=method,
+        dtype=stage_data_types['stg_loja'],
+        fingerprint=True,
+        snapshot=True
     )
     exec_time = time.time() - start
     print(f'tempo de execução da stage STG_LOJA: {exec_time:.4f}')
 
+    return exec_time
+
 
-def create_stg_produto(conn_dw):
+def create_stg_produto(conn_dw, method='auto'):
     start = time.time()
     dwt.create_stage(
         conn_input=conn_dw,
@@ -56,14 +134,19 @@ def create_stg_produto(conn_dw):
         schema_in='public',
         table='PRODUTO',
         stg_name='stg_produto',
-        tbl_exists='replace'
-
+        tbl_exists='replace',
+        method=method,
+        dtype=stage_data_types['stg_produto'],
+        fingerprint=True,
+        snapshot=True
     )
     exec_time = time.time() - start
     print(f'tempo de execução da stage STG_PRODUTO: {exec_time:.4f}')
 
+    return exec_time
+
 
-def create_stg_forma_pagamento(conn_dw):
+def create_stg_forma_pagamento(conn_dw, method='auto'):
     start = time.time()
     dwt.create_stage(
         conn_input=conn_dw,
@@ -71,14 +154,19 @@ def create_stg_forma_pagamento(conn_dw):
         schema_in='public',
         table='FORMA_PAGAMENTO',
         stg_name='stg_forma_pagamento',
-        tbl_exists='replace'
-
+        tbl_exists='replace',
+        method=method,
+        dtype=stage_data_types['stg_forma_pagamento'],
+        fingerprint=True,
+        snapshot=True
     )
     exec_time = time.time() - start
     print(f'tempo de execução da stage STG_FORMA_PAGAMENTO {exec_time:.4f}')
 
+    return exec_time
+
 
-def create_stg_cliente(conn_dw):
+def create_stg_cliente(conn_dw, method='auto'):
     start = time.time()
     dwt.create_stage(
         conn_input=conn_dw,
@@ -86,14 +174,19 @@ def create_stg_cliente(conn_dw):
         schema_in='public',
         table='CLIENTE',
         stg_name='stg_cliente',
-        tbl_exists='replace'
-
+        tbl_exists='replace',
+        method=method,
+        dtype=stage_data_types['stg_cliente'],
+        fingerprint=True,
+        snapshot=True
     )
     exec_time = time.time() - start
     print(f'tempo de execução da stage STG_CLIENTE: {exec_time:.4f}')
 
+    return exec_time
+
 
-def create_stg_funcionario(conn_dw):
+def create_stg_funcionario(conn_dw, method='auto'):
     start = time.time()
     dwt.create_stage(
         conn_input=conn_dw,
@@ -101,14 +194,19 @@ def create_stg_funcionario(conn_dw):
         schema_in='public',
         table='FUNCIONARIO',
         stg_name='stg_funcionario',
-        tbl_exists='replace'
-
+        tbl_exists='replace',
+        method=method,
+        dtype=stage_data_types['stg_funcionario'],
+        fingerprint=True,
+        snapshot=True
     )
     exec_time = time.time() - start
     print(f'tempo de execução da stage STG_FUNCIONARIO: {exec_time:.4f}')
 
+    return exec_time
 
-def create_stg_endereco(conn_dw):
+
+def create_stg_endereco(conn_dw, method='auto'):
     start = time.time()
     dwt.create_stage(
         conn_input=conn_dw,
@@ -116,27 +214,75 @@ def create_stg_endereco(conn_dw):
         schema_in='public',
         table='ENDERECO',
         stg_name='stg_endereco',
-        tbl_exists='replace'
-
+        tbl_exists='replace',
+        method=method,
+        dtype=stage_data_types['stg_endereco'],
+        fingerprint=True,
+        snapshot=True
     )
     exec_time = time.time() - start
     print(f'tempo de execução da stage STG_ENDERECO: {exec_time:.4f}')
 
+    return exec_time
+
+
+def run_stages(conn_dw, workers=4, method='auto', full_refresh=False):
+    """
+    Cria todas as stages em paralelo
+
+    parâmetros:
+    conn_dw -- conexão criada via SqlAlchemy com o servidor DW. O pool deve ter
+               pelo menos 2 * workers conexões (o modo 'copy' usa uma conexão
+               de leitura e uma de escrita por tabela);
+    workers -- quantidade de stages criadas ao mesmo tempo;
+    method -- modo de cópia repassado ao create_stage;
+    full_refresh -- recria as stages incrementais;
+
+    return:
+    timings -- dicionário stage -> tempo de execução em segundos;
+    """
+    stages = {
+        'stg_venda': lambda: create_stg_venda(conn_dw, method=method, full_refresh=full_refresh),
+        'stg_item_venda': lambda: create_stg_item_venda(conn_dw, method=method, full_refresh=full_refresh),
+        'stg_funcionario': lambda: create_stg_funcionario(conn_dw, method=method),
+        'stg_forma_pagamento': lambda: create_stg_forma_pagamento(conn_dw, method=method),
+        'stg_produto': lambda: create_stg_produto(conn_dw, method=method),
+        'stg_loja': lambda: create_stg_loja(conn_dw, method=method),
+        'stg_cliente': lambda: create_stg_cliente(conn_dw, method=method),
+        'stg_endereco': lambda: create_stg_endereco(conn_dw, method=method)
+    }
+
+    dwt.create_control_table(conn_dw)
+
+    start = time.time()
+    timings = dict()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(stage): name for name, stage in stages.items()}
+        for future in as_completed(futures):
+            timings[futures[future]] = future.result()
+    exec_time = time.time() - start
+
+    for name, stage_time in sorted(timings.items(), key=lambda x: x[1], reverse=True):
+        print(f'{name}: {stage_time:.4f}')
+    print(f'tempo total de execução das stages: {exec_time:.4f} '
+          f'(soma das stages: {sum(timings.values()):.4f})')
+
+    return timings
+
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--full-refresh', action='store_true')
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
     conn_dw = create_connection_postgre(
         server="192.168.3.2",
         database="projeto_dw_vendas",
         username="itix",
         password="itix123",
-        port="5432"
+        port="5432",
+        pool_size=2 * args.workers
     )
 
-    create_stg_venda(conn_dw)
-    create_stg_funcionario(conn_dw)
-    create_stg_forma_pagamento(conn_dw)
-    create_stg_item_venda(conn_dw)
-    create_stg_produto(conn_dw)
-    create_stg_loja(conn_dw)
-    create_stg_cliente(conn_dw)
-    create_stg_endereco(conn_dw)
\ No newline at end of file
+    run_stages(conn_dw, workers=args.workers, full_refresh=args.full_refresh)
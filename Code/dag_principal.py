@@ -10,6 +10,7 @@ from D_PRODUTO import run_dim_produto
 from F_VENDA import run_fact_venda
 from CONEXAO import create_connection_postgre
 import DW_TOOLS as dwt
+from STAGES import stage_data_types
 
 conn_dw = create_connection_postgre(
     server="192.168.3.2",
@@ -22,151 +23,194 @@ conn_dw = create_connection_postgre(
 with DAG("dag_principal",
          start_date=datetime(2021, 7, 28),
          schedule_interval="@daily", catchup=False) as dag:
+    create_control_table = PythonOperator(
+        task_id='create_control_table',
+        python_callable=dwt.create_control_table,
+        op_kwargs={'conn': conn_dw}
+    )
+
     create_stg_cliente = PythonOperator(
         task_id='create_stg_cliente',
         python_callable=dwt.create_stage,
-        op_args={
+        op_kwargs={
             'conn_input': conn_dw,
             'conn_output': conn_dw,
             'schema_in': 'public',
-            'table': 'PRODUTO',
-            'stg_name': 'STG_PRODUTO',
-            'tbl_exists': 'replace'
+            'table': 'CLIENTE',
+            'stg_name': 'stg_cliente',
+            'tbl_exists': 'replace',
+            'method': 'auto',
+            'dtype': stage_data_types['stg_cliente'],
+            'fingerprint': True,
+            'snapshot': True
         }
     )
 
     create_stg_forma_pagamento = PythonOperator(
         task_id='create_stg_forma_pagamento',
         python_callable=dwt.create_stage,
-        op_args={
+        op_kwargs={
             'conn_input': conn_dw,
             'conn_output': conn_dw,
             'schema_in': 'public',
             'table': 'FORMA_PAGAMENTO',
-            'stg_name': 'STG_FORMA_PAGAMENTO',
-            'tbl_exists': 'replace'
+            'stg_name': 'stg_forma_pagamento',
+            'tbl_exists': 'replace',
+            'method': 'auto',
+            'dtype': stage_data_types['stg_forma_pagamento'],
+            'fingerprint': True,
+            'snapshot': True
         }
     )
 
     create_stg_funcionario = PythonOperator(
         task_id='create_stg_funcionario',
         python_callable=dwt.create_stage,
-        op_args={
+        op_kwargs={
             'conn_input': conn_dw,
             'conn_output': conn_dw,
             'schema_in': 'public',
             'table': 'FUNCIONARIO',
-            'stg_name': 'STG_FUNCIONARIO',
-            'tbl_exists': 'replace'
+            'stg_name': 'stg_funcionario',
+            'tbl_exists': 'replace',
+            'method': 'auto',
+            'dtype': stage_data_types['stg_funcionario'],
+            'fingerprint': True,
+            'snapshot': True
         }
     )
 
     create_stg_endereco = PythonOperator(
         task_id='create_stg_endereco',
         python_callable=dwt.create_stage,
-        op_args={
+        op_kwargs={
             'conn_input': conn_dw,
             'conn_output': conn_dw,
             'schema_in': 'public',
             'table': 'ENDERECO',
-            'stg_name': 'STG_ENDERECO',
-            'tbl_exists': 'replace'
+            'stg_name': 'stg_endereco',
+            'tbl_exists': 'replace',
+            'method': 'auto',
+            'dtype': stage_data_types['stg_endereco'],
+            'fingerprint': True,
+            'snapshot': True
         }
     )
 
     create_stg_loja = PythonOperator(
         task_id='create_stg_loja',
         python_callable=dwt.create_stage,
-        op_args={
+        op_kwargs={
             'conn_input': conn_dw,
             'conn_output': conn_dw,
             'schema_in': 'public',
             'table': 'LOJA',
-            'stg_name': 'STG_LOJA',
-            'tbl_exists': 'replace'}
+            'stg_name': 'stg_loja',
+            'tbl_exists': 'replace',
+            'method': 'auto',
+            'dtype': stage_data_types['stg_loja'],
+            'fingerprint': True,
+            'snapshot': True
+        }
     )
 
     create_stg_produto = PythonOperator(
         task_id='create_stg_produto',
         python_callable=dwt.create_stage,
-        op_args={
+        op_kwargs={
             'conn_input': conn_dw,
             'conn_output': conn_dw,
             'schema_in': 'public',
             'table': 'PRODUTO',
-            'stg_name': 'STG_PRODUTO',
-            'tbl_exists': 'replace'
+            'stg_name': 'stg_produto',
+            'tbl_exists': 'replace',
+            'method': 'auto',
+            'dtype': stage_data_types['stg_produto'],
+            'fingerprint': True,
+            'snapshot': True
         }
     )
 
     create_stg_venda = PythonOperator(
         task_id='create_stg_venda',
         python_callable=dwt.create_stage,
-        op_args={
+        op_kwargs={
             'conn_input': conn_dw,
             'conn_output': conn_dw,
             'schema_in': 'public',
             'table': 'VENDA',
-            'stg_name': 'STG_VENDA',
-            'tbl_exists': 'replace'
+            'stg_name': 'stg_venda',
+            'tbl_exists': 'append',
+            'method': 'auto',
+            'dtype': stage_data_types['stg_venda'],
+            'watermark': 'id_venda',
+            'full_refresh': False
         }
     )
 
     create_stg_item_venda = PythonOperator(
         task_id='create_stg_item_venda',
         python_callable=dwt.create_stage,
-        op_args={
+        op_kwargs={
             'conn_input': conn_dw,
             'conn_output': conn_dw,
             'schema_in': 'public',
             'table': 'ITEM_VENDA',
-            'stg_name': 'STG_ITEM_VENDA',
-            'tbl_exists': 'replace'
+            'stg_name': 'stg_item_venda',
+            'tbl_exists': 'append',
+            'method': 'auto',
+            'dtype': stage_data_types['stg_item_venda'],
+            'watermark': 'id_venda',
+            'full_refresh': False
         }
     )
 
     task_run_dim_cliente = PythonOperator(
         task_id="run_dim_cliente",
         python_callable=run_dim_cliente,
-        op_args={'conn': conn_dw}
+        op_kwargs={'conn': conn_dw}
     )
 
     task_run_dim_funcionario = PythonOperator(
         task_id="run_dim_funcionario",
         python_callable=run_dim_funcionario,
-        op_args={'conn': conn_dw}
+        op_kwargs={'conn': conn_dw}
     )
 
     task_run_dim_data = PythonOperator(
         task_id='run_dim_data',
         python_callable=run_dim_data,
-        op_args={'conn': conn_dw}
+        op_kwargs={'conn': conn_dw}
     )
 
     task_run_dim_loja = PythonOperator(
         task_id='run_dim_loja',
         python_callable=run_dim_loja,
-        op_args={'conn': conn_dw}
+        op_kwargs={'conn': conn_dw}
     )
 
     task_run_dim_forma_pagamento = PythonOperator(
         task_id='run_dim_forma_pagamento',
         python_callable=run_dim_forma_pagamento,
-        op_args={'conn': conn_dw}
+        op_kwargs={'conn': conn_dw}
     )
 
     task_run_dim_produto = PythonOperator(
         task_id='run_dim-produto',
         python_callable=run_dim_produto,
-        op_args={'conn': conn_dw}
+        op_kwargs={'conn': conn_dw}
     )
 
     task_run_fact_venda = PythonOperator(
         task_id='run_fact_venda',
         python_callable=run_fact_venda,
-        op_args={'conn': conn_dw}
+        op_kwargs={'conn': conn_dw}
     )
 
+    create_control_table >> [create_stg_cliente, create_stg_forma_pagamento, create_stg_funcionario,
+                             create_stg_endereco, create_stg_loja, create_stg_produto,
+                             create_stg_venda, create_stg_item_venda]
+
     [create_stg_endereco, create_stg_loja] >> task_run_dim_loja
 
     [create_stg_endereco, create_stg_cliente] >> task_run_dim_cliente
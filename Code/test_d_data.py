@@ -0,0 +1,19 @@
+import pandas as pd
+from D_DATA import calculate_sk_data, data_fim, data_inicio, treat_dim_data
+
+
+def test_calculate_sk_data_matches_dimension():
+    dim_data = treat_dim_data()
+    dim_data = dim_data[dim_data['sk_data'] > 0]
+
+    assert (calculate_sk_data(dim_data['dt_referencia']) == dim_data['sk_data'].to_numpy()).all()
+
+
+def test_calculate_sk_data_outside_dimension_is_unknown():
+    dates = [
+        pd.Timestamp(data_inicio) - pd.Timedelta(hours=1),
+        pd.Timestamp(data_fim) + pd.Timedelta(hours=1),
+        pd.NaT
+    ]
+
+    assert calculate_sk_data(dates).tolist() == [-3, -3, -3]
@@ -0,0 +1,117 @@
+import types
+import pandas as pd
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.types import Integer, String
+import DW_TOOLS as dwt
+
+
+def test_watermark_filters_compare_in_the_declared_type():
+    source, stage = dwt.watermark_filters(postgresql.dialect(), 'id_venda', '9999', dtype={'id_venda': Integer()})
+
+    assert source == 'CAST("id_venda" AS INTEGER) >= CAST(\'9999\' AS INTEGER)'
+    assert stage == 'CAST("id_venda" AS INTEGER) = CAST(\'9999\' AS INTEGER)'
+
+
+def test_watermark_filters_without_dtype_keep_the_raw_column():
+    source, stage = dwt.watermark_filters(postgresql.dialect(), 'id_venda', '9999')
+
+    assert source == '"id_venda" >= \'9999\''
+    assert stage == '"id_venda" = \'9999\''
+
+
+def test_layout_fingerprint_changes_with_the_declared_layout():
+    dialect = postgresql.dialect()
+    integer = dwt.layout_fingerprint(dialect, {'id_venda': Integer()})
+
+    assert dwt.layout_fingerprint(dialect, {'id_venda': Integer}) == integer
+    assert dwt.layout_fingerprint(dialect, {'id_venda': String()}) != integer
+    assert dwt.layout_fingerprint(dialect) != integer
+
+
+class FakeCursor:
+    def __init__(self):
+        self.copied = []
+
+    def copy_expert(self, sql, buffer):
+        self.copied.append(buffer.read())
+
+
+class FakeResult:
+    rowcount = 1
+
+
+def test_update_table_copies_nullable_integers_as_integers():
+    cursor = FakeCursor()
+    connection = types.SimpleNamespace(
+        execute=lambda sql: FakeResult(),
+        connection=types.SimpleNamespace(cursor=lambda: cursor)
+    )
+    df = pd.DataFrame({'cd_loja': [1, 2], 'cd_endereco_loja': [12, None]})
+
+    dwt.update_table(connection, df, 'dw', 'd_loja', key='cd_loja',
+                     dtype={'cd_loja': Integer(), 'cd_endereco_loja': Integer()})
+
+    assert cursor.copied == ['1,12\n2,\\N\n']
+
+
+def test_asof_join_sends_null_and_float_keys_to_default():
+    dim_loja = pd.DataFrame({
+        'cd_loja': [1, 2],
+        'sk_loja': [10, 20],
+        'dt_inicio': pd.to_datetime(['2020-01-01', '2020-01-01']),
+        'dt_fim': [None, None]
+    })
+    venda = pd.DataFrame({
+        'id_loja': [1.0, None, 2.0, 3.0],
+        'data_venda': pd.to_datetime(['2021-01-01'] * 4)
+    })
+
+    result = dwt.asof_join(venda, dim_loja, 'id_loja', 'cd_loja', 'data_venda', columns=['sk_loja'],
+                           default={'sk_loja': -3})
+
+    assert result['sk_loja'].tolist() == [10, -3, 20, -3]
+
+
+def test_create_stage_rebuilds_an_existing_stage_without_watermark(monkeypatch):
+    calls = []
+    monkeypatch.setattr(dwt, 'create_control_table', lambda conn: None)
+    monkeypatch.setattr(dwt, 'table_exists', lambda conn, schema, table_name: True)
+    monkeypatch.setattr(dwt, 'read_watermark', lambda conn, stg_name: None)
+    monkeypatch.setattr(dwt, 'server_stage', lambda **kwargs: calls.append(kwargs))
+
+    dwt.create_stage(None, None, 'public', 'VENDA', 'stg_venda', 'append', method='server', watermark='id_venda',
+                     dtype={'id_venda': Integer()})
+
+    assert calls[0]['tbl_exists'] == 'replace'
+    assert calls[0]['where'] is None
+    assert calls[0]['before'] == []
+
+
+def test_classify_scd_flags_only_the_row_without_hash():
+    stage = pd.DataFrame({'cd_loja': [1, 2], 'nm_loja': ['a', 'b'], 'ds_cidade': ['x', 'y']})
+    hashes = dwt.assign_row_hashes(stage, type1=['nm_loja'], type2=['ds_cidade'])
+    dim = hashes.filter(['cd_loja', 'nu_hash_tipo1', 'nu_hash_tipo2']).assign(fl_inferido=0)
+    dim.loc[1, ['nu_hash_tipo1', 'nu_hash_tipo2']] = 0
+
+    result = dwt.classify_scd(stage, dim, 'cd_loja', type1=['nm_loja'], type2=['ds_cidade'])
+
+    assert result['fl_tipo1'].tolist() == [False, True]
+    assert result['fl_tipo2'].tolist() == [False, True]
+
+
+def test_read_table_ranges_keeps_dtypes_with_an_empty_range(monkeypatch):
+    class FakeConnection:
+        def execute(self, sql):
+            return types.SimpleNamespace(fetchone=lambda: (1, 8))
+
+    def read_table(conn, schema, table_name, where=None, **kwargs):
+        if '"id_venda" >= 1 ' in where:
+            return pd.DataFrame({'id_venda': pd.Series([1, 2], dtype='int64')})
+        return pd.DataFrame({'id_venda': pd.Series([], dtype='object')})
+
+    monkeypatch.setattr(dwt, 'read_table', read_table)
+
+    result = dwt.read_table_ranges(FakeConnection(), 'stage', 'stg_item_venda', key='id_venda', partitions=2)
+
+    assert result['id_venda'].dtype == 'int64'
+    assert result['id_venda'].tolist() == [1, 2]
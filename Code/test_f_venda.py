@@ -0,0 +1,84 @@
+import contextlib
+import pandas as pd
+import DW_TOOLS as dwt
+import F_VENDA
+
+
+class FakeConnection:
+    """
+    Conexão falsa que apenas registra os comandos sql executados
+    """
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, sql):
+        self.statements.append(sql)
+
+    @contextlib.contextmanager
+    def begin(self):
+        self.statements.append('BEGIN')
+        yield self
+        self.statements.append('COMMIT')
+
+
+def test_rebuild_fact_month_swaps_partition_and_aggregates(monkeypatch):
+    conn = FakeConnection()
+    loaded = []
+
+    monkeypatch.setattr(F_VENDA, 'create_venda_aggregates', lambda conn: None)
+    monkeypatch.setattr(dwt, 'table_exists', lambda conn, schema, table_name: True)
+    monkeypatch.setattr(dwt, 'load_table', lambda df, conn, schema, table_name, **kwargs: loaded.append(
+        (table_name, df['sk_dt_venda'].tolist())))
+    monkeypatch.setattr(F_VENDA, 'replace_month_aggregates', lambda connection, fact_venda, month:
+                        connection.statements.append(f'AGGREGATES {month}'))
+
+    start, end = F_VENDA.month_bounds(pd.Period('2021-03', freq='M'))
+    fact_venda = pd.DataFrame({column: [1, 1] for column in F_VENDA.data_type}).assign(
+        sk_dt_venda=[start + 30, start + 2])
+
+    F_VENDA.rebuild_fact_month(fact_venda, conn, '2021-03')
+
+    assert loaded == [('f_venda_2021_03_new', [start + 2, start + 30])]
+    swap = conn.statements[conn.statements.index('BEGIN'):]
+    assert swap[1] == 'AGGREGATES 2021-03'
+    assert 'DETACH PARTITION "dw"."f_venda_2021_03"' in swap[2]
+    assert swap[-2].endswith(f'FOR VALUES FROM ({start}) TO ({end})')
+    assert swap[-1] == 'COMMIT'
+
+
+def test_replace_month_aggregates_recomputes_the_month(monkeypatch):
+    connection = FakeConnection()
+    added = []
+    monkeypatch.setattr(F_VENDA, 'update_venda_aggregates', lambda fact_venda, connection: added.append(
+        (len(connection.statements), len(fact_venda))))
+
+    month = pd.Period('2021-03', freq='M')
+    start, end = F_VENDA.month_bounds(month)
+    F_VENDA.replace_month_aggregates(connection, pd.DataFrame({'sk_dt_venda': [start]}), month)
+
+    assert connection.statements == [
+        f'DELETE FROM "dw"."{table_name}" WHERE "sk_dt_venda" >= {start} AND "sk_dt_venda" < {end}'
+        for table_name in ['a_venda_dia', 'a_venda_mes']
+    ]
+    assert added == [(2, 1)]
+
+
+def test_month_filters_cover_each_month_and_the_default_partition():
+    filters = F_VENDA.month_filters(pd.period_range('2021-12', '2022-01', freq='M'))
+
+    assert filters[:2] == [
+        '"data_venda" >= TIMESTAMP \'2021-12-01\' AND "data_venda" < TIMESTAMP \'2022-01-01\'',
+        '"data_venda" >= TIMESTAMP \'2022-01-01\' AND "data_venda" < TIMESTAMP \'2022-02-01\''
+    ]
+    assert filters[2].startswith('NOT COALESCE(')
+    assert len(filters) == 3
+
+
+def test_venda_boundary_reads_the_registered_watermark(monkeypatch):
+    monkeypatch.setattr(dwt, 'table_exists', lambda conn, schema, table_name: True)
+    monkeypatch.setattr(dwt, 'read_watermark', lambda conn, stg_name, schema='stage': '42')
+
+    boundary = F_VENDA.venda_boundary(FakeConnection())
+
+    assert boundary == 42
+    assert F_VENDA.new_venda_filter(boundary) == '"stg_venda"."id_venda" >= 42'